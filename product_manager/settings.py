@@ -40,8 +40,13 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
 ]
-SIMPLE_JWT = {"ACCESS_TOKEN_LIFETIME": timedelta(minutes=130)}
+SIMPLE_JWT = {
+    "ACCESS_TOKEN_LIFETIME": timedelta(minutes=130),
+    "TOKEN_REFRESH_SERIALIZER": "products.serializers.TokenRefreshSerializer",
+    "TOKEN_BLACKLIST_SERIALIZER": "products.serializers.TokenBlacklistSerializer",
+}
 MIDDLEWARE = [
+    'products.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,13 +80,36 @@ WSGI_APPLICATION = 'product_manager.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Connections are kept open for CONN_MAX_AGE seconds and tuned with
+# SQLITE_PRAGMAS when opened (see products/db.py). 'read' is a query-only
+# connection to the same file that ReadWriteRouter uses for read-only views.
+# Tests use a file too: the default in-memory test database shares one cache
+# between connections, whose table locks don't behave like SQLite's file locks.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    },
+    'read': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+DATABASE_ROUTERS = ['products.db.ReadWriteRouter']
+
+# Overrides of the pragmas applied to every new SQLite connection. The
+# defaults (WAL journal, synchronous=NORMAL, 256 MB mmap, 64 MB page cache,
+# 5 s busy_timeout) are SQLITE_PRAGMA_DEFAULTS in products/db.py, e.g.
+# {'busy_timeout': 10000} waits longer for the write lock.
+SQLITE_PRAGMAS = {}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -126,7 +154,98 @@ REST_FRAMEWORK = {
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
 
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'products.authentication.CachedJWTAuthentication',
     )
 
 }
+
+# In-process cache of authenticated users (see products/authentication.py).
+# Entries expire after TTL seconds; saves and logouts in other processes are
+# only seen once the entry expires there.
+JWT_USER_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+}
+
+# In-process product name index behind /api/product/suggest/ (see
+# products/suggest.py). Product writes made by other processes are picked up by
+# a reload, checked for at most every SYNC_INTERVAL seconds.
+PRODUCT_SUGGEST_INDEX = {
+    'SYNC_INTERVAL': 5,
+}
+
+# Bloom filter over blacklisted refresh tokens (see products/blacklist.py).
+# Refreshes only query the blacklist tables on a filter hit. Blacklistings
+# made by other processes are synced every SYNC_INTERVAL seconds; each sync
+# re-reads the last SYNC_OVERLAP ids to catch rows that committed out of order.
+JWT_BLACKLIST_FILTER = {
+    'CAPACITY': 100000,
+    'ERROR_RATE': 0.001,
+    'SYNC_INTERVAL': 5,
+    'SYNC_OVERLAP': 100,
+}
+
+# Serve /api/product/search/ from the SQLite FTS5 index when it exists
+# (see products/search.py). Set to False to always use name__icontains.
+PRODUCT_SEARCH_FTS = True
+
+# Serialize search pages from values_list() rows with products.encoders.RowEncoder
+# instead of ProductSerializer. The JSON output is identical.
+PRODUCT_SEARCH_FAST_PATH = False
+
+# Search result cache (see products/cache.py). Entries are keyed on a catalog
+# version that every Product write bumps; use a shared cache backend to share
+# both the entries and the version between processes.
+PRODUCT_SEARCH_CACHE = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'TIMEOUT': 60,
+    'LOCAL_SIZE': 1024,
+}
+
+# Per-request timings (products/middleware.py), exposed at /api/metrics and,
+# with SERVER_TIMING, in a Server-Timing response header. /api/metrics is
+# readable by staff users and, without a token, from ALLOWED_IPS (e.g. the
+# Prometheus server's address).
+REQUEST_METRICS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'ALLOWED_IPS': [],
+}
+
+# Per-user session snapshots served by /api/session/restore/ (see
+# products/snapshots.py). The last search is cached in ALIAS and saved to the
+# database after the response, in one write per PERSIST_INTERVAL seconds per
+# process. The selected product ids are only cached and are re-read with one
+# query whenever the cache misses. Snapshots older than TIMEOUT seconds are
+# ignored.
+SESSION_SNAPSHOT = {
+    'ALIAS': 'default',
+    'TIMEOUT': 30 * 24 * 60 * 60,
+    'PERSIST_INTERVAL': 5,
+}
+
+# Stock reservations (products/stock.py). Product.stock of a sharded product is
+# refreshed from its shards at most every SHARD_REFRESH_INTERVAL seconds per
+# process.
+STOCK_RESERVATION = {
+    'SHARD_REFRESH_INTERVAL': 1.0,
+}
+
+# Write-behind select/deselect (products/writebehind.py). When enabled, toggles
+# are answered with 202, queued per process (at most MAX_PENDING) and written
+# in one transaction every FLUSH_INTERVAL seconds or once BATCH_SIZE are queued.
+SELECTION_WRITE_BEHIND = {
+    'ENABLED': False,
+    'MAX_PENDING': 10000,
+    'BATCH_SIZE': 1000,
+    'FLUSH_INTERVAL': 0.5,
+}
+
+# Single-flight search (products/singleflight.py): identical concurrent search
+# pages and facet counts are computed once per process; the other requests wait
+# up to TIMEOUT seconds for that result before computing it themselves.
+SEARCH_SINGLE_FLIGHT = {
+    'ENABLED': True,
+    'TIMEOUT': 10,
+}
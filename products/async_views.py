@@ -0,0 +1,303 @@
+"""
+Native async versions of the read-heavy and selection endpoints.
+
+These run directly on the event loop under ``product_manager.asgi``: queries
+go through Django's async ORM (``aget``, ``aget_or_create``, ``async for``) and
+authentication resolves the user from the in-process cache or with
+``aget()``, so no request holds a worker thread while it waits. Django's
+cache API is synchronous (the version counters behind cache keys and ETags
+included), so those calls run through ``sync_to_async`` as well. The views
+mirror the payloads of their REST framework counterparts in ``products.views``.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.exceptions import NotAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+
+from product_manager.utils import create_json_response
+from products.authentication import CachedJWTAuthentication
+from products.cache import search_cache
+from products.db import read_database
+from products.etags import not_modified
+from products.etags import search_etag
+from products.etags import user_products_etag
+from products.metrics import timed
+from products.models import Product
+from products.models import ProductSelection
+from products.pagination import KeysetPagination
+from products.renderers import EnvelopeJSONRenderer
+from products.search import aproduct_facets
+from products.search import build_search_queryset
+from products.search import filter_products
+from products.search import fts_checked
+from products.search import fts_enabled
+from products.selections import create_selection
+from products.selections import deselect_selection
+from products.selections import user_selections
+from products.serializers import ProductSearchFilterSerializer
+from products.serializers import ProductSerializer
+from products.serializers import UserProductSelectionSerializer
+from products.singleflight import async_facets_flight
+from products.singleflight import async_search_flight
+from products.snapshots import arecord_search
+from products.snapshots import selected_product_ids
+from products.views import mark_selected
+from products.views import product_row_encoder
+from products.views import row_columns
+from products.writebehind import overlay_selected_ids
+from products.writebehind import overlay_user_products
+from products.writebehind import queue_selection_toggle
+from products.writebehind import selection_buffer
+
+
+class AsyncAPIView(View):
+    """
+    Base class for async JSON endpoints authenticated with a JWT access token.
+
+    Like REST framework's APIView it is CSRF exempt and answers unauthenticated
+    requests with 401 and the authentication error payload.
+    """
+    authentication = CachedJWTAuthentication()
+    renderer = EnvelopeJSONRenderer()
+    # Route the view's reads to the read database (see products.db). Only for views that never write.
+    read_only = False
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        if method not in self.http_method_names or not hasattr(self, method):
+            return await self.http_method_not_allowed(request, *args, **kwargs)
+
+        if self.read_only:
+            with read_database():
+                return await self.handle(request, method, *args, **kwargs)
+        return await self.handle(request, method, *args, **kwargs)
+
+    async def handle(self, request, method, *args, **kwargs):
+        try:
+            result = await self.authentication.aauthenticate(request)
+            if result is None:
+                raise NotAuthenticated()
+        except APIException as exc:
+            return self.error_response(request, exc)
+        request.user, request.auth = result
+
+        try:
+            return await getattr(self, method)(request, *args, **kwargs)
+        except APIException as exc:
+            return self.error_response(request, exc)
+
+    def json_response(self, data, status=status.HTTP_200_OK):
+        with timed('serialize'):
+            content = self.renderer.render(data)
+        return HttpResponse(content, status=status, content_type=self.renderer.media_type)
+
+    def error_response(self, request, exc):
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        response = self.json_response(data, status=exc.status_code)
+        if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+            response['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+        return response
+
+
+class AsyncProductSearchView(AsyncAPIView):
+    """
+    Async counterpart of ProductSearchView.
+
+    Request method: GET
+    Endpoint: /api/async/product/search/
+
+    Accepts the same query, sort_by, sort_order, page_size, cursor, filter, facets and include_selected
+    parameters and returns the same paginated payload. Streaming is only offered by the synchronous endpoint.
+    """
+    pagination_class = KeysetPagination
+    read_only = True
+
+    async def get(self, request, *args, **kwargs):
+        etag = await sync_to_async(search_etag)(request.GET, self.renderer.media_type, request.user.id)
+        response = not_modified(request, etag)
+        if response is not None:
+            if response.status_code == status.HTTP_304_NOT_MODIFIED:
+                # A revalidated page is still the page the user is on.
+                await arecord_search(request.user.id, request.GET)
+            return response
+        response = await self.search(request)
+        if response.status_code == 200:
+            response['ETag'] = etag
+        return response
+
+    async def search(self, request):
+        try:
+            params = request.GET
+            filters = self.get_filters(params)
+            queryset = await self.get_queryset(params, filters)
+            paginator = self.pagination_class()
+            fast_path = getattr(settings, 'PRODUCT_SEARCH_FAST_PATH', False)
+            cache_key, payload = await sync_to_async(self.get_cached)(
+                search_cache.make_search_key, params, paginator.get_page_size(Request(request)), fast_path)
+            if payload is None:
+                payload = await async_search_flight.do(
+                    cache_key, lambda: self.get_payload(request, queryset, paginator, fast_path, cache_key))
+            await arecord_search(request.user.id, params)
+            if filters['include_selected']:
+                selected_ids = overlay_selected_ids(request.user.id,
+                                                    await sync_to_async(selected_product_ids)(request.user.id))
+                payload = mark_selected(payload, frozenset(selected_ids))
+            if filters['facets']:
+                payload = dict(payload, facets=await self.get_facets(params, queryset))
+            return self.json_response(payload)
+        except ValidationError as e:
+            return self.json_response(dict(error=e.detail), status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return self.json_response(dict(error=str(e)), status=status.HTTP_400_BAD_REQUEST)
+
+    def get_filters(self, params):
+        serializer = ProductSearchFilterSerializer(data=params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def get_cached(self, make_key, *args):
+        """
+        The cache key built by ``make_key(*args)`` and its cached value, if any.
+
+        Keys embed version counters, so building one reads the cache just like
+        looking it up; callers run this with ``sync_to_async``.
+        """
+        key = make_key(*args)
+        return key, search_cache.get(key) if search_cache.enabled else None
+
+    async def get_queryset(self, params, filters):
+        # Only the first search may introspect the schema; afterwards fts_enabled() is a dict lookup.
+        if not fts_checked():
+            await sync_to_async(fts_enabled)()
+        return build_search_queryset(filter_products(Product.objects.all(), filters), params.get('query', ''),
+                                     params.get('sort_by', 'name'), params.get('sort_order', 'asc'),
+                                     ProductSerializer.Meta.fields)
+
+    async def get_payload(self, request, queryset, paginator, fast_path, cache_key):
+        if fast_path:
+            queryset = queryset.values_list(*row_columns(queryset), named=True)
+
+        page = paginator.finish_page([row async for row in paginator.prepare_page(queryset, Request(request))])
+        with timed('serialize'):
+            data = product_row_encoder.encode_many(page) if fast_path else ProductSerializer(page, many=True).data
+        payload = paginator.get_paginated_payload(data, message="Products Overview")
+        if search_cache.enabled:
+            await sync_to_async(search_cache.set)(cache_key, payload)
+        return payload
+
+    async def get_facets(self, params, queryset):
+        cache_key, facets = await sync_to_async(self.get_cached)(search_cache.make_facets_key, params)
+        if facets is None:
+            facets = await async_facets_flight.do(cache_key, lambda: self.compute_facets(queryset, cache_key))
+        return facets
+
+    async def compute_facets(self, queryset, cache_key):
+        facets = await aproduct_facets(queryset)
+        if search_cache.enabled:
+            await sync_to_async(search_cache.set)(cache_key, facets)
+        return facets
+
+
+class AsyncUserProductListView(AsyncAPIView):
+    """
+    Async counterpart of UserProductListView.
+
+    Request method: GET
+    Endpoint: /api/async/user/products/
+    """
+    pagination_class = KeysetPagination
+    read_only = True
+
+    async def get(self, request, *args, **kwargs):
+        etag = await sync_to_async(user_products_etag)(request.user.id, request.GET, self.renderer.media_type)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        paginator = self.pagination_class()
+        queryset = paginator.prepare_page(user_selections(request.user.id), Request(request))
+        page = paginator.finish_page([selection async for selection in queryset])
+        with timed('serialize'):
+            data = UserProductSelectionSerializer(page, many=True).data
+        if selection_buffer.pending_for(request.user.id):
+            # Only then does the overlay query the database.
+            data = await sync_to_async(overlay_user_products)(request.user.id, data,
+                                                              last_page=paginator.next_cursor is None)
+        response = self.json_response(
+            paginator.get_paginated_payload(data, message=f"Products of user {request.user.username}"))
+        response['ETag'] = etag
+        return response
+
+
+class AsyncProductSelectView(AsyncAPIView):
+    """
+    Async counterpart of ProductSelectViewSet's select (POST) and deselect (PUT) actions.
+
+    Endpoint: /api/async/product/{id}/select/
+    """
+
+    async def post(self, request, pk=None):
+        try:
+            if selection_buffer.enabled:
+                response = await self.queue_toggle(request, pk, selected=True)
+                if response is not None:
+                    return response
+
+            if not await Product.objects.filter(pk=pk).aexists():
+                raise Product.DoesNotExist
+            selection, changed = await sync_to_async(create_selection)(request.user.id, pk)
+            if not changed:
+                return self.json_response(create_json_response(
+                    status=True, message=f"Product Selected by user {request.user.username} again"))
+            return self.json_response(
+                create_json_response(status=True, message=f"Product Selected by user {request.user.username}",
+                                     data=self.selection_data(selection)))
+        except Product.DoesNotExist:
+            return self.json_response(create_json_response(status=False, message="Product doesnt exist"),
+                                      status=status.HTTP_404_NOT_FOUND)
+        except Exception:
+            return self.json_response(create_json_response(status=False, message="General Error on Select API"),
+                                      status=status.HTTP_400_BAD_REQUEST)
+
+    async def put(self, request, pk=None):
+        try:
+            if selection_buffer.enabled:
+                response = await self.queue_toggle(request, pk, selected=False)
+                if response is not None:
+                    return response
+
+            selection = await ProductSelection.objects.aget(user_id=request.user.id, product_id=pk)
+            # The count update needs a transaction, which the async ORM doesn't offer.
+            await sync_to_async(deselect_selection)(selection)
+            return self.json_response(
+                create_json_response(status=True, message=f"Product Deselected by user {request.user.username}",
+                                     data=self.selection_data(selection)))
+        except ProductSelection.DoesNotExist:
+            return self.json_response(create_json_response(status=False, message="Product selection doesn't exist"),
+                                      status=status.HTTP_404_NOT_FOUND)
+        except Exception:
+            return self.json_response(create_json_response(status=False, message="General Error on Deselect API"),
+                                      status=status.HTTP_400_BAD_REQUEST)
+
+    async def queue_toggle(self, request, pk, selected):
+        """ProductSelectViewSet.queue_toggle(): 202 Accepted once queued, None when the buffer is full."""
+        if not await sync_to_async(queue_selection_toggle)(request.user.id, pk, selected):
+            return None
+        verb = "Selected" if selected else "Deselected"
+        return self.json_response(
+            create_json_response(status=True, message=f"Product {verb} by user {request.user.username}",
+                                 data=dict(user=request.user.id, product=pk, selected=selected)),
+            status=status.HTTP_202_ACCEPTED)
+
+    def selection_data(self, selection):
+        return dict(user=selection.user_id, product=selection.product_id, selected=selection.selected)
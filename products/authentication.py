@@ -0,0 +1,105 @@
+import copy
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from products.cache import LRUCache
+from products.metrics import timed
+
+JWT_USER_CACHE_DEFAULTS = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+}
+
+
+def get_user_cache_settings():
+    return {**JWT_USER_CACHE_DEFAULTS, **getattr(settings, 'JWT_USER_CACHE', {})}
+
+
+class UserCache(LRUCache):
+    """LRUCache that takes its size and TTL from ``get_user_cache_settings()`` whenever an entry is added."""
+
+    def __init__(self):
+        super().__init__(JWT_USER_CACHE_DEFAULTS['MAX_SIZE'], ttl=JWT_USER_CACHE_DEFAULTS['TTL'])
+
+    def set(self, key, value):
+        config = get_user_cache_settings()
+        self.maxsize, self.ttl = config['MAX_SIZE'], config['TTL']
+        super().set(key, value)
+
+
+# user id claim -> active User, per process.
+user_cache = UserCache()
+
+
+def invalidate_user(user_id):
+    user_cache.delete(user_id)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves users through a bounded in-process LRU cache.
+
+    A cache hit costs no query. Entries expire after ``JWT_USER_CACHE['TTL']``
+    seconds and are dropped when the user is saved or deleted (see
+    ``products.signals``) and when one of their refresh tokens is blacklisted
+    on logout. Inactive or missing users are never cached, so they keep
+    failing authentication exactly as with JWTAuthentication.
+    """
+
+    def authenticate(self, request):
+        with timed('auth'):
+            return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+        # Requests get their own copy, so per-request attributes never leak into the cache.
+        return copy.copy(user)
+
+    async def aauthenticate(self, request):
+        """
+        ``authenticate()`` for async views.
+
+        Token validation is pure computation; a user cache miss is resolved
+        with ``aget()``, so the event loop never blocks on a sync query.
+        """
+        with timed('auth'):
+            header = self.get_header(request)
+            if header is None:
+                return None
+
+            raw_token = self.get_raw_token(header)
+            if raw_token is None:
+                return None
+
+            validated_token = self.get_validated_token(raw_token)
+
+            return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        user = user_cache.get(user_id)
+        if user is None:
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+            if not user.is_active:
+                raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+            user_cache.set(user_id, user)
+        return copy.copy(user)
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
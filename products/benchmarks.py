@@ -0,0 +1,446 @@
+"""
+Load and latency benchmarks for the API.
+
+``seed_catalog`` fills the configured database with a reproducible catalog
+and a set of benchmark users with random selections. ``run_benchmark`` then
+drives each route either through Django's in-process test client (which
+also counts database queries per request) or over HTTP against a running
+server with several concurrent workers. The ``benchmark`` management
+command wraps both and prints the results as JSON, so runs can be compared
+across commits.
+"""
+import itertools
+import json
+import math
+import platform
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db import connections
+from django.db import transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from products.cache import get_search_cache_settings
+from products.models import Product
+from products.models import ProductSelection
+from products.selections import reconcile_selection_counts
+from products.signals import products_bulk_saved
+from products.stock import available_stock
+from products.stock import shard_stock
+
+CATALOG_SIZES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+
+BENCHMARK_USER_PREFIX = 'bench-user-'
+BENCHMARK_PASSWORD = 'bench-password'
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliett',
+         'kilo', 'lima', 'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango']
+
+
+def parse_catalog_size(value):
+    """Accept a named catalog size (``1k``, ``100k``, ``1m``) or a plain number of products."""
+    size = CATALOG_SIZES.get(str(value).lower())
+    if size is None:
+        size = int(value)
+    if size < 0:
+        raise ValueError(f"Invalid catalog size: {value}")
+    return size
+
+
+def seed_catalog(products, users, selections, seed=0, batch_size=5000):
+    """
+    Make sure the database holds at least ``products`` products and ``users`` benchmark users.
+
+    Each benchmark user that is created gets ``selections`` random product
+    selections. Existing rows are kept, so seeding is cheap when the catalog is
+    already the requested size. The same ``seed`` produces the same catalog.
+    Returns the number of products, users and selections created.
+    """
+    rng = random.Random(seed)
+    created = dict(products=0, users=0, selections=0)
+
+    existing = Product.objects.count()
+    for start in range(existing, products, batch_size):
+        batch = [
+            Product(name=f'{rng.choice(WORDS)} {rng.choice(WORDS)} {index}',
+                    description=' '.join(rng.choices(WORDS, k=8)),
+                    price=Decimal(rng.randrange(100, 100000)) / 100, stock=rng.randrange(0, 500))
+            for index in range(start, min(start + batch_size, products))
+        ]
+        with transaction.atomic():
+            batch = Product.objects.bulk_create(batch)
+            products_bulk_saved.send(sender=Product, products=batch, using=connection.alias)
+        created['products'] += len(batch)
+
+    usernames = [f'{BENCHMARK_USER_PREFIX}{index}' for index in range(users)]
+    missing = set(usernames) - set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    if missing:
+        # Hash once; every benchmark user shares the same password.
+        password = make_password(BENCHMARK_PASSWORD)
+        new_users = User.objects.bulk_create([
+            User(username=username, email=f'{username}@example.com', password=password)
+            for username in sorted(missing)
+        ])
+        created['users'] = len(new_users)
+
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        rows = [
+            ProductSelection(user_id=user.id, product_id=product_id, selected=True)
+            for user in User.objects.filter(username__in=missing).order_by('id')
+            for product_id in rng.sample(product_ids, min(selections, len(product_ids)))
+        ]
+        created['selections'] = len(ProductSelection.objects.bulk_create(rows, batch_size=batch_size,
+                                                                          ignore_conflicts=True))
+        reconcile_selection_counts()
+    return created
+
+
+class Route:
+    """
+    One benchmarked request.
+
+    ``path``, ``params`` and ``body`` are either values or callables taking the
+    BenchmarkContext, so every request can target a different product.
+    """
+
+    def __init__(self, name, method, path, params=None, body=None, auth=True):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.params = params
+        self.body = body
+        self.auth = auth
+
+    def build(self, context):
+        resolve = lambda value: value(context) if callable(value) else value
+        return resolve(self.path), resolve(self.params), resolve(self.body)
+
+
+ROUTES = [
+    Route('signup', 'post', '/api/auth/signup/', auth=False, body=lambda context: context.new_user()),
+    Route('login', 'post', '/api/auth/login/', auth=False, body=lambda context: context.credentials),
+    Route('refresh', 'post', '/api/auth/token/refresh/', auth=False,
+          body=lambda context: dict(refresh=context.refresh)),
+    Route('create', 'post', '/api/product/create/', body=lambda context: context.new_product()),
+    Route('search-name', 'get', '/api/product/search/', params=dict(sort_by='name')),
+    Route('search-price', 'get', '/api/product/search/', params=dict(sort_by='price', sort_order='desc')),
+    Route('search-stock', 'get', '/api/product/search/', params=dict(sort_by='stock')),
+    Route('search-query', 'get', '/api/product/search/', params=lambda context: dict(query=context.word())),
+    Route('search-relevance', 'get', '/api/product/search/',
+          params=lambda context: dict(query=context.word(), sort_by='relevance')),
+    Route('search-popularity', 'get', '/api/product/search/',
+          params=dict(sort_by='popularity', sort_order='desc')),
+    Route('search-async', 'get', '/api/async/product/search/', params=dict(sort_by='name')),
+    Route('suggest', 'get', '/api/product/suggest/', params=lambda context: dict(query=context.word()[:2])),
+    Route('select', 'post', lambda context: f'/api/product/{context.product_id()}/select/'),
+    Route('deselect', 'put', lambda context: f'/api/product/{context.selected_id()}/select/'),
+    Route('select-batch', 'post', '/api/product/select/batch/',
+          body=lambda context: dict(product_ids=[context.product_id() for _ in range(20)])),
+    Route('user-products', 'get', '/api/user/products/'),
+]
+
+
+class BenchmarkContext:
+    """State shared by the requests of one run: the benchmark user's tokens and the ids to pick from."""
+
+    def __init__(self, username, seed=0, sample_size=10000):
+        self.credentials = dict(username=username, password=BENCHMARK_PASSWORD)
+        self.access = self.refresh = None
+        self.run_id = uuid.uuid4().hex[:8]
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        self.product_ids = self._rng.sample(product_ids, min(sample_size, len(product_ids)))
+        self.selected_ids = list(ProductSelection.objects.filter(user__username=username)
+                                 .values_list('product_id', flat=True)[:sample_size])
+        if not self.product_ids:
+            raise ValueError("The catalog is empty; seed it first.")
+
+    def login(self, runner):
+        status, _, _, payload = runner.request('post', '/api/auth/login/', body=self.credentials)
+        if status != 200:
+            raise ValueError(f"Login as {self.credentials['username']} failed with status {status}.")
+        tokens = payload['data'][0]
+        self.access, self.refresh = tokens['access'], tokens['refresh']
+
+    def choice(self, values):
+        with self._lock:
+            return self._rng.choice(values)
+
+    def word(self):
+        return self.choice(WORDS)
+
+    def product_id(self):
+        return self.choice(self.product_ids)
+
+    def selected_id(self):
+        return self.choice(self.selected_ids or self.product_ids)
+
+    def new_user(self):
+        username = f'bench-signup-{self.run_id}-{next(self._counter)}'
+        return dict(username=username, email=f'{username}@example.com', password=BENCHMARK_PASSWORD)
+
+    def new_product(self):
+        return dict(name=f'{self.word()} benchmark {next(self._counter)}', description='created by benchmark',
+                    price='9.99', stock=10)
+
+
+class InProcessRunner:
+    """
+    Sends requests through Django's test client and counts the queries each one runs.
+
+    Queries are counted on every database alias, so reads routed to ``read``
+    count too. Each worker thread gets its own client, and so its own
+    database connections.
+    """
+    mode = 'inprocess'
+    counts_queries = True
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client()
+        return client
+
+    def request(self, method, path, params=None, body=None, token=None):
+        extra = dict(HTTP_AUTHORIZATION=f'Bearer {token}') if token else {}
+        if body is not None:
+            extra.update(data=json.dumps(body), content_type='application/json')
+        elif params:
+            extra.update(data=params)
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(alias_connection))
+                        for alias_connection in connections.all()]
+            started = time.perf_counter()
+            response = getattr(self.client, method)(path, **extra)
+            elapsed = time.perf_counter() - started
+        queries = sum(len(alias_captured) for alias_captured in captured)
+        return response.status_code, elapsed, queries, self.decode(response.content)
+
+    def decode(self, content):
+        try:
+            return json.loads(content)
+        except ValueError:
+            return None
+
+
+class HTTPRunner:
+    """Sends requests to a running server. Query counts aren't visible from outside the server."""
+    mode = 'http'
+    counts_queries = False
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, method, path, params=None, body=None, token=None):
+        url = self.base_url + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        headers = {'Accept': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(url, data=data, headers=headers, method=method.upper())
+
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, content = e.code, e.read()
+        elapsed = time.perf_counter() - started
+        try:
+            payload = json.loads(content)
+        except ValueError:
+            payload = None
+        return status, elapsed, None, payload
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, wall_time):
+    latencies = sorted(elapsed for _, elapsed, _ in samples)
+    queries = [count for _, _, count in samples if count is not None]
+    to_ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return dict(
+        requests=len(samples),
+        errors=sum(1 for status, _, _ in samples if status >= 400),
+        throughput_rps=round(len(samples) / wall_time, 2) if wall_time else None,
+        latency_ms=dict(
+            mean=to_ms(sum(latencies) / len(latencies)) if latencies else None,
+            p50=to_ms(percentile(latencies, 0.50)),
+            p95=to_ms(percentile(latencies, 0.95)),
+            p99=to_ms(percentile(latencies, 0.99)),
+            max=to_ms(latencies[-1]) if latencies else None,
+        ),
+        queries_per_request=round(sum(queries) / len(queries), 2) if queries else None,
+    )
+
+
+def run_route(route, runner, context, requests, warmup=0, concurrency=1):
+    def send(_):
+        path, params, body = route.build(context)
+        status, elapsed, queries, _ = runner.request(route.method, path, params=params, body=body,
+                                                     token=context.access if route.auth else None)
+        return status, elapsed, queries
+
+    for index in range(warmup):
+        send(index)
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(send, range(requests)))
+    else:
+        samples = [send(index) for index in range(requests)]
+    return summarize(samples, time.perf_counter() - started)
+
+
+def run_benchmark(runner, username, routes=None, requests=200, warmup=10, concurrency=1, seed=0):
+    """
+    Run every route in ``routes`` (names from ``ROUTES``; all by default) ``requests`` times.
+
+    Returns a JSON-serializable dict with the run's environment and, per route,
+    throughput, latency percentiles and (in-process only) queries per request.
+    """
+    selected = [route for route in ROUTES if routes is None or route.name in routes]
+    unknown = set(routes or []) - {route.name for route in ROUTES}
+    if unknown:
+        raise ValueError(f"Unknown routes: {', '.join(sorted(unknown))}")
+
+    context = BenchmarkContext(username, seed=seed)
+    context.login(runner)
+    results = {route.name: run_route(route, runner, context, requests, warmup, concurrency) for route in selected}
+    return dict(environment=describe_environment(runner, concurrency), routes=results)
+
+
+READ_ROUTES = ('search-name', 'search-price', 'search-query', 'user-products')
+WRITE_ROUTES = ('select', 'deselect')
+
+
+def run_mixed(runner, username, requests=500, concurrency=8, write_ratio=0.2, seed=0):
+    """
+    Send searches and select/deselect writes from ``concurrency`` workers at the same time.
+
+    About ``write_ratio`` of the ``requests`` are writes. Reads and writes are
+    summarized separately over the same wall time, which shows how much
+    concurrent writes slow searches down, and how often they fail.
+    """
+    routes = {route.name: route for route in ROUTES}
+    context = BenchmarkContext(username, seed=seed)
+    context.login(runner)
+    rng = random.Random(seed)
+    plan = [routes[rng.choice(WRITE_ROUTES if rng.random() < write_ratio else READ_ROUTES)]
+            for _ in range(requests)]
+
+    def send(route):
+        path, params, body = route.build(context)
+        return route.name in WRITE_ROUTES, runner.request(route.method, path, params=params, body=body,
+                                                          token=context.access)[:3]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(send, plan))
+    wall_time = time.perf_counter() - started
+
+    return dict(
+        environment=describe_environment(runner, concurrency),
+        mixed=dict(
+            write_ratio=write_ratio,
+            throughput_rps=round(len(samples) / wall_time, 2),
+            reads=summarize([sample for is_write, sample in samples if not is_write], wall_time),
+            writes=summarize([sample for is_write, sample in samples if is_write], wall_time),
+        ),
+    )
+
+
+def run_reservations(runner, username, requests=500, concurrency=8, shards=0, quantity=1, seed=0):
+    """
+    Reserve stock of one hot product from ``concurrency`` workers at the same time.
+
+    A fresh product with exactly enough stock for every request is created
+    (split over ``shards`` StockShard rows when given). Besides throughput
+    and latency, the result checks that no reservation was lost or oversold:
+    the remaining stock must equal the initial stock minus what was reserved.
+    """
+    context = BenchmarkContext(username, seed=seed)
+    context.login(runner)
+    initial = requests * quantity
+    product = Product.objects.create(name=f'benchmark hot product {context.run_id}',
+                                     description='reserved by benchmark', price=Decimal('9.99'), stock=initial)
+    if shards:
+        shard_stock(product.id, shards)
+
+    def send(_):
+        return runner.request('post', f'/api/product/{product.id}/reserve/', body=dict(quantity=quantity),
+                              token=context.access)[:3]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(send, range(requests)))
+    wall_time = time.perf_counter() - started
+
+    reserved = sum(quantity for status, _, _ in samples if status == 200)
+    remaining = available_stock(product.id)
+    return dict(
+        environment=describe_environment(runner, concurrency),
+        reservations=dict(summarize(samples, wall_time), shards=shards, initial_stock=initial, reserved=reserved,
+                          remaining_stock=remaining, consistent=initial - reserved == remaining),
+    )
+
+
+def describe_environment(runner, concurrency):
+    cache = get_search_cache_settings()
+    return dict(
+        commit=git_commit(),
+        timestamp=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        mode=runner.mode,
+        concurrency=concurrency,
+        products=Product.objects.count(),
+        users=User.objects.count(),
+        selections=ProductSelection.objects.count(),
+        database=connection.vendor,
+        databases=sorted(settings.DATABASES),
+        python=platform.python_version(),
+        django=django.get_version(),
+        search_cache=cache['ENABLED'],
+        fast_path=getattr(settings, 'PRODUCT_SEARCH_FAST_PATH', False),
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
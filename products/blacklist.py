@@ -0,0 +1,110 @@
+"""
+Per-process Bloom filter over blacklisted refresh token JTIs.
+
+Checking a refresh token against the ``token_blacklist`` tables costs a query
+on every refresh. The filter answers "definitely not blacklisted" for almost
+every token without touching the database; only filter hits (real
+blacklistings plus ~``ERROR_RATE`` false positives) go on to the query.
+
+Logouts handled by this process are added immediately. Blacklistings made by
+other processes are picked up by an incremental sync that runs at most once
+every ``SYNC_INTERVAL`` seconds, which bounds how long such a token can still
+be refreshed here. Rows can commit out of id order when several processes
+blacklist at once, so each sync re-reads the last ``SYNC_OVERLAP`` ids below
+the watermark as well.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+JWT_BLACKLIST_FILTER_DEFAULTS = {
+    'CAPACITY': 100000,
+    'ERROR_RATE': 0.001,
+    'SYNC_INTERVAL': 5,
+    'SYNC_OVERLAP': 100,
+}
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class BlacklistFilter:
+
+    def __init__(self):
+        self._filter = None
+        self._last_id = 0
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def config(self):
+        return {**JWT_BLACKLIST_FILTER_DEFAULTS, **getattr(settings, 'JWT_BLACKLIST_FILTER', {})}
+
+    def load(self):
+        """Rebuild the filter from every blacklisted token in the database."""
+        config = self.config
+        with self._lock:
+            count = BlacklistedToken.objects.count()
+            bloom = BloomFilter(max(config['CAPACITY'], count * 2), config['ERROR_RATE'])
+            last_id = 0
+            for pk, jti in BlacklistedToken.objects.values_list('id', 'token__jti').order_by('id').iterator():
+                bloom.add(jti)
+                last_id = pk
+            self._filter, self._last_id, self._synced_at = bloom, last_id, time.monotonic()
+
+    def sync(self):
+        """Add tokens blacklisted since the last sync, e.g. by other processes."""
+        config = self.config
+        with self._lock:
+            if time.monotonic() - self._synced_at < config['SYNC_INTERVAL']:
+                return
+            # A row with a lower id can commit after the watermark moved past it, so overlap the previous read.
+            since = self._last_id - config['SYNC_OVERLAP']
+            new = BlacklistedToken.objects.filter(id__gt=since).values_list('id', 'token__jti')
+            for pk, jti in new.order_by('id'):
+                if jti not in self._filter:
+                    self._filter.add(jti)
+                self._last_id = max(self._last_id, pk)
+            self._synced_at = time.monotonic()
+            overfull = self._filter.count > self._filter.capacity
+        if overfull:
+            self.load()
+
+    def add(self, jti):
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+
+    def might_contain(self, jti):
+        """False means ``jti`` is certainly not blacklisted; True means ask the database."""
+        if self._filter is None:
+            self.load()
+        self.sync()
+        return jti in self._filter
+
+
+blacklist_filter = BlacklistFilter()
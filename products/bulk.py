@@ -0,0 +1,145 @@
+import csv
+import json
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db import transaction
+
+from products import search
+from products.models import Product
+from products.serializers import ProductSerializer
+from products.signals import products_bulk_saved
+
+FILE_FORMATS = ('csv', 'jsonl')
+
+PRODUCT_COLUMNS = ['id', 'name', 'description', 'price', 'stock']
+
+
+def validate_rows(rows, serializer_class=ProductSerializer, offset=0):
+    """
+    Validate ``rows`` with ``serializer_class(many=True)``.
+
+    Returns ``(validated_data, errors)``: the validated data of every valid
+    row, and ``{"index", "errors"}`` for each invalid one, where ``index`` is
+    the row's position plus ``offset``. Invalid rows don't discard valid ones.
+    """
+    serializer = serializer_class(data=rows, many=True)
+    if serializer.is_valid():
+        return serializer.validated_data, []
+
+    errors, valid_rows = [], []
+    for index, (row, row_errors) in enumerate(zip(rows, serializer.errors)):
+        if row_errors:
+            errors.append(dict(index=offset + index, errors=row_errors))
+        else:
+            valid_rows.append(row)
+    if not valid_rows:
+        return [], errors
+
+    # ListSerializer drops all validated data when any row fails, so validate the valid rows again.
+    serializer = serializer_class(data=valid_rows, many=True)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data, errors
+
+
+def bulk_create_products(rows, chunk_size, using=DEFAULT_DB_ALIAS):
+    """
+    Validate and insert ``rows`` ``chunk_size`` at a time, one transaction per chunk.
+
+    Returns ``(created, errors)``: the created Product instances and the
+    per-row errors from ``validate_rows``.
+    """
+    created, errors = [], []
+    for offset in range(0, len(rows), chunk_size):
+        validated, chunk_errors = validate_rows(rows[offset:offset + chunk_size], offset=offset)
+        errors.extend(chunk_errors)
+        if not validated:
+            continue
+        with transaction.atomic(using=using):
+            products = Product.objects.using(using).bulk_create([Product(**data) for data in validated])
+            products_bulk_saved.send(sender=Product, products=products, using=using)
+        created.extend(products)
+    return created, errors
+
+
+def upsert_products(validated, using=DEFAULT_DB_ALIAS):
+    """
+    Save validated rows in one transaction: insert rows without an ``id``, insert or update rows with one.
+
+    When the same id appears more than once, the last row wins. Returns the saved Product instances.
+    """
+    by_id, new = {}, []
+    for data in validated:
+        product = Product(**data)
+        if product.id is None:
+            new.append(product)
+        else:
+            by_id[product.id] = product
+
+    with transaction.atomic(using=using):
+        products = Product.objects.using(using).bulk_create(
+            by_id.values(), update_conflicts=True, unique_fields=['id'],
+            update_fields=[field for field in PRODUCT_COLUMNS if field != 'id'],
+        ) if by_id else []
+        products += Product.objects.using(using).bulk_create(new)
+        products_bulk_saved.send(sender=Product, products=products, using=using)
+    return products
+
+
+def detect_format(path, file_format=None):
+    """Return ``file_format``, or the format implied by the file extension of ``path``."""
+    file_format = file_format or Path(path).suffix.lstrip('.').lower()
+    if file_format == 'ndjson':
+        file_format = 'jsonl'
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"Unknown file format for {path}; use one of {', '.join(FILE_FORMATS)}.")
+    return file_format
+
+
+def read_product_rows(file, file_format):
+    """
+    Yield one dict per product from an open text file, one row at a time.
+
+    CSV files need a header row naming the columns; an empty ``id`` is
+    treated as missing. JSONL files hold one JSON object per line; blank
+    lines are skipped.
+    """
+    if file_format == 'csv':
+        for row in csv.DictReader(file):
+            if not row.get('id'):
+                row.pop('id', None)
+            yield row
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+@contextmanager
+def product_indexes_dropped(connection):
+    """
+    Drop the Product sort indexes and the FTS sync triggers for the duration of a bulk load.
+
+    On exit, even after an error, the indexes and triggers are recreated and
+    the FTS table is rebuilt. Indexes already missing (say, after a killed
+    load) are simply recreated.
+    """
+    # Plain statements rather than a schema_editor block, which SQLite refuses inside a transaction.
+    editor = connection.schema_editor()
+    indexes = Product._meta.indexes
+    fts = search.fts_enabled(connection.alias)
+    with connection.cursor() as cursor:
+        for index in indexes:
+            cursor.execute(f'DROP INDEX IF EXISTS {connection.ops.quote_name(index.name)}')
+    if fts:
+        search.drop_triggers(connection)
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for index in indexes:
+                cursor.execute(str(index.create_sql(Product, editor)))
+        if fts:
+            search.create_index(connection)
+            search.rebuild_index(connection)
@@ -0,0 +1,242 @@
+"""
+Search result caching keyed on a catalog version.
+
+The same version counters (the catalog's, and one per user for selections)
+also make the ETags of ``products.etags``.
+
+Every Product write bumps a version counter stored in Django's cache (see
+``products.signals``). Cache keys embed the current version, so a write makes
+every cached search unreachable at once instead of invalidating keys one by
+one; stale entries simply age out. The counter lives in the configured cache
+backend, so with a shared backend (memcached, Redis) all processes see the
+same version.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from products.search import SEARCH_FILTER_PARAMS
+
+CATALOG_VERSION_KEY = 'products:catalog-version'
+SELECTION_VERSION_KEY = 'products:selection-version:{user_id}'
+POPULARITY_VERSION_KEY = 'products:popularity-version'
+STOCK_VERSION_KEY = 'products:stock-version'
+
+SEARCH_CACHE_DEFAULTS = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'TIMEOUT': 60,
+    'LOCAL_SIZE': 1024,
+}
+
+_missing = object()
+
+
+class LRUCache:
+    """A small thread-safe LRU mapping with an optional per-entry TTL in seconds."""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _missing)
+            if entry is _missing:
+                return default
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _version_cache():
+    return caches[get_search_cache_settings()['ALIAS']]
+
+
+def _initial_version():
+    # Start from the clock rather than 1, so a counter that was evicted from
+    # the cache never restarts at a value older entries were stored under.
+    return int(time.time() * 1000)
+
+
+def _get_version(key):
+    cache = _version_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key):
+    cache = _version_cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), timeout=None)
+        return cache.get(key)
+
+
+def get_catalog_version():
+    return _get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    return _bump_version(CATALOG_VERSION_KEY)
+
+
+def get_selection_version(user_id):
+    """Version of ``user_id``'s selections, bumped whenever one of them is written or deleted."""
+    return _get_version(SELECTION_VERSION_KEY.format(user_id=user_id))
+
+
+def bump_selection_version(user_id):
+    return _bump_version(SELECTION_VERSION_KEY.format(user_id=user_id))
+
+
+def get_popularity_version():
+    """Version of the products' selection counts, which only ``sort_by=popularity`` searches depend on."""
+    return _get_version(POPULARITY_VERSION_KEY)
+
+
+def bump_popularity_version():
+    return _bump_version(POPULARITY_VERSION_KEY)
+
+
+def get_stock_version():
+    """Version of the products' stock counts, which reservations change without bumping the catalog version."""
+    return _get_version(STOCK_VERSION_KEY)
+
+
+def bump_stock_version():
+    return _bump_version(STOCK_VERSION_KEY)
+
+
+def get_search_cache_settings():
+    return {**SEARCH_CACHE_DEFAULTS, **getattr(settings, 'PRODUCT_SEARCH_CACHE', {})}
+
+
+class SearchCache:
+    """
+    Two-tier cache for search responses.
+
+    Lookups go to an in-process LRU first and then to the Django cache alias
+    configured in ``PRODUCT_SEARCH_CACHE``. Keys are namespaced by the
+    current catalog version.
+    """
+
+    def __init__(self):
+        self._local = None
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def config(self):
+        return get_search_cache_settings()
+
+    @property
+    def enabled(self):
+        return self.config['ENABLED']
+
+    @property
+    def local(self):
+        if self._local is None:
+            self._local = LRUCache(self.config['LOCAL_SIZE'])
+        return self._local
+
+    def make_key(self, *parts):
+        digest = hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+        return f'products:search:{get_catalog_version()}:{digest}'
+
+    def make_search_key(self, params, page_size, fast_path=False):
+        """
+        Key for one search page, from the request's query parameters.
+
+        Popularity-sorted pages are also keyed on the popularity version, so
+        selections reorder them without touching the other cached searches.
+        Every page shows stock counts and is keyed on the stock version too.
+        """
+        return self.make_key(
+            'fast-search' if fast_path else 'search',
+            get_popularity_version() if params.get('sort_by') == 'popularity' else None,
+            get_stock_version(),
+            params.get('query', ''),
+            params.get('sort_by', 'name'),
+            params.get('sort_order', 'asc'),
+            params.get('cursor', ''),
+            page_size,
+            *(params.get(name, '') for name in SEARCH_FILTER_PARAMS),
+        )
+
+    def make_facets_key(self, params):
+        """Key for the facet counts of a search; they don't depend on sorting or the page."""
+        return self.make_key('facets', params.get('query', ''),
+                             *(params.get(name, '') for name in SEARCH_FILTER_PARAMS))
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local_hits')
+            return value
+        value = caches[self.config['ALIAS']].get(key)
+        if value is not None:
+            self._count('shared_hits')
+            self.local.set(key, value)
+            return value
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        caches[self.config['ALIAS']].set(key, value, timeout=self.config['TIMEOUT'])
+
+    def clear_local(self):
+        self.local.clear()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = dict(local_hits=0, shared_hits=0, misses=0)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = sum(stats.values())
+        stats['hit_ratio'] = (stats['local_hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        stats['local_entries'] = len(self.local)
+        stats['catalog_version'] = get_catalog_version()
+        return stats
+
+
+search_cache = SearchCache()
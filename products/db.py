@@ -0,0 +1,98 @@
+"""
+SQLite connection tuning and read/write routing.
+
+Every new SQLite connection gets the pragmas in ``SQLITE_PRAGMAS`` (WAL
+journal, ``synchronous=NORMAL``, memory-mapped I/O, a larger page cache and
+a busy timeout). With WAL, readers don't block the writer and the writer
+doesn't block readers. Only one writer runs at a time, and ``busy_timeout``
+makes the others wait for it instead of failing with ``database is
+locked``.
+
+That wait only covers transactions that write first. A transaction that
+reads and then writes while another connection has committed in between
+can't be upgraded to a writer; SQLite fails it with ``database is locked``
+at once, whatever the timeout. Write paths that need to read therefore do
+their reads before ``atomic()``, or start the transaction with the write
+(see ``products.selections``).
+
+``SQLITE_PRAGMA_DEFAULTS`` are the pragmas; ``settings.SQLITE_PRAGMAS``
+only overrides individual values.
+
+Views that only read can run inside ``read_database()``. While that is
+active, ``ReadWriteRouter`` sends ORM reads to the ``read`` alias: a second
+connection to the same file, opened with ``query_only``. Reads stay on
+``default`` inside a transaction on ``default``, so a transaction always
+reads its own writes. Writes always go to ``default``.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections
+
+READ_DB_ALIAS = 'read'
+
+SQLITE_PRAGMA_DEFAULTS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 268435456,
+    'cache_size': -65536,
+    'busy_timeout': 5000,
+}
+
+_read_only = ContextVar('products_read_only', default=False)
+
+
+def get_sqlite_pragmas(alias):
+    pragmas = {**SQLITE_PRAGMA_DEFAULTS, **getattr(settings, 'SQLITE_PRAGMAS', {})}
+    if alias == READ_DB_ALIAS:
+        pragmas['query_only'] = 'ON'
+    return pragmas
+
+
+def configure_connection(connection):
+    """Apply ``get_sqlite_pragmas()`` to a newly opened SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in get_sqlite_pragmas(connection.alias).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def read_database():
+    """Route the ORM reads of the enclosed block to the read alias (see ``ReadWriteRouter``)."""
+    token = _read_only.set(True)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+class ReadOnlyViewMixin:
+    """Runs a DRF view inside ``read_database()``. Only for views that never write."""
+
+    def dispatch(self, request, *args, **kwargs):
+        with read_database():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class ReadWriteRouter:
+    """Send reads inside ``read_database()`` to the read alias, and everything else to default."""
+
+    def db_for_read(self, model, **hints):
+        if (_read_only.get() and READ_DB_ALIAS in settings.DATABASES
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return READ_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same database.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != READ_DB_ALIAS
@@ -0,0 +1,84 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from products.benchmarks import BENCHMARK_USER_PREFIX
+from products.benchmarks import HTTPRunner
+from products.benchmarks import InProcessRunner
+from products.benchmarks import ROUTES
+from products.benchmarks import parse_catalog_size
+from products.benchmarks import run_benchmark
+from products.benchmarks import run_mixed
+from products.benchmarks import run_reservations
+from products.benchmarks import seed_catalog
+
+
+class Command(BaseCommand):
+    help = ("Seed a benchmark catalog and measure throughput, p50/p95/p99 latency and queries per request "
+            "for every API route. Results are printed as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', default='1k',
+                            help="Catalog size: 1k, 100k, 1m or a number of products (default 1k).")
+        parser.add_argument('--users', type=int, default=10, help='Benchmark users to seed.')
+        parser.add_argument('--selections', type=int, default=20, help='Random selections per seeded user.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the catalog and the requests.')
+        parser.add_argument('--skip-seed', action='store_true', help='Benchmark the database as it is.')
+        parser.add_argument('--routes', help='Comma-separated route names (default: all). '
+                                             f"Available: {', '.join(route.name for route in ROUTES)}.")
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per route.')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per route.')
+        parser.add_argument('--mode', choices=['inprocess', 'http'], default='inprocess',
+                            help="'inprocess' uses Django's test client and counts queries; 'http' sends "
+                                 "concurrent requests to a running server at --url.")
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server address for --mode http.')
+        parser.add_argument('--concurrency', type=int, default=1, help='Concurrent workers.')
+        parser.add_argument('--mixed', action='store_true',
+                            help='Instead of timing each route, send searches and select/deselect writes '
+                                 'concurrently and report reads and writes separately.')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of writes with --mixed.')
+        parser.add_argument('--reserve', action='store_true',
+                            help='Instead of timing each route, reserve stock of one hot product concurrently '
+                                 'and check that no reservation was lost.')
+        parser.add_argument('--stock-shards', type=int, default=0,
+                            help='Split the hot product of --reserve over this many stock shards.')
+        parser.add_argument('--output', help='Also write the results to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            products = parse_catalog_size(options['products'])
+        except ValueError:
+            raise CommandError(f"Invalid --products value: {options['products']}")
+        if options['users'] < 1:
+            raise CommandError("At least one benchmark user is needed.")
+
+        if not options['skip_seed']:
+            created = seed_catalog(products, options['users'], options['selections'], seed=options['seed'])
+            self.stderr.write(f"Seeded {created['products']} products, {created['users']} users and "
+                              f"{created['selections']} selections.")
+
+        runner = InProcessRunner() if options['mode'] == 'inprocess' else HTTPRunner(options['url'])
+        routes = options['routes'].split(',') if options['routes'] else None
+        username = f'{BENCHMARK_USER_PREFIX}0'
+        try:
+            if options['reserve']:
+                results = run_reservations(runner, username, requests=options['requests'],
+                                           concurrency=options['concurrency'], shards=options['stock_shards'],
+                                           seed=options['seed'])
+            elif options['mixed']:
+                results = run_mixed(runner, username, requests=options['requests'],
+                                    concurrency=max(options['concurrency'], 2),
+                                    write_ratio=options['write_ratio'], seed=options['seed'])
+            else:
+                results = run_benchmark(runner, username, routes=routes, requests=options['requests'],
+                                        warmup=options['warmup'], concurrency=options['concurrency'],
+                                        seed=options['seed'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
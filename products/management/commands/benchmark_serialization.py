@@ -0,0 +1,70 @@
+import json
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from rest_framework.renderers import JSONRenderer
+
+from product_manager.utils import create_json_response
+from products.models import Product
+from products.renderers import EnvelopeJSONRenderer
+from products.serializers import ProductSerializer
+from products.views import product_row_encoder
+
+
+class Command(BaseCommand):
+    help = ("Compare ProductSerializer + JSONRenderer with the RowEncoder + EnvelopeJSONRenderer fast path "
+            "on one page of search results.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500, help='Products per page.')
+        parser.add_argument('--repeat', type=int, default=50, help='Timed runs per path.')
+        parser.add_argument('--source', choices=['memory', 'db'], default='memory',
+                            help="'memory' serializes generated products; 'db' also times reading "
+                                 "the first --rows products from the database.")
+
+    def handle(self, *args, **options):
+        rows, repeat, source = options['rows'], options['repeat'], options['source']
+        if source == 'db':
+            if Product.objects.count() < rows:
+                raise CommandError(f"The database has fewer than {rows} products.")
+            load_instances = lambda: list(Product.objects.order_by('id')[:rows])
+            load_rows = lambda: list(Product.objects.order_by('id').values_list(*product_row_encoder.columns)[:rows])
+        else:
+            products = [
+                Product(id=pk, name=f'Product {pk} é', description='A "sample" product description.',
+                        price=Decimal(pk % 1000) / 4, stock=pk % 50)
+                for pk in range(1, rows + 1)
+            ]
+            tuples = [tuple(getattr(product, column) for column in product_row_encoder.columns)
+                      for product in products]
+            load_instances = lambda: products
+            load_rows = lambda: tuples
+
+        def serializer_path():
+            data = ProductSerializer(load_instances(), many=True).data
+            return JSONRenderer().render(create_json_response(status=True, message="Products Overview", data=data))
+
+        def fast_path():
+            data = product_row_encoder.encode_many(load_rows())
+            return EnvelopeJSONRenderer().render(create_json_response(status=True, message="Products Overview",
+                                                                      data=data))
+
+        if serializer_path() != fast_path():
+            raise CommandError("The fast path output differs from ProductSerializer + JSONRenderer.")
+
+        results = dict(rows=rows, repeat=repeat, source=source,
+                       serializer_ms=self.time(serializer_path, repeat),
+                       fast_path_ms=self.time(fast_path, repeat))
+        results['speedup'] = round(results['serializer_ms'] / results['fast_path_ms'], 2)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def time(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        return round(timings[len(timings) // 2] * 1000, 3)
@@ -0,0 +1,59 @@
+import csv
+import sys
+import time
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from products.bulk import PRODUCT_COLUMNS
+from products.bulk import detect_format
+from products.db import read_database
+from products.models import Product
+from products.views import product_row_encoder
+
+
+class Command(BaseCommand):
+    help = ("Stream every product to a CSV or JSONL file with constant memory. "
+            "JSONL rows are identical to the API's product representation.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, or '-' for standard output.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Default: from the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            file_format = detect_format(path, options['format'] or ('jsonl' if path == '-' else None))
+        except ValueError as e:
+            raise CommandError(e)
+
+        columns = PRODUCT_COLUMNS if file_format == 'csv' else product_row_encoder.columns
+        started = time.perf_counter()
+        with read_database():
+            rows = Product.objects.order_by('id').values_list(*columns).iterator(chunk_size=options['chunk_size'])
+            if file_format == 'csv':
+                with self.open(path, 'w', newline='', encoding='utf-8') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(PRODUCT_COLUMNS)
+                    count = 0
+                    for row in rows:
+                        writer.writerow(row)
+                        count += 1
+            else:
+                with self.open(path, 'wb') as f:
+                    count = 0
+                    for row in rows:
+                        f.write(product_row_encoder.encode(row) + b'\n')
+                        count += 1
+
+        elapsed = time.perf_counter() - started
+        rate = round(count / elapsed) if elapsed > 0 else count
+        self.stderr.write(self.style.SUCCESS(f"Exported {count} products in {elapsed:.1f}s, {rate} rows/s."))
+
+    def open(self, path, mode, **kwargs):
+        if path == '-':
+            stream = sys.stdout.buffer if 'b' in mode else sys.stdout
+            return nullcontext(stream)
+        return open(path, mode, **kwargs)
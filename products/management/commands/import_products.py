@@ -0,0 +1,95 @@
+import json
+import os
+import time
+from contextlib import nullcontext
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections
+from django.db import transaction
+
+from products.bulk import detect_format
+from products.bulk import product_indexes_dropped
+from products.bulk import read_product_rows
+from products.bulk import upsert_products
+from products.bulk import validate_rows
+from products.models import ImportCheckpoint
+from products.serializers import ProductImportSerializer
+
+
+class Command(BaseCommand):
+    help = ("Stream products from a CSV or JSONL file into the catalog, validating each chunk with "
+            "ProductSerializer. Rows with an id update that product; rows without one are created.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with a header row) or JSONL file.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Default: from the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows per transaction.')
+        parser.add_argument('--drop-indexes', action='store_true',
+                            help='Drop the product sort indexes and search index triggers during the load and '
+                                 'rebuild them afterwards. Faster for large files.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue after the last committed chunk of an interrupted import.')
+        parser.add_argument('--checkpoint', help='Checkpoint name (default: the absolute path of the file).')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive.")
+        try:
+            file_format = detect_format(path, options['format'])
+            stat = os.stat(path)
+        except (ValueError, OSError) as e:
+            raise CommandError(e)
+
+        checkpoint = options['checkpoint'] or os.path.abspath(path)
+        checkpoints = ImportCheckpoint.objects.using(DEFAULT_DB_ALIAS)
+        fingerprint = dict(path=os.path.abspath(path), size=stat.st_size, mtime=stat.st_mtime)
+        state = dict(fingerprint, rows=0, imported=0, invalid=0)
+        saved = checkpoints.filter(name=checkpoint).values_list('state', flat=True).first()
+        if options['resume'] and saved is not None:
+            if {key: saved.get(key) for key in fingerprint} != fingerprint:
+                raise CommandError(f"Checkpoint {checkpoint} belongs to a different version of {path}.")
+            state = saved
+            self.stderr.write(f"Resuming after row {state['rows']}.")
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        started = last_report = time.perf_counter()
+        resumed_from = state['rows']
+        with open(path, newline='', encoding='utf-8') as f, \
+                (product_indexes_dropped(connection) if options['drop_indexes'] else nullcontext()):
+            rows = islice(read_product_rows(f, file_format), state['rows'], None)
+            while True:
+                try:
+                    chunk = list(islice(rows, options['chunk_size']))
+                except (ValueError, UnicodeDecodeError) as e:
+                    raise CommandError(f"Can't read row {state['rows']} of {path}: {e}")
+                if not chunk:
+                    break
+                validated, errors = validate_rows(chunk, ProductImportSerializer, offset=state['rows'])
+                for error in errors:
+                    self.stderr.write(f"Row {error['index']}: {json.dumps(error['errors'])}")
+
+                state = dict(state, rows=state['rows'] + len(chunk), imported=state['imported'] + len(validated),
+                             invalid=state['invalid'] + len(errors))
+                # The checkpoint commits with the chunk, so a crash can never replay rows that were saved.
+                with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                    if validated:
+                        upsert_products(validated)
+                    checkpoints.bulk_create([ImportCheckpoint(name=checkpoint, state=state)],
+                                            update_conflicts=True, unique_fields=['name'], update_fields=['state'])
+                if time.perf_counter() - last_report >= 5:
+                    last_report = time.perf_counter()
+                    self.stderr.write(f"{state['rows']} rows, "
+                                      f"{self.rate(state['rows'] - resumed_from, last_report - started)} rows/s...")
+
+        elapsed = time.perf_counter() - started
+        checkpoints.filter(name=checkpoint).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {state['imported']} of {state['rows']} rows ({state['invalid']} invalid) "
+            f"in {elapsed:.1f}s, {self.rate(state['rows'] - resumed_from, elapsed)} rows/s."))
+
+    def rate(self, rows, seconds):
+        return round(rows / seconds) if seconds > 0 else rows
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+
+class Command(BaseCommand):
+    help = ("Delete expired outstanding tokens and their blacklist entries in batches, "
+            "keeping each write transaction short.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tokens deleted per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the expired tokens.')
+
+    def handle(self, *args, **options):
+        expired = OutstandingToken.objects.filter(expires_at__lt=timezone.now())
+        if options['dry_run']:
+            self.stdout.write(f"{expired.count()} expired tokens would be deleted.")
+            return
+
+        deleted = 0
+        while True:
+            ids = list(expired.order_by('id').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            with transaction.atomic():
+                BlacklistedToken.objects.filter(token_id__in=ids).delete()
+                OutstandingToken.objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+            self.stdout.write(f"Deleted {deleted} expired tokens...")
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired tokens."))
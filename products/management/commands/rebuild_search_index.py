@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections
+
+from products import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index used by /api/product/search/."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database alias to rebuild the index on.')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if not search.fts_supported(connection):
+            raise CommandError("This database does not support SQLite FTS5 with the trigram tokenizer.")
+
+        search.create_index(connection)
+        search.rebuild_index(connection)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {search.FTS_TABLE}."))
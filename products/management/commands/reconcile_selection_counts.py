@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from products.selections import reconcile_selection_counts
+
+
+class Command(BaseCommand):
+    help = ("Recompute Product.selection_count from the selections table in one UPDATE, fixing counts that "
+            "drifted from writes that bypass the select/deselect/batch endpoints.")
+
+    def handle(self, *args, **options):
+        fixed = reconcile_selection_counts()
+        self.stdout.write(self.style.SUCCESS(f"Fixed the selection count of {fixed} products."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from products.models import Product
+from products.stock import shard_stock
+
+
+class Command(BaseCommand):
+    help = ("Split a hot product's stock over several rows so concurrent reservations don't queue on one. "
+            "Pass 0 shards to fold the stock back into the product.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_id', type=int)
+        parser.add_argument('shards', type=int)
+
+    def handle(self, *args, **options):
+        if options['shards'] < 0:
+            raise CommandError("The number of shards can't be negative.")
+        try:
+            total = shard_stock(options['product_id'], options['shards'])
+        except Product.DoesNotExist:
+            raise CommandError(f"Product {options['product_id']} doesn't exist.")
+        if options['shards']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Spread {total} units of product {options['product_id']} over {options['shards']} shards."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Product {options['product_id']} is unsharded with {total} units."))
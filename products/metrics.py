@@ -0,0 +1,202 @@
+"""
+Per-request timings and Prometheus histograms.
+
+``RequestMetricsMiddleware`` (see ``products.middleware``) opens a
+``RequestTimings`` for each request in a context variable. A database
+execute wrapper, installed on every connection when it is created, adds each
+query's count and duration to it. Code that serializes or authenticates wraps
+the work in ``timed('serialize')`` or ``timed('auth')``. Everything is a no-op
+outside a request, e.g. in management commands.
+
+Histograms are kept per process. Each series is a list of bucket counts
+updated under a single lock per request. Searches coalesced by
+``products.singleflight`` are counted alongside.
+"""
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+
+REQUEST_METRICS_DEFAULTS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    # Client addresses that may read /api/metrics without a token; staff users always may.
+    'ALLOWED_IPS': [],
+}
+
+# Any other request method is labelled 'other', so clients can't add series at will.
+METHOD_LABELS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_current = ContextVar('products_request_timings', default=None)
+
+
+def get_metrics_settings():
+    return {**REQUEST_METRICS_DEFAULTS, **getattr(settings, 'REQUEST_METRICS', {})}
+
+
+class RequestTimings:
+    """Time spent by one request, in seconds. Phases may overlap: auth includes its own queries."""
+    __slots__ = ('db_queries', 'db', 'serialize', 'auth')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db = self.serialize = self.auth = 0.0
+
+
+def start_request():
+    """Start collecting timings for the current context; pass the returned token to ``end_request``."""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+@contextmanager
+def timed(phase):
+    """Add the duration of the block to ``phase`` ('serialize' or 'auth') of the current request."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        setattr(timings, phase, getattr(timings, phase) + perf_counter() - started)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper counting queries and their time for the current request."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += perf_counter() - started
+        timings.db_queries += 1
+
+
+def install_query_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_bound(bound):
+    return repr(float(bound)) if bound != float('inf') else '+Inf'
+
+
+class Histogram:
+    """A labelled Prometheus histogram. ``observe`` expects the caller to hold the registry lock."""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self, labelnames):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total) in sorted(self._series.items()):
+            label_text = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, labels))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{format_bound(bound)}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total!r}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+
+class RequestMetrics:
+    """Per-process request histograms, labelled by URL name and method, plus a request counter by status."""
+    labelnames = ('view', 'method')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.duration = Histogram('http_request_duration_seconds',
+                                      'Wall time of the request in the application.', DURATION_BUCKETS)
+            self.db_queries = Histogram('http_request_db_queries',
+                                        'Database queries run by the request.', QUERY_COUNT_BUCKETS)
+            self.db_duration = Histogram('http_request_db_duration_seconds',
+                                         'Time spent executing database queries.', DURATION_BUCKETS)
+            self.serialize_duration = Histogram('http_request_serialization_duration_seconds',
+                                                'Time spent serializing and rendering the response.',
+                                                DURATION_BUCKETS)
+            self.auth_duration = Histogram('http_request_auth_duration_seconds',
+                                           'Time spent authenticating the request.', DURATION_BUCKETS)
+            self.requests = {}
+            self.coalesced = {}
+
+    @property
+    def histograms(self):
+        return [self.duration, self.db_queries, self.db_duration, self.serialize_duration, self.auth_duration]
+
+    def observe(self, view, method, status, duration, timings):
+        method = method if method in METHOD_LABELS else 'other'
+        labels = (view, method)
+        with self._lock:
+            self.duration.observe(labels, duration)
+            self.db_queries.observe(labels, timings.db_queries)
+            self.db_duration.observe(labels, timings.db)
+            self.serialize_duration.observe(labels, timings.serialize)
+            self.auth_duration.observe(labels, timings.auth)
+            key = (view, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def count_coalesced(self, kind):
+        """Count a request that shared another in-flight request's ``kind`` ('search' or 'facets') result."""
+        with self._lock:
+            self.coalesced[kind] = self.coalesced.get(kind, 0) + 1
+
+    def render(self):
+        with self._lock:
+            lines = ['# HELP http_requests_total Requests handled, by response status.',
+                     '# TYPE http_requests_total counter']
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{view="{escape_label(view)}",method="{method}",'
+                             f'status="{status}"}} {count}')
+            lines += ['# HELP search_requests_coalesced_total Requests served by an identical in-flight request.',
+                      '# TYPE search_requests_coalesced_total counter']
+            for kind, count in sorted(self.coalesced.items()):
+                lines.append(f'search_requests_coalesced_total{{kind="{kind}"}} {count}')
+            for histogram in self.histograms:
+                lines.extend(histogram.render(self.labelnames))
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+def server_timing(duration, timings):
+    """``Server-Timing`` header value; durations in milliseconds."""
+    return (f'total;dur={duration * 1000:.2f}, '
+            f'db;dur={timings.db * 1000:.2f};desc="{timings.db_queries} queries", '
+            f'serialize;dur={timings.serialize * 1000:.2f}, '
+            f'auth;dur={timings.auth * 1000:.2f}')
@@ -0,0 +1,75 @@
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction
+from asgiref.sync import markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+
+from products.metrics import end_request
+from products.metrics import get_metrics_settings
+from products.metrics import request_metrics
+from products.metrics import server_timing
+from products.metrics import start_request
+from products.metrics import timed
+
+
+class RequestMetricsMiddleware:
+    """
+    Records wall, database, serialization and authentication time for every request.
+
+    Timings are added to the ``/api/metrics`` histograms under the resolved
+    URL name and, unless ``REQUEST_METRICS['SERVER_TIMING']`` is off, sent back
+    in a ``Server-Timing`` header. Rendering of DRF responses is timed as
+    serialization. The body of a streaming response is produced after the
+    middleware returns, so only the time to its first byte is measured.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_metrics_settings()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.server_timing = config['SERVER_TIMING']
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = perf_counter()
+        timings, token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(request, response, perf_counter() - started, timings)
+
+    async def __acall__(self, request):
+        started = perf_counter()
+        timings, token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(request, response, perf_counter() - started, timings)
+
+    def process_template_response(self, request, response):
+        # Called right before DRF responses are rendered; the post-render callback closes the timer.
+        timer = timed('serialize')
+        timer.__enter__()
+
+        def rendered(response):
+            timer.__exit__(None, None, None)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, duration, timings):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        request_metrics.observe(view, request.method, response.status_code, duration, timings)
+        if self.server_timing:
+            response['Server-Timing'] = server_timing(duration, timings)
+        return response
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.3 on 2026-10-18 02:54
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models import OuterRef
+from django.db.models import Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_selections(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductSelection = apps.get_model('products', 'ProductSelection')
+    selected = ProductSelection.objects.filter(product=OuterRef('pk'), selected=True).order_by().values(
+        'product').annotate(count=Count('id')).values('count')
+    Product.objects.update(selection_count=Coalesce(Subquery(selected), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='selection_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['selection_count', 'id'], name='product_selection_count_id_idx'),
+        ),
+        migrations.RunPython(count_selections, migrations.RunPython.noop),
+    ]
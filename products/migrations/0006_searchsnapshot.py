@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-18 03:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('products', '0005_stockshard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchSnapshot',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('params', models.JSONField(default=dict)),
+                ('recorded_at', models.DateTimeField()),
+            ],
+        ),
+    ]
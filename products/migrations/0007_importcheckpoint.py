@@ -0,0 +1,20 @@
+# Generated by Django 4.2.3 on 2026-10-18 03:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_searchsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('name', models.CharField(max_length=1024, primary_key=True, serialize=False)),
+                ('state', models.JSONField(default=dict)),
+            ],
+        ),
+    ]
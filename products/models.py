@@ -13,10 +13,37 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=8, decimal_places=2)
     stock = models.IntegerField()
+    # Number of users who currently have this product selected. Kept up to date
+    # by the select/deselect/batch paths in products/selections.py and
+    # recomputed by the reconcile_selection_counts command.
+    selection_count = models.IntegerField(default=0)
 
     def __str__(self):
         return self.name
 
+    class Meta:
+        # One index per sortable search field, with id as the keyset pagination tiebreaker,
+        # so sorted pages are read in index order instead of through a temporary sort.
+        indexes = [
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['stock', 'id'], name='product_stock_id_idx'),
+            models.Index(fields=['selection_count', 'id'], name='product_selection_count_id_idx'),
+        ]
+
+
+class StockShard(models.Model):
+    """One slice of a hot product's stock, see products/stock.py."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_shards')
+    index = models.PositiveSmallIntegerField()
+    stock = models.IntegerField()
+
+    def __str__(self):
+        return f'{self.product.name} shard {self.index}'
+
+    class Meta:
+        unique_together = [['product', 'index']]
+
 
 class ProductSelection(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -27,4 +54,23 @@ class ProductSelection(models.Model):
         return f'{self.user.username} selected {self.product.name} at {self.selected_at}'
 
     class Meta:
-        unique_together = [['user', 'product']]
\ No newline at end of file
+        unique_together = [['user', 'product']]
+
+
+class SearchSnapshot(models.Model):
+    """The parameters of a user's last search page, restored by /api/session/restore/ (see products/snapshots.py)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    params = models.JSONField(default=dict)
+    recorded_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'Last search of {self.user.username}'
+
+
+class ImportCheckpoint(models.Model):
+    """Position of an interrupted import_products run, saved in the same transaction as each chunk."""
+    name = models.CharField(max_length=1024, primary_key=True)
+    state = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f'Import of {self.name} after row {self.state.get("rows", 0)}'
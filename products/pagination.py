@@ -0,0 +1,175 @@
+import base64
+import binascii
+import json
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+from product_manager.utils import create_json_response
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over ``(sort_field, id)``.
+
+    The sort field and direction are taken from the first ``order_by`` term of
+    the queryset the view hands in (``id`` when it is unordered), and ``id``
+    is appended as a tiebreaker in the same direction. Each page is a
+    ``WHERE (sort_field, id) > (last_value, last_id) ... LIMIT page_size + 1``
+    query that seeks the ``(sort_field, id)`` index, so deep pages cost the
+    same as the first one.
+
+    Cursors are opaque, URL-safe strings returned as ``next``/``prev`` next to
+    the usual ``create_json_response`` envelope.
+    """
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finish_page(list(self.prepare_page(queryset, request)))
+
+    def prepare_page(self, queryset, request):
+        """
+        Return the ordered, filtered and sliced queryset for the requested page.
+
+        Split from ``paginate_queryset`` so callers can evaluate the queryset
+        themselves (e.g. with ``async for``) before calling ``finish_page``.
+        """
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending = self.get_ordering(queryset)
+        self.cursor = self.decode_cursor(request, queryset)
+
+        # Walking backwards flips the scan direction; finish_page restores it.
+        reverse = self.cursor is not None and self.cursor['r']
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f'{prefix}{self.field}', f'{prefix}id')
+
+        if self.cursor is not None:
+            lookup, bound = ('lt', 'lte') if descending else ('gt', 'gte')
+            value, pk = self.cursor['v'], self.cursor['i']
+            # (field, id) after (value, pk). The bound on field alone lets the (field, id) index seek to the
+            # cursor; without it SQLite scans the index from the start and filters every earlier row.
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{bound}': value}),
+                Q(**{f'{self.field}__{lookup}': value}) | Q(**{f'id__{lookup}': pk}),
+            )
+        return queryset[:self.page_size + 1]
+
+    def finish_page(self, rows):
+        has_more = len(rows) > self.page_size
+        page = rows[:self.page_size]
+
+        if self.cursor is not None and self.cursor['r']:
+            page.reverse()
+            self.has_next, self.has_prev = True, has_more
+        else:
+            self.has_next, self.has_prev = has_more, self.cursor is not None
+
+        self.next_cursor = self.encode_cursor(page[-1], reverse=False) if page and self.has_next else None
+        self.prev_cursor = self.encode_cursor(page[0], reverse=True) if page and self.has_prev else None
+        return page
+
+    def get_paginated_response(self, data, message="Products Overview"):
+        return Response(self.get_paginated_payload(data, message))
+
+    def get_paginated_payload(self, data, message="Products Overview"):
+        payload = create_json_response(status=True, message=message, data=data)
+        payload['next'] = self.next_cursor
+        payload['prev'] = self.prev_cursor
+        return payload
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        ordering = queryset.query.order_by
+        if not ordering or not isinstance(ordering[0], str):
+            return 'id', False
+        field = ordering[0]
+        if field.startswith('-'):
+            return field[1:], True
+        return field, False
+
+    def get_sort_field(self, queryset):
+        """The model field or annotation output field that ``self.field`` orders by."""
+        annotation = queryset.query.annotations.get(self.field)
+        if annotation is not None:
+            return annotation.output_field
+        model = queryset.model
+        *path, name = self.field.split(LOOKUP_SEP)
+        for part in path:
+            model = model._meta.get_field(part).related_model
+        return model._meta.get_field(name)
+
+    def get_position(self, item):
+        """Return the ``(sort value, id)`` of a page item."""
+        return getattr(item, self.field), item.id
+
+    def encode_cursor(self, item, reverse):
+        value, pk = self.get_position(item)
+        if isinstance(value, Decimal):
+            value = str(value)
+        cursor = dict(f=self.field, d=self.descending, v=value, i=pk, r=reverse)
+        data = json.dumps(cursor, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii')
+
+    def decode_cursor(self, request, queryset):
+        """
+        The cursor of the request, or None on the first page.
+
+        The sort value is converted with the sort field's ``to_python()``, so
+        a tampered cursor is rejected with NotFound instead of reaching the
+        query with a value of the wrong type.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            valid = (
+                cursor['f'] == self.field and cursor['d'] == self.descending
+                and type(cursor['i']) is int and isinstance(cursor['r'], bool)
+                and isinstance(cursor['v'], (str, int, float)) and not isinstance(cursor['v'], bool)
+            )
+            if valid:
+                cursor['v'] = self.get_sort_field(queryset).to_python(cursor['v'])
+                valid = cursor['v'] is not None
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError, FieldDoesNotExist):
+            raise NotFound(self.invalid_cursor_message)
+        if not valid:
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+        ]
@@ -0,0 +1,99 @@
+import json
+from itertools import islice
+
+from rest_framework.renderers import JSONRenderer
+
+from products.encoders import EncodedRows
+
+
+class EnvelopeJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that splices pre-encoded rows into the response envelope.
+
+    When ``data["data"]`` is ``[EncodedRows]`` (as built by
+    ``create_json_response`` around ``RowEncoder.encode_many``), the rows are
+    joined into the output buffer as they are instead of being decoded and
+    re-encoded. Any other data is rendered exactly like ``JSONRenderer``.
+    """
+    rows_placeholder = '\x00encoded-rows\x00'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = self.get_encoded_rows(data)
+        if rows is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            data = dict(data, data=[[json.loads(row) for row in rows]])
+            return super().render(data, accepted_media_type, renderer_context)
+
+        envelope = super().render(dict(data, data=[self.rows_placeholder]), accepted_media_type, renderer_context)
+        placeholder = json.dumps(self.rows_placeholder).encode()
+        head, tail = envelope.split(placeholder, 1)
+        return b''.join([head, b'[', b','.join(rows), b']', tail])
+
+    def get_encoded_rows(self, data):
+        if not isinstance(data, dict):
+            return None
+        inner = data.get('data')
+        if isinstance(inner, list) and len(inner) == 1 and isinstance(inner[0], EncodedRows):
+            return inner[0]
+        return None
+
+
+class NDJSONRenderer(JSONRenderer):
+    """
+    Renders newline-delimited JSON.
+
+    Lists are written one item per line; anything else (e.g. an error
+    envelope) is written as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, list):
+            return b''.join(self.render_line(item) for item in data)
+        return self.render_line(data)
+
+    def render_line(self, item):
+        return super().render(item) + b'\n'
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def stream_ndjson(items, serializer, chunk_size):
+    """Yield ``items`` serialized by ``serializer`` as NDJSON, ``chunk_size`` lines at a time."""
+    renderer = NDJSONRenderer()
+    for chunk in _chunked(items, chunk_size):
+        yield b''.join(renderer.render_line(serializer.to_representation(item)) for item in chunk)
+
+
+def stream_json_envelope(items, serializer, chunk_size, message):
+    """
+    Yield the ``create_json_response`` envelope around ``items`` incrementally.
+
+    The output is identical to rendering ``create_json_response(True, message,
+    data)`` with ``JSONRenderer``, including the empty ``"data": []`` case.
+    """
+    renderer = JSONRenderer()
+    head = renderer.render({"status": True, "message": str(message), "data": None})
+    # Everything up to the closing 'null}' of the placeholder.
+    prefix = head[:-len(b'null}')]
+
+    started = False
+    for chunk in _chunked(items, chunk_size):
+        body = b','.join(renderer.render(serializer.to_representation(item)) for item in chunk)
+        if started:
+            yield b',' + body
+        else:
+            started = True
+            yield prefix + b'[[' + body
+    yield b']]}' if started else prefix + b'[]}'
@@ -0,0 +1,265 @@
+"""
+Full-text search backend for products.
+
+On SQLite builds with FTS5 and the trigram tokenizer, migration 0002 creates
+the ``products_product_fts`` external-content table over ``name`` and
+``description``. Triggers on ``products_product`` keep it in sync on insert,
+update and delete, so bulk writes that bypass model signals are indexed too.
+SQLite drops those triggers whenever a migration rebuilds ``products_product``
+(most AddField/AlterField/RemoveField operations); ``restore_triggers`` puts
+them back after every ``migrate``.
+
+When the table is missing (other database vendors, SQLite without FTS5) or
+the query is too short for trigram matching, search falls back to a
+case-insensitive substring match on the same two columns.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from django.db.models import Count
+from django.db.models import FloatField
+from django.db.models import Q
+
+FTS_TABLE = 'products_product_fts'
+
+# The trigram tokenizer cannot match queries shorter than one trigram.
+FTS_MIN_QUERY_LENGTH = 3
+
+# bm25() column weights, in the column order of FTS_TABLE (name, description).
+FTS_RANK_WEIGHTS = (10.0, 1.0)
+
+# Query parameters of the search filters (see filter_products).
+SEARCH_FILTER_PARAMS = ('price_min', 'price_max', 'in_stock', 'stock_min')
+
+# sort_by values that order by a column the serializer doesn't expose.
+SORT_ALIASES = {'popularity': 'selection_count'}
+
+# Lower bounds of the price facet buckets; the last bucket is open-ended.
+PRICE_FACET_BOUNDS = (0, 10, 25, 50, 100, 250, 500, 1000)
+
+FTS_CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"name, description, content='products_product', content_rowid='id', tokenize='trigram')"
+)
+
+FTS_CREATE_TRIGGERS_SQL = [
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON products_product BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description); "
+    f"END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON products_product BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description) "
+    f"VALUES ('delete', old.id, old.name, old.description); "
+    f"END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description ON products_product BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description) "
+    f"VALUES ('delete', old.id, old.name, old.description); "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description); "
+    f"END",
+]
+
+FTS_CREATE_SQL = [FTS_CREATE_TABLE_SQL, *FTS_CREATE_TRIGGERS_SQL]
+
+FTS_DROP_TRIGGERS_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+]
+
+FTS_DROP_SQL = [
+    *FTS_DROP_TRIGGERS_SQL,
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+FTS_REBUILD_SQL = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+
+# Per-alias cache of whether FTS_TABLE exists, so searches don't introspect sqlite_master.
+_fts_available = {}
+
+
+def fts_supported(connection):
+    """Return True if ``connection`` can create a trigram FTS5 table."""
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.products_fts_probe USING fts5(x, tokenize='trigram')")
+        except Exception:
+            return False
+        cursor.execute("DROP TABLE temp.products_fts_probe")
+    return True
+
+
+def fts_enabled(using=DEFAULT_DB_ALIAS):
+    """Return True if searches on ``using`` should go through the FTS index."""
+    if not getattr(settings, 'PRODUCT_SEARCH_FTS', True):
+        return False
+    if using not in _fts_available:
+        connection = connections[using]
+        _fts_available[using] = (
+            connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_available[using]
+
+
+def fts_checked(using=DEFAULT_DB_ALIAS):
+    """Return True if ``fts_enabled(using)`` is answered without touching the database."""
+    return using in _fts_available or not getattr(settings, 'PRODUCT_SEARCH_FTS', True)
+
+
+def create_index(connection):
+    with connection.cursor() as cursor:
+        for statement in FTS_CREATE_SQL:
+            cursor.execute(statement)
+    _fts_available.clear()
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        for statement in FTS_DROP_SQL:
+            cursor.execute(statement)
+    _fts_available.clear()
+
+
+def restore_triggers(connection):
+    """Recreate missing sync triggers if ``connection`` has the FTS table. Returns whether it has."""
+    if connection.vendor != 'sqlite' or FTS_TABLE not in connection.introspection.table_names():
+        return False
+    with connection.cursor() as cursor:
+        for statement in FTS_CREATE_TRIGGERS_SQL:
+            cursor.execute(statement)
+    return True
+
+
+def drop_triggers(connection):
+    """
+    Stop syncing the FTS table on writes, e.g. around a large import.
+
+    The table stays in place, so searches keep working on the old contents.
+    ``create_index`` restores the triggers; follow it with ``rebuild_index``.
+    """
+    with connection.cursor() as cursor:
+        for statement in FTS_DROP_TRIGGERS_SQL:
+            cursor.execute(statement)
+
+
+def rebuild_index(connection):
+    """Repopulate the FTS table from ``products_product``."""
+    with connection.cursor() as cursor:
+        cursor.execute(FTS_REBUILD_SQL)
+
+
+def fts_match_expression(query):
+    """Quote ``query`` as a single FTS5 phrase so user input is never parsed as syntax."""
+    return '"{}"'.format(query.replace('"', '""'))
+
+
+def search_products(queryset, query, rank=False, using=DEFAULT_DB_ALIAS):
+    """
+    Filter ``queryset`` down to products matching ``query``.
+
+    Returns ``(queryset, ranked)``. ``ranked`` is True when ``rank`` was
+    requested and the queryset was filtered through the FTS index; it then
+    carries a ``search_rank`` annotation (lower is better, as returned by
+    ``bm25()``).
+    """
+    if not query:
+        return queryset, False
+    if len(query) < FTS_MIN_QUERY_LENGTH or not fts_enabled(using):
+        return queryset.filter(Q(name__icontains=query) | Q(description__icontains=query)), False
+
+    match = fts_match_expression(query)
+    queryset = queryset.filter(
+        id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+    )
+    if not rank:
+        return queryset, False
+
+    weights = ', '.join(str(weight) for weight in FTS_RANK_WEIGHTS)
+    queryset = queryset.annotate(
+        search_rank=RawSQL(
+            f"SELECT bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = products_product.id",
+            [match],
+            output_field=FloatField(),
+        )
+    )
+    return queryset, True
+
+
+def build_search_queryset(queryset, query, sort_by, sort_order, sort_fields):
+    """
+    Apply the search view's ``query``/``sort_by``/``sort_order`` parameters to ``queryset``.
+
+    ``sort_by`` must be one of ``sort_fields``, ``'relevance'`` or a key of
+    ``SORT_ALIASES``; anything else leaves the queryset unordered.
+    """
+    products, ranked = search_products(queryset, query, rank=sort_by == 'relevance')
+
+    # Apply sorting based on the sort_by and sort_order parameters
+    if ranked:
+        products = products.order_by('search_rank' if sort_order == 'asc' else '-search_rank')
+    elif sort_by in sort_fields or sort_by in SORT_ALIASES:
+        # Construct the sort field based on sort_by and sort_order
+        field = SORT_ALIASES.get(sort_by, sort_by)
+        sort_field = field if sort_order == 'asc' else f"-{field}"
+        products = products.order_by(sort_field)
+    return products
+
+
+def filter_products(queryset, filters):
+    """
+    Narrow ``queryset`` by the validated search filters.
+
+    ``price_min``/``price_max`` are inclusive bounds, ``stock_min`` is an
+    inclusive lower bound on stock, and ``in_stock`` keeps products with
+    (True) or without (False) stock. Missing or None filters are ignored.
+    """
+    if filters.get('price_min') is not None:
+        queryset = queryset.filter(price__gte=filters['price_min'])
+    if filters.get('price_max') is not None:
+        queryset = queryset.filter(price__lte=filters['price_max'])
+    if filters.get('stock_min') is not None:
+        queryset = queryset.filter(stock__gte=filters['stock_min'])
+    if filters.get('in_stock') is not None:
+        queryset = queryset.filter(stock__gt=0) if filters['in_stock'] else queryset.filter(stock__lte=0)
+    return queryset
+
+
+def _price_buckets():
+    bounds = list(PRICE_FACET_BOUNDS)
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def facet_aggregates():
+    """
+    Conditional counts for every facet bucket, evaluated together in one aggregate query.
+
+    The first bucket also holds prices below its lower bound.
+    """
+    aggregates = dict(total=Count('id'), in_stock=Count('id', filter=Q(stock__gt=0)),
+                      out_of_stock=Count('id', filter=Q(stock__lte=0)))
+    for index, (low, high) in enumerate(_price_buckets()):
+        condition = Q(price__gte=low) if index else Q()
+        if high is not None:
+            condition &= Q(price__lt=high)
+        aggregates[f'price_{index}'] = Count('id', filter=condition) if condition else Count('id')
+    return aggregates
+
+
+def format_facets(result):
+    """Shape the result of ``aggregate(**facet_aggregates())`` for the search response."""
+    return dict(
+        total=result['total'],
+        price=[dict(min=low, max=high, count=result[f'price_{index}'])
+               for index, (low, high) in enumerate(_price_buckets())],
+        stock=dict(in_stock=result['in_stock'], out_of_stock=result['out_of_stock']),
+    )
+
+
+def product_facets(queryset):
+    return format_facets(queryset.aggregate(**facet_aggregates()))
+
+
+async def aproduct_facets(queryset):
+    return format_facets(await queryset.aaggregate(**facet_aggregates()))
@@ -0,0 +1,156 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import Exists
+from django.db.models import F
+from django.db.models import OuterRef
+from django.db.models import Subquery
+from django.db.models.functions import Coalesce
+
+from products.cache import bump_popularity_version
+from products.models import Product
+from products.models import ProductSelection
+from products.serializers import ProductSerializer
+from products.signals import selections_bulk_saved
+
+
+def user_selections(user_id):
+    """The selections of ``user_id`` with their products joined in, reading only the serialized columns."""
+    product_fields = [f'product__{field}' for field in ProductSerializer.Meta.fields]
+    return ProductSelection.objects.filter(user_id=user_id).select_related(
+        'product').only('id', 'user', 'selected', *product_fields)
+
+
+def adjust_selection_counts(product_ids, delta):
+    """
+    Add ``delta`` to the ``selection_count`` of ``product_ids`` with a single
+    ``UPDATE ... SET selection_count = selection_count + delta``.
+
+    Call it inside the transaction that changed the selections; popularity
+    sorted searches are invalidated once it commits.
+    """
+    if not product_ids:
+        return 0
+    updated = Product.objects.filter(id__in=product_ids).update(selection_count=F('selection_count') + delta)
+    transaction.on_commit(bump_popularity_version)
+    return updated
+
+
+def count_selection_changes(user_id, product_ids, selected):
+    """
+    Count or uncount the ``product_ids`` whose selection by ``user_id`` is about to become ``selected``.
+
+    One conditional ``UPDATE`` compares against the stored selections, so
+    it must run before they are written. Make it the first statement of the
+    transaction: on SQLite a transaction that reads before it writes cannot
+    wait for the write lock and fails at once with "database is locked",
+    while one that starts with a write waits up to ``busy_timeout``. Returns
+    how many products changed.
+    """
+    already = ProductSelection.objects.filter(user_id=user_id, product=OuterRef('pk'), selected=True)
+    products = Product.objects.filter(id__in=product_ids)
+    products = products.exclude(Exists(already)) if selected else products.filter(Exists(already))
+    changed = products.update(selection_count=F('selection_count') + (1 if selected else -1))
+    if changed:
+        transaction.on_commit(bump_popularity_version)
+    return changed
+
+
+def create_selection(user_id, product_id):
+    """
+    Select the existing product ``product_id`` for ``user_id``. Returns ``(selection, changed)``.
+
+    A missing selection is created and a deselected one selected again, the
+    same as a queued write-behind select. ``changed`` is False when the
+    product was selected already, and nothing is written then. The
+    transaction starts with the count update (see
+    ``count_selection_changes``), which claims the change.
+    """
+    with transaction.atomic():
+        changed = bool(count_selection_changes(user_id, [product_id], True))
+        if changed:
+            _upsert_selections(user_id, [product_id], True)
+    return ProductSelection(user_id=user_id, product_id=product_id, selected=True), changed
+
+
+def deselect_selection(selection):
+    """
+    Mark ``selection`` as not selected, uncounting it if it was selected.
+
+    The change is claimed with a conditional ``UPDATE ... WHERE selected``,
+    so concurrent deselects of the same selection only uncount it once.
+    """
+    with transaction.atomic():
+        if ProductSelection.objects.filter(pk=selection.pk, selected=True).update(selected=False):
+            adjust_selection_counts([selection.product_id], -1)
+            selections_bulk_saved.send(sender=ProductSelection, user_id=selection.user_id,
+                                       product_ids=[selection.product_id], selected=False, using=DEFAULT_DB_ALIAS)
+    selection.selected = False
+    return selection
+
+
+def split_known_products(product_ids):
+    """
+    Split ``product_ids`` into ``(known, unknown)``: the ids that match a product and the others.
+
+    Both are in request order without duplicates. This is a read, so call it
+    before the transaction that writes the selections (see
+    ``count_selection_changes``).
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    known = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+    return [pk for pk in product_ids if pk in known], [pk for pk in product_ids if pk not in known]
+
+
+def write_selections(user_id, product_ids, selected):
+    """
+    Set the selection state of the existing products ``product_ids`` for ``user_id``.
+
+    Existing selections are updated and missing ones created by a single
+    ``INSERT ... ON CONFLICT (user_id, product_id) DO UPDATE``, after the
+    counts. Call it inside a transaction, before any read in it.
+    """
+    count_selection_changes(user_id, product_ids, selected)
+    _upsert_selections(user_id, product_ids, selected)
+
+
+def _upsert_selections(user_id, product_ids, selected):
+    ProductSelection.objects.bulk_create(
+        [ProductSelection(user_id=user_id, product_id=pk, selected=selected) for pk in product_ids],
+        update_conflicts=True,
+        unique_fields=['user', 'product'],
+        update_fields=['selected'],
+    )
+    selections_bulk_saved.send(sender=ProductSelection, user_id=user_id, product_ids=product_ids,
+                               selected=selected, using=DEFAULT_DB_ALIAS)
+
+
+def apply_selections(user_id, product_ids, selected):
+    """
+    Set the selection state of ``product_ids`` for ``user_id``.
+
+    Returns ``(applied, unknown)``: the ids that were written and the ids
+    that don't match any product, both in request order without duplicates.
+    """
+    applied, unknown = split_known_products(product_ids)
+    if applied:
+        with transaction.atomic():
+            write_selections(user_id, applied, selected)
+    return applied, unknown
+
+
+def reconcile_selection_counts():
+    """
+    Recompute every product's ``selection_count`` from ``ProductSelection`` in one ``UPDATE``.
+
+    Only products whose count drifted (e.g. selections deleted with their
+    user, or written by raw SQL) are written. Returns how many were fixed.
+    """
+    selected = ProductSelection.objects.filter(product=OuterRef('pk'), selected=True).order_by().values(
+        'product').annotate(count=Count('id')).values('count')
+    actual = Coalesce(Subquery(selected), 0)
+    with transaction.atomic():
+        fixed = Product.objects.exclude(selection_count=actual).update(selection_count=actual)
+        if fixed:
+            transaction.on_commit(bump_popularity_version)
+    return fixed
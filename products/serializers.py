@@ -1,5 +1,7 @@
 from rest_framework import serializers
+from rest_framework_simplejwt import serializers as jwt_serializers
 from .models import User, Product, ProductSelection
+from .tokens import FilteredRefreshToken
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -23,21 +25,86 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'price', 'stock']
 
 
+class ProductImportSerializer(ProductSerializer):
+    """ProductSerializer with a writable, optional ``id``, so imports can update existing products."""
+    id = serializers.IntegerField(required=False, min_value=1)
+
+
 class ProductSelectionSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductSelection
         fields = ('user', 'product', 'selected')
 
-    def __init__(self, *args, **kwargs):
-        specified_depth = kwargs.get('context')
-        if specified_depth:
-            self.Meta.depth = specified_depth.get('depth')
-        else:
-            self.Meta.depth = 0
-
-        super(ProductSelectionSerializer, self).__init__(*args, **kwargs)
-
     def update(self, instance, validated_data):
         instance.selected = validated_data.get('selected', instance.selected)
         instance.save()
         return instance
+
+
+class UserProductSelectionSerializer(serializers.ModelSerializer):
+    """
+    Read-only selection with its product nested.
+
+    Declares the nesting explicitly instead of adjusting ``Meta.depth``,
+    which is class-level state shared by concurrent requests. ``user`` is
+    rendered from ``user_id`` and never loads the user row.
+    """
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
+    product = ProductSerializer(read_only=True)
+
+    class Meta:
+        model = ProductSelection
+        fields = ('user', 'product', 'selected')
+        read_only_fields = fields
+
+
+class ProductSearchFilterSerializer(serializers.Serializer):
+    """Validates the filter query parameters of the product search."""
+    price_min = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=0, required=False)
+    price_max = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=0, required=False)
+    # default=None, or a missing query parameter would read as False.
+    in_stock = serializers.BooleanField(allow_null=True, default=None)
+    stock_min = serializers.IntegerField(required=False)
+    facets = serializers.BooleanField(default=False)
+    include_selected = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        price_min, price_max = attrs.get('price_min'), attrs.get('price_max')
+        if price_min is not None and price_max is not None and price_min > price_max:
+            raise serializers.ValidationError({'price_max': 'Must not be lower than price_min.'})
+        return attrs
+
+
+class ProductSelectionBatchSerializer(serializers.Serializer):
+    product_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                        max_length=1000)
+    selected = serializers.BooleanField(default=True)
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    token_class = FilteredRefreshToken
+
+
+class TokenBlacklistSerializer(jwt_serializers.TokenBlacklistSerializer):
+    """Keeps the blacklisted token on ``self.token`` so the view can act on its claims."""
+    token_class = FilteredRefreshToken
+
+    def validate(self, attrs):
+        self.token = self.token_class(attrs["refresh"])
+        try:
+            self.token.blacklist()
+        except AttributeError:
+            pass
+        return {}
+
+
+class StockReservationSerializer(serializers.Serializer):
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+
+class StockReservationItemSerializer(StockReservationSerializer):
+    product = serializers.IntegerField(min_value=1)
+
+
+class StockReservationBatchSerializer(serializers.Serializer):
+    items = serializers.ListField(child=StockReservationItemSerializer(), allow_empty=False, max_length=1000)
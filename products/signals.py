@@ -0,0 +1,115 @@
+from django.contrib.auth import get_user_model
+from django.core.signals import request_finished
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_migrate
+from django.db.models.signals import post_save
+from django.dispatch import Signal
+from django.dispatch import receiver
+
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from products.authentication import invalidate_user
+from products.cache import bump_catalog_version
+from products.cache import bump_selection_version
+from products.db import configure_connection
+from products.metrics import install_query_recorder
+from products.models import Product
+from products.models import ProductSelection
+from products.search import restore_triggers
+from products.snapshots import apply_selection_changes
+from products.snapshots import persist_searches
+from products.suggest import suggest_index
+
+# Sent by code paths that write products with bulk_create(), which skips
+# post_save. Arguments: ``products`` (the saved instances) and ``using``.
+products_bulk_saved = Signal()
+
+# Sent by code paths that write a user's selections with bulk_create().
+# Arguments: ``user_id``, ``product_ids``, ``selected`` and ``using``.
+selections_bulk_saved = Signal()
+
+
+# Derived state is only touched once the write is committed. Bumping the
+# catalog version earlier would let a concurrent search cache pre-commit rows
+# under the new version.
+
+@receiver(post_save, sender=Product, dispatch_uid='products_catalog_saved')
+def product_saved(sender, instance, **kwargs):
+    pk, name = instance.pk, instance.name
+
+    def apply():
+        suggest_index.add(pk, name, bump_catalog_version())
+
+    transaction.on_commit(apply, using=kwargs.get('using'))
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='products_catalog_deleted')
+def product_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+
+    def apply():
+        suggest_index.remove(pk, bump_catalog_version())
+
+    transaction.on_commit(apply, using=kwargs.get('using'))
+
+
+@receiver(products_bulk_saved, dispatch_uid='products_catalog_bulk_saved')
+def products_bulk_saved_handler(sender, products, using=None, **kwargs):
+    names = {product.pk: product.name for product in products}
+
+    def apply():
+        suggest_index.add_many(names, bump_catalog_version())
+
+    transaction.on_commit(apply, using=using)
+
+
+@receiver(post_save, sender=ProductSelection, dispatch_uid='products_selection_saved')
+@receiver(post_delete, sender=ProductSelection, dispatch_uid='products_selection_deleted')
+def selection_changed(sender, instance, signal, **kwargs):
+    user_id = instance.user_id
+    changes = {instance.product_id: instance.selected and signal is post_save}
+
+    def apply():
+        apply_selection_changes(user_id, bump_selection_version(user_id), changes)
+
+    transaction.on_commit(apply, using=kwargs.get('using'))
+
+
+@receiver(selections_bulk_saved, dispatch_uid='products_selections_bulk_saved')
+def selections_bulk_saved_handler(sender, user_id, product_ids, selected, using=None, **kwargs):
+    changes = dict.fromkeys(product_ids, selected)
+
+    def apply():
+        apply_selection_changes(user_id, bump_selection_version(user_id), changes)
+
+    transaction.on_commit(apply, using=using)
+
+
+@receiver(post_save, sender=get_user_model(), dispatch_uid='products_user_saved')
+@receiver(post_delete, sender=get_user_model(), dispatch_uid='products_user_deleted')
+def user_changed(sender, instance, **kwargs):
+    user_id = getattr(instance, jwt_settings.USER_ID_FIELD)
+    transaction.on_commit(lambda: invalidate_user(user_id), using=kwargs.get('using'))
+
+
+@receiver(post_migrate, dispatch_uid='products_search_triggers')
+def migrated(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    if sender.name == 'products':
+        restore_triggers(connections[using])
+
+
+@receiver(request_finished, dispatch_uid='products_search_snapshots')
+def request_done(sender, **kwargs):
+    # Outside the view, so search views stay read-only; never inside a transaction someone else opened.
+    if not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        persist_searches()
+
+
+@receiver(connection_created, dispatch_uid='products_query_recorder')
+def connection_opened(sender, connection, **kwargs):
+    configure_connection(connection)
+    install_query_recorder(connection)
@@ -0,0 +1,125 @@
+"""
+Single-flight coalescing of identical concurrent work.
+
+When many requests need the same search page at the same moment (and it
+isn't cached yet), only the first one runs the query and serializes it; the
+others wait for that result instead of repeating it. ``SingleFlight`` does
+this for threads (WSGI), ``AsyncSingleFlight`` for coroutines on one event
+loop (ASGI). Keys are the search cache keys, which already normalize the
+query parameters and embed the catalog version.
+
+Results are shared, not copied: callers must not modify them in place, the
+same rule as for search cache entries. A leader's exception is raised in
+every waiting request too. Each coalesced request is counted in
+``request_metrics``.
+"""
+import asyncio
+import threading
+
+from django.conf import settings
+
+from products.metrics import request_metrics
+
+SEARCH_SINGLE_FLIGHT_DEFAULTS = {
+    'ENABLED': True,
+    # Seconds a request waits for another one's result before running the work itself.
+    'TIMEOUT': 10,
+}
+
+
+def get_single_flight_settings():
+    return {**SEARCH_SINGLE_FLIGHT_DEFAULTS, **getattr(settings, 'SEARCH_SINGLE_FLIGHT', {})}
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs ``fn`` once per key among concurrent threads."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        config = get_single_flight_settings()
+        if not config['ENABLED']:
+            return fn()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(config['TIMEOUT']):
+                request_metrics.count_coalesced(self.kind)
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            return fn()
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """Awaits ``fn()`` once per key among concurrent coroutines of the same event loop."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self._calls = {}
+
+    async def do(self, key, fn):
+        config = get_single_flight_settings()
+        if not config['ENABLED']:
+            return await fn()
+        # Futures belong to one loop; requests on different loops don't share.
+        loop_key = (asyncio.get_running_loop(), key)
+        future = self._calls.get(loop_key)
+        if future is not None:
+            done, _ = await asyncio.wait({future}, timeout=config['TIMEOUT'])
+            if not done:
+                return await fn()
+            if future.cancelled():
+                # The leader's request was cancelled (say, its client went away), not ours: start over.
+                return await self.do(key, fn)
+            request_metrics.count_coalesced(self.kind)
+            return future.result()
+
+        future = self._calls[loop_key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved here so an exception nobody waited for isn't logged as unhandled.
+            future.exception()
+            raise
+        finally:
+            del self._calls[loop_key]
+
+
+search_flight = SingleFlight('search')
+facets_flight = SingleFlight('facets')
+async_search_flight = AsyncSingleFlight('search')
+async_facets_flight = AsyncSingleFlight('facets')
@@ -0,0 +1,213 @@
+"""
+Per-user session snapshots for ``/api/session/restore/``.
+
+The selected ids also back the ``include_selected`` flags of the product
+search.
+
+A snapshot has two parts, stored separately so that updating one never
+overwrites a concurrent update of the other:
+
+- ``search``: the query parameters of the user's last search page, cached
+  under a key of the ``SESSION_SNAPSHOT`` alias. They can't be rebuilt from
+  anything else, so they are also kept in a ``SearchSnapshot`` row, which
+  survives restarts and is shared by every process. Search views are
+  read-only and never write that row themselves: they queue the parameters,
+  and ``persist_searches()`` upserts everything queued in one statement once
+  the response is done (``request_finished``), at most every
+  ``PERSIST_INTERVAL`` seconds per process. A failed write is logged and
+  retried later, so it never fails a search; a stopped process loses what
+  was queued, which the cache still holds. Restore reads the queue and then
+  the row when the cache misses.
+- ``selected``: the ids of the products the user has selected, tagged with
+  the selection version (``products.cache``) they reflect, under a key of the
+  cache alias configured in ``SESSION_SNAPSHOT``.
+
+Both parts expire after ``SESSION_SNAPSHOT['TIMEOUT']`` seconds.
+
+Selection writes patch the id list in place once committed (see
+``products.signals``). A patch is only applied on top of the version
+directly before the one it produced; otherwise the list is dropped. Restore
+only trusts a list whose version matches the current one and rebuilds it
+with a single query when it doesn't, so a lost or reordered patch costs one
+query instead of a wrong answer.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import DatabaseError
+from django.utils import timezone
+
+from products.cache import get_selection_version
+from products.models import ProductSelection
+from products.models import SearchSnapshot
+from products.search import SEARCH_FILTER_PARAMS
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = 'products:session:{user_id}:{part}'
+SNAPSHOT_SEARCH_PARAMS = ('query', 'sort_by', 'sort_order', 'page_size', 'cursor', *SEARCH_FILTER_PARAMS)
+
+SESSION_SNAPSHOT_DEFAULTS = {
+    'ALIAS': 'default',
+    'TIMEOUT': 30 * 24 * 60 * 60,
+    'PERSIST_INTERVAL': 5,
+}
+
+
+def get_session_snapshot_settings():
+    return {**SESSION_SNAPSHOT_DEFAULTS, **getattr(settings, 'SESSION_SNAPSHOT', {})}
+
+
+def _cache():
+    return caches[get_session_snapshot_settings()['ALIAS']]
+
+
+def _key(user_id, part):
+    return SNAPSHOT_KEY.format(user_id=user_id, part=part)
+
+
+def _set(user_id, part, value):
+    _cache().set(_key(user_id, part), value, timeout=get_session_snapshot_settings()['TIMEOUT'])
+
+
+def _search_params(params):
+    return {name: params[name] for name in SNAPSHOT_SEARCH_PARAMS if params.get(name)}
+
+
+# A single INSERT ... ON CONFLICT statement, so recording never reads before it writes.
+_UPSERT = dict(update_conflicts=True, unique_fields=['user'], update_fields=['params', 'recorded_at'])
+
+
+_queued = {}  # user id -> (params, recorded_at) not written to SearchSnapshot yet
+_queue_lock = threading.Lock()
+_persisted_at = float('-inf')
+
+
+def _queue(user_id, search):
+    with _queue_lock:
+        _queued[user_id] = (search, timezone.now())
+
+
+def record_search(user_id, params):
+    """Remember the search parameters of the page ``user_id`` just fetched. Never touches the database."""
+    search = _search_params(params)
+    if _cache().get(_key(user_id, 'search')) == search:
+        return
+    _set(user_id, 'search', search)
+    _queue(user_id, search)
+
+
+async def arecord_search(user_id, params):
+    """``record_search()`` for async views."""
+    search = _search_params(params)
+    cache = _cache()
+    if await cache.aget(_key(user_id, 'search')) == search:
+        return
+    await cache.aset(_key(user_id, 'search'), search, timeout=get_session_snapshot_settings()['TIMEOUT'])
+    _queue(user_id, search)
+
+
+def persist_searches(force=False):
+    """
+    Upsert the queued search parameters into ``SearchSnapshot`` in one statement. Returns how many were written.
+
+    Does nothing until ``PERSIST_INTERVAL`` seconds have passed since the
+    last write, unless ``force``. On a database error the parameters stay
+    queued for the next call.
+    """
+    global _persisted_at
+    interval = get_session_snapshot_settings()['PERSIST_INTERVAL']
+    with _queue_lock:
+        if not _queued or not force and time.monotonic() - _persisted_at < interval:
+            return 0
+        batch = dict(_queued)
+        _queued.clear()
+        _persisted_at = time.monotonic()
+    try:
+        # Users deleted since their search was queued would fail the whole statement.
+        users = list(User.objects.filter(pk__in=batch).values_list('pk', flat=True))
+        SearchSnapshot.objects.bulk_create(
+            [SearchSnapshot(user_id=user_id, params=batch[user_id][0], recorded_at=batch[user_id][1])
+             for user_id in users], **_UPSERT)
+    except DatabaseError:
+        logger.warning("Saving %d search snapshots failed; they stay queued.", len(batch), exc_info=True)
+        with _queue_lock:
+            # Searches recorded since the batch was taken are newer and win.
+            for user_id, queued in batch.items():
+                _queued.setdefault(user_id, queued)
+        return 0
+    return len(users)
+
+
+def apply_selection_changes(user_id, version, changes):
+    """
+    Patch the selected ids of ``user_id`` with ``changes`` (product id -> selected).
+
+    ``version`` is the selection version the write produced.
+    """
+    cache = _cache()
+    key = _key(user_id, 'selected')
+    snapshot = cache.get(key)
+    if snapshot is None:
+        return
+    if snapshot['version'] != version - 1:
+        cache.delete(key)
+        return
+    selected = set(snapshot['ids'])
+    for product_id, is_selected in changes.items():
+        if is_selected:
+            selected.add(product_id)
+        else:
+            selected.discard(product_id)
+    _set(user_id, 'selected', dict(version=version, ids=sorted(selected)))
+
+
+def get_snapshot(user_id):
+    """The ``(search, selected)`` parts of ``user_id``'s snapshot, either None when missing."""
+    parts = _cache().get_many([_key(user_id, 'search'), _key(user_id, 'selected')])
+    search = parts.get(_key(user_id, 'search'))
+    if search is None:
+        with _queue_lock:
+            search = _queued.get(user_id, (None,))[0]
+    if search is None:
+        recorded_since = timezone.now() - timedelta(seconds=get_session_snapshot_settings()['TIMEOUT'])
+        search = (SearchSnapshot.objects.filter(user_id=user_id, recorded_at__gte=recorded_since)
+                  .values_list('params', flat=True).first())
+        if search is not None:
+            _set(user_id, 'search', search)
+    return search, parts.get(_key(user_id, 'selected'))
+
+
+def load_selected_ids(user_id, version):
+    """Read the selected product ids of ``user_id`` in one query and store them under ``version``."""
+    ids = list(ProductSelection.objects.filter(user_id=user_id, selected=True)
+               .order_by('product_id').values_list('product_id', flat=True))
+    _set(user_id, 'selected', dict(version=version, ids=ids))
+    return ids
+
+
+def selected_product_ids(user_id, selected=None):
+    """
+    The selected product ids of ``user_id``, from the snapshot when it is current.
+
+    ``selected`` is the snapshot's ``selected`` part when the caller already
+    fetched it; otherwise it is read from the cache.
+    """
+    version = get_selection_version(user_id)
+    if selected is None:
+        selected = _cache().get(_key(user_id, 'selected'))
+    if selected is not None and selected['version'] == version:
+        return selected['ids']
+    return load_selected_ids(user_id, version)
+
+
+def clear_snapshot(user_id):
+    with _queue_lock:
+        _queued.pop(user_id, None)
+    SearchSnapshot.objects.filter(user_id=user_id).delete()
+    _cache().delete_many([_key(user_id, 'search'), _key(user_id, 'selected')])
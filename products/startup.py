@@ -0,0 +1,22 @@
+import logging
+
+from django.db import DatabaseError
+
+from products.blacklist import blacklist_filter
+from products.suggest import suggest_index
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """
+    Load the per-process in-memory indexes when the WSGI/ASGI application starts.
+
+    Each index also loads lazily on first use, so a database that isn't
+    migrated yet only costs a warning here.
+    """
+    for name, index in [('product suggestion index', suggest_index), ('token blacklist filter', blacklist_filter)]:
+        try:
+            index.load()
+        except DatabaseError:
+            logger.warning("%s not loaded at startup; it will load on first use.", name.capitalize())
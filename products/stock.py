@@ -0,0 +1,172 @@
+"""
+Stock reservations without read-modify-write.
+
+A reservation is one conditional ``UPDATE ... SET stock = stock - n WHERE
+stock >= n``. It either takes the stock or changes nothing. It never reads
+the row first and holds no lock beyond that statement, so concurrent
+reservations can neither oversell nor lose each other's updates.
+
+Very hot products can be split into ``StockShard`` rows with
+``shard_stock()``. Their reservations decrement one randomly chosen shard
+that has enough stock, so concurrent checkouts spread over several rows
+instead of queueing on one. A single reservation must fit in one shard. The
+shards are authoritative; ``Product.stock`` of a sharded product is their
+sum, refreshed after reservations at most every ``SHARD_REFRESH_INTERVAL``
+seconds per process, so searches show it slightly behind. On SQLite every
+write takes the database's single writer lock, so sharding only pays off on
+databases with row-level locks.
+
+Every reservation that changes ``Product.stock`` bumps the stock version,
+which drops the cached search pages and ETags that show stock counts (see
+``products.cache``). Only a product selling out or coming back in stock
+bumps the catalog version, since only that changes what the ``in_stock``
+filters and facets match; the facet counts and the other caches keyed on the
+catalog version survive a checkout rush.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists
+from django.db.models import F
+from django.db.models import OuterRef
+from django.db.models import Subquery
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+from products.cache import LRUCache
+from products.cache import bump_catalog_version
+from products.cache import bump_stock_version
+from products.models import Product
+from products.models import StockShard
+
+STOCK_RESERVATION_DEFAULTS = {
+    'SHARD_REFRESH_INTERVAL': 1.0,
+}
+
+# Products refreshed most recently by this process -> when; see refresh_sharded_stock.
+_refreshed = LRUCache(1024)
+_refreshed_lock = threading.Lock()
+
+
+def get_stock_reservation_settings():
+    return {**STOCK_RESERVATION_DEFAULTS, **getattr(settings, 'STOCK_RESERVATION', {})}
+
+
+def _shard_total(product_id):
+    return Coalesce(Subquery(StockShard.objects.filter(product_id=product_id).order_by().values(
+        'product').annotate(total=Sum('stock')).values('total')), 0)
+
+
+def reserve_stock(product_id, quantity):
+    """
+    Take ``quantity`` units of ``product_id``'s stock.
+
+    Returns True when reserved and False when there isn't enough stock.
+    Raises Product.DoesNotExist for unknown products. Unsharded products
+    need a single statement, or two when the reservation sells them out.
+    """
+    with transaction.atomic():
+        unsharded = Product.objects.filter(~Exists(StockShard.objects.filter(product=OuterRef('pk'))), pk=product_id)
+        if unsharded.filter(stock__gt=quantity).update(stock=F('stock') - quantity):
+            transaction.on_commit(bump_stock_version)
+            return True
+        if unsharded.filter(stock=quantity).update(stock=0):
+            transaction.on_commit(bump_catalog_version)
+            return True
+        if _reserve_from_shard(product_id, quantity):
+            transaction.on_commit(lambda: refresh_sharded_stock(product_id))
+            return True
+        if not Product.objects.filter(pk=product_id).exists():
+            raise Product.DoesNotExist(f"Product {product_id} doesn't exist")
+        return False
+
+
+def _reserve_from_shard(product_id, quantity):
+    # Reading the candidates takes no lock; a shard drained in between just fails its UPDATE and the next is tried.
+    candidates = list(StockShard.objects.filter(product_id=product_id, stock__gte=quantity)
+                      .values_list('index', flat=True))
+    random.shuffle(candidates)
+    for index in candidates:
+        if StockShard.objects.filter(product_id=product_id, index=index, stock__gte=quantity).update(
+                stock=F('stock') - quantity):
+            return True
+    return False
+
+
+def reserve_stock_batch(quantities):
+    """
+    Reserve every ``product id -> quantity`` of ``quantities`` in one transaction, or none of them.
+
+    Returns ``(insufficient, unknown)`` product ids; both are empty when the
+    reservation went through.
+    """
+    insufficient, unknown = [], []
+    with transaction.atomic():
+        for product_id, quantity in quantities.items():
+            try:
+                if not reserve_stock(product_id, quantity):
+                    insufficient.append(product_id)
+            except Product.DoesNotExist:
+                unknown.append(product_id)
+        if insufficient or unknown:
+            transaction.set_rollback(True)
+    return insufficient, unknown
+
+
+def available_stock(product_id):
+    """The current stock of ``product_id``, summing its shards when it is sharded."""
+    product = Product.objects.annotate(
+        sharded=Exists(StockShard.objects.filter(product=OuterRef('pk'))),
+        shard_total=_shard_total(OuterRef('pk')),
+    ).values('stock', 'sharded', 'shard_total').get(pk=product_id)
+    return product['shard_total'] if product['sharded'] else product['stock']
+
+
+def refresh_sharded_stock(product_id, force=False):
+    """
+    Set ``Product.stock`` of a sharded product to the sum of its shards.
+
+    Skipped when this process refreshed the product less than
+    ``SHARD_REFRESH_INTERVAL`` seconds ago, unless ``force`` is set, so a
+    burst of reservations doesn't turn back into writes to one row. Returns
+    whether it refreshed.
+    """
+    now = time.monotonic()
+    interval = get_stock_reservation_settings()['SHARD_REFRESH_INTERVAL']
+    with _refreshed_lock:
+        last = _refreshed.get(product_id)
+        if not force and last is not None and now - last < interval:
+            return False
+        _refreshed.set(product_id, now)
+    total = StockShard.objects.filter(product_id=product_id).aggregate(total=Coalesce(Sum('stock'), 0))['total']
+    product = Product.objects.filter(pk=product_id)
+    # Matches only when the refresh sells the product out or brings it back in stock.
+    crossing = product.filter(stock__gt=0) if total <= 0 else product.filter(stock__lte=0)
+    if crossing.update(stock=total):
+        bump_catalog_version()
+    elif product.exclude(stock=total).update(stock=total):
+        bump_stock_version()
+    return True
+
+
+def shard_stock(product_id, shards):
+    """
+    Spread the stock of ``product_id`` evenly over ``shards`` StockShard rows.
+
+    Re-sharding keeps the total. ``shards=0`` folds the stock back into
+    ``Product.stock`` and makes the product unsharded again.
+    """
+    with transaction.atomic():
+        total = available_stock(product_id)
+        StockShard.objects.filter(product_id=product_id).delete()
+        if shards:
+            base, extra = divmod(total, shards)
+            StockShard.objects.bulk_create([StockShard(product_id=product_id, index=index,
+                                                       stock=base + (1 if index < extra else 0))
+                                            for index in range(shards)])
+        Product.objects.filter(pk=product_id).update(stock=total)
+        transaction.on_commit(bump_catalog_version)
+    return total
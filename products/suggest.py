@@ -0,0 +1,189 @@
+"""
+In-memory prefix index for product name suggestions.
+
+Each process keeps a sorted list of ``(normalized name, id)`` pairs. A prefix
+lookup is a binary search followed by a short forward scan, so suggestions
+never touch the database. The index is loaded once (at startup, or lazily on
+first use) and kept current from Product signals.
+
+Signals only fire in the process that wrote, so the index also remembers the
+catalog version (see ``products.cache``) it was loaded at. Changes from this
+process advance it in step; when the shared catalog version has moved on
+anyway, another process wrote, and the index is reloaded. That check runs at
+most once every ``SYNC_INTERVAL`` seconds, which bounds how stale other
+processes' writes can be here.
+"""
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from bisect import insort
+
+from django.conf import settings
+
+from products.cache import get_catalog_version
+from products.models import Product
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_SUGGEST_INDEX_DEFAULTS = {
+    'SYNC_INTERVAL': 5,
+}
+
+# Batches larger than this are merged with one pass and a sort instead of an insort per name.
+MERGE_THRESHOLD = 32
+
+
+def normalize(name):
+    return ' '.join(name.casefold().split())
+
+
+class PrefixIndex:
+
+    def __init__(self):
+        self._entries = []
+        self._names = {}
+        self._lock = threading.RLock()
+        self._load_lock = threading.RLock()
+        # Changes made while a load reads the database, applied on top of what it read.
+        self._loading_changes = None
+        self._checked_at = 0.0
+        self.version = None
+        self.loaded = False
+        self.build_seconds = None
+
+    @property
+    def config(self):
+        return {**PRODUCT_SUGGEST_INDEX_DEFAULTS, **getattr(settings, 'PRODUCT_SUGGEST_INDEX', {})}
+
+    def load(self):
+        """Rebuild the index from the database."""
+        with self._load_lock:
+            started = time.perf_counter()
+            with self._lock:
+                self._loading_changes = {}
+            try:
+                # Read before the names: a write committed in between makes the next sync reload again.
+                version = get_catalog_version()
+                names = dict(Product.objects.values_list('id', 'name').iterator(chunk_size=10000))
+            except BaseException:
+                with self._lock:
+                    self._loading_changes = None
+                raise
+            with self._lock:
+                for pk, name in self._loading_changes.items():
+                    if name is None:
+                        names.pop(pk, None)
+                    else:
+                        names[pk] = name
+                self._entries = sorted((normalize(name), pk) for pk, name in names.items())
+                self._names, self._loading_changes = names, None
+                self.version, self._checked_at = version, time.monotonic()
+                self.loaded = True
+                self.build_seconds = time.perf_counter() - started
+
+        stats = self.stats()
+        logger.info("Loaded product suggestion index: %(entries)d names, %(memory_bytes)d bytes "
+                    "in %(build_seconds).3fs", stats)
+        return stats
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self._load_lock:
+                if not self.loaded:
+                    self.load()
+
+    def sync(self):
+        """Reload if another process changed the catalog, checking at most every ``SYNC_INTERVAL`` seconds."""
+        if time.monotonic() - self._checked_at < self.config['SYNC_INTERVAL']:
+            return
+        self._checked_at = time.monotonic()
+        # A reload already running in another thread serves this request too.
+        if get_catalog_version() != self.version and self._load_lock.acquire(blocking=False):
+            try:
+                self.load()
+            finally:
+                self._load_lock.release()
+
+    def add(self, pk, name, version=None):
+        self.apply({pk: name}, version)
+
+    def add_many(self, names, version=None):
+        """Add or rename every ``id -> name`` of ``names``."""
+        self.apply(dict(names), version)
+
+    def remove(self, pk, version=None):
+        self.apply({pk: None}, version)
+
+    def apply(self, changes, version=None):
+        """
+        Apply ``id -> name`` changes, None meaning removed, written at catalog ``version``.
+
+        The index only advances to ``version`` when it directly follows the
+        one it is at; otherwise the changes are still applied, and the next
+        ``sync`` reloads whatever else it missed.
+        """
+        with self._lock:
+            if self._loading_changes is not None:
+                self._loading_changes.update(changes)
+            if not self.loaded:
+                return
+            if len(changes) > MERGE_THRESHOLD:
+                self._merge(changes)
+            else:
+                for pk, name in changes.items():
+                    self._discard(pk)
+                    if name is not None:
+                        self._names[pk] = name
+                        insort(self._entries, (normalize(name), pk))
+            if version is not None and self.version is not None and version == self.version + 1:
+                self.version = version
+
+    def _merge(self, changes):
+        entries = [entry for entry in self._entries if entry[1] not in changes]
+        for pk, name in changes.items():
+            if name is None:
+                self._names.pop(pk, None)
+            else:
+                self._names[pk] = name
+                entries.append((normalize(name), pk))
+        entries.sort()
+        self._entries = entries
+
+    def _discard(self, pk):
+        name = self._names.pop(pk, None)
+        if name is None:
+            return
+        entry = (normalize(name), pk)
+        position = bisect_left(self._entries, entry)
+        if position < len(self._entries) and self._entries[position] == entry:
+            del self._entries[position]
+
+    def suggest(self, prefix, limit):
+        """Return up to ``limit`` ``(id, name)`` pairs whose normalized name starts with ``prefix``."""
+        self.ensure_loaded()
+        self.sync()
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        suggestions = []
+        with self._lock:
+            position = bisect_left(self._entries, (prefix,))
+            for normalized, pk in self._entries[position:position + limit]:
+                if not normalized.startswith(prefix):
+                    break
+                suggestions.append((pk, self._names[pk]))
+        return suggestions
+
+    def stats(self):
+        with self._lock:
+            memory = sys.getsizeof(self._entries) + sys.getsizeof(self._names)
+            for normalized, pk in self._entries:
+                memory += sys.getsizeof((normalized, pk)) + sys.getsizeof(normalized) + sys.getsizeof(pk)
+                memory += sys.getsizeof(self._names[pk])
+            return dict(entries=len(self._entries), memory_bytes=memory, build_seconds=self.build_seconds)
+
+
+suggest_index = PrefixIndex()
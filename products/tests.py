@@ -1,3 +1,1655 @@
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.db import OperationalError
+from django.db import connection
+from django.db import connections
+from django.db import transaction
+from django.db.models import QuerySet
 from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from product_manager.utils import create_json_response
+from products.authentication import user_cache
+from products.blacklist import blacklist_filter
+from products.benchmarks import BENCHMARK_USER_PREFIX
+from products.benchmarks import InProcessRunner
+from products.benchmarks import ROUTES
+from products.benchmarks import percentile
+from products.benchmarks import run_benchmark
+from products.benchmarks import seed_catalog
+from products.bulk import upsert_products
+from products.cache import bump_catalog_version
+from products.cache import get_catalog_version
+from products.cache import search_cache
+from products.db import get_sqlite_pragmas
+from products.db import read_database
+from products.metrics import request_metrics
+from products.models import ImportCheckpoint
+from products.models import Product
+from products.models import ProductSelection
+from products.models import SearchSnapshot
+from products.models import StockShard
+from products.renderers import EnvelopeJSONRenderer
+from products.search import FTS_TABLE
+from products.search import search_products
+from products.selections import apply_selections
+from products.selections import create_selection
+from products.selections import deselect_selection
+from products.selections import reconcile_selection_counts
+from products.serializers import ProductSerializer
+from products.singleflight import AsyncSingleFlight
+from products.snapshots import clear_snapshot
+from products.snapshots import persist_searches
+from products.singleflight import SingleFlight
+from products import stock
+from products.stock import available_stock
+from products.stock import refresh_sharded_stock
+from products.stock import shard_stock
+from products.suggest import PrefixIndex
+from products.suggest import suggest_index
+from products.tokens import FilteredRefreshToken
+from products.views import ProductBulkCreateView
+from products.views import ProductSearchView
+from products.views import product_row_encoder
+from products.writebehind import SelectionWriteBuffer
+from products.writebehind import selection_buffer
+
+
+def sqlite_objects(kind, prefix):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = %s AND name LIKE %s", [kind, f'{prefix}%'])
+        return sorted(row[0] for row in cursor.fetchall())
+
+
+@override_settings(PRODUCT_SEARCH_CACHE={'ENABLED': False})
+class FullTextSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('searcher', 'searcher@example.com', 'password')
+        cls.desk_lamp = Product.objects.create(name='Desk lamp', description='brass', price=Decimal('30'), stock=1)
+        cls.chair = Product.objects.create(name='Chair', description='goes well with a lamp', price=Decimal('50'),
+                                           stock=1)
+        cls.table = Product.objects.create(name='Table', description='oak', price=Decimal('90'), stock=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, query, **params):
+        response = self.client.get('/api/product/search/', dict(params, query=query))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        return [product['id'] for product in data[0]] if data else []
+
+    def test_matches_names_and_descriptions_and_ranks_names_first(self):
+        self.assertEqual(self.search('LAMP', sort_by='relevance'), [self.desk_lamp.id, self.chair.id])
+        self.assertEqual(self.search('lamp', sort_by='relevance', sort_order='desc'),
+                         [self.chair.id, self.desk_lamp.id])
+        self.assertEqual(self.search('amp', sort_by='price', sort_order='desc'), [self.chair.id, self.desk_lamp.id])
+        self.assertEqual(self.search('"lamp'), [])
+
+    def test_short_queries_match_names_and_descriptions_too(self):
+        self.assertEqual(self.search('oa', sort_by='id'), [self.table.id])
+        self.assertEqual(self.search('ch', sort_by='id'), [self.chair.id])
+
+    def test_triggers_follow_writes_that_bypass_signals(self):
+        Product.objects.filter(pk=self.table.pk).update(name='Lamp table')
+        self.assertEqual(self.search('lamp table'), [self.table.id])
+        Product.objects.filter(pk=self.chair.pk).update(description='plain')
+        self.assertEqual(self.search('lamp', sort_by='id'), [self.desk_lamp.id, self.table.id])
+        Product.objects.filter(pk=self.desk_lamp.pk).delete()
+        self.assertEqual(self.search('lamp'), [self.table.id])
+        self.assertEqual(self.search('brass'), [])
+
+
+class SearchIndexMigrationTests(TransactionTestCase):
+    databases = '__all__'
+
+    def test_triggers_survive_migrations_that_rebuild_the_product_table(self):
+        triggers = sqlite_objects('trigger', FTS_TABLE)
+        self.assertEqual(len(triggers), 3)
+        # 0004 adds a column, which makes SQLite rebuild products_product without its triggers.
+        call_command('migrate', 'products', '0003', verbosity=0)
+        call_command('migrate', 'products', verbosity=0)
+        self.assertEqual(sqlite_objects('trigger', FTS_TABLE), triggers)
+
+        product = Product.objects.create(name='Floor lamp', description='tall', price=Decimal('10'), stock=1)
+        Product.objects.filter(pk=product.pk).update(description='short')
+        self.assertEqual(list(search_products(Product.objects.all(), 'short')[0].values_list('id', flat=True)),
+                         [product.id])
+        self.assertFalse(search_products(Product.objects.all(), 'tall')[0].exists())
+
+
+def encode_cursor(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+
+@override_settings(PRODUCT_SEARCH_CACHE={'ENABLED': False})
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('pager', 'pager@example.com', 'password')
+        for index, price in enumerate([5, 5, 5, 3, 3, 1, 9]):
+            Product.objects.create(name=f'product {index % 3}', description='description', price=Decimal(price),
+                                   stock=index)
+        apply_selections(cls.user.id, list(Product.objects.values_list('id', flat=True)), True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, params):
+        pages, payload = [], self.client.get(url, params).json()
+        while True:
+            pages.append(payload['data'][0])
+            if not payload['next']:
+                break
+            payload = self.client.get(url, dict(params, cursor=payload['next'])).json()
+        backwards = [payload['data'][0]]
+        while payload['prev']:
+            payload = self.client.get(url, dict(params, cursor=payload['prev'])).json()
+            backwards.insert(0, payload['data'][0])
+        self.assertEqual(backwards, pages)
+        return pages
+
+    def test_pages_follow_the_sort_order_across_ties(self):
+        for sort_by, sort_order in [('price', 'asc'), ('price', 'desc'), ('name', 'asc'), ('stock', 'desc')]:
+            with self.subTest(sort_by=sort_by, sort_order=sort_order):
+                pages = self.walk('/api/product/search/', dict(sort_by=sort_by, sort_order=sort_order, page_size=2))
+                prefix = '-' if sort_order == 'desc' else ''
+                expected = list(Product.objects.order_by(f'{prefix}{sort_by}', f'{prefix}id')
+                                .values_list('id', flat=True))
+                self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+                self.assertEqual([product['id'] for page in pages for product in page], expected)
+
+    def test_user_products_are_paged_by_id(self):
+        pages = self.walk('/api/user/products/', dict(page_size=3))
+        self.assertEqual([row['product']['id'] for page in pages for row in page],
+                         list(ProductSelection.objects.filter(user=self.user).order_by('id')
+                              .values_list('product_id', flat=True)))
+
+    def test_cursor_pages_seek_the_sort_index(self):
+        for url, params, table in [
+            ('/api/product/search/', dict(sort_by='price', page_size=2), 'products_product'),
+            ('/api/product/search/', dict(sort_by='name', sort_order='desc', page_size=2), 'products_product'),
+            ('/api/user/products/', dict(page_size=2), 'products_productselection'),
+        ]:
+            with self.subTest(url=url, **params):
+                cursor = self.client.get(url, params).json()['next']
+                with CaptureQueriesContext(connection) as captured:
+                    self.assertEqual(self.client.get(url, dict(params, cursor=cursor)).status_code, 200)
+                statement = next(query['sql'] for query in captured.captured_queries
+                                 if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql'])
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {statement}')
+                    plan = [row[-1] for row in cursor.fetchall()]
+                self.assertTrue([step for step in plan if step.startswith(f'SEARCH {table} ')], plan)
+                self.assertFalse([step for step in plan if step.startswith(f'SCAN {table}')], plan)
+
+    def test_tampered_cursors_are_rejected(self):
+        price = dict(f='price', d=False, i=1, r=False)
+        selection = dict(f='id', d=False, i=1, r=False)
+        for url, params, cursor in [
+            ('/api/product/search/', dict(sort_by='price'), dict(price, v=['1'])),
+            ('/api/product/search/', dict(sort_by='price'), dict(price, v={'a': 1})),
+            ('/api/product/search/', dict(sort_by='price'), dict(price, v='cheap')),
+            ('/api/product/search/', dict(sort_by='price'), dict(price, v='1', i='1')),
+            ('/api/product/search/', dict(sort_by='name'), dict(price, v='1')),
+            ('/api/product/search/', dict(sort_by='price'), ['1']),
+            ('/api/user/products/', {}, dict(selection, v=[1])),
+            ('/api/user/products/', {}, dict(selection, v={'1': 1})),
+            ('/api/user/products/', {}, dict(selection, v=None)),
+            ('/api/user/products/', {}, dict(selection, v=True)),
+            ('/api/user/products/', {}, dict(selection, v='x')),
+        ]:
+            with self.subTest(url=url, cursor=cursor):
+                response = self.client.get(url, dict(params, cursor=encode_cursor(cursor)))
+                if url == '/api/product/search/':
+                    self.assertEqual((response.status_code, response.json()), (400, dict(error='Invalid cursor')))
+                else:
+                    self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get('/api/user/products/', dict(cursor='not base64!')).status_code, 404)
+
+
+@override_settings(PRODUCT_SEARCH_CACHE={'ENABLED': False})
+class StreamingSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('streamer', 'streamer@example.com', 'password')
+        for index in range(11):
+            Product.objects.create(name=f'item {index}', description='quote " and unicode é', price=Decimal(index),
+                                   stock=index)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch.object(ProductSearchView, 'stream_chunk_size', 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def expected(self, **filters):
+        return ProductSerializer(Product.objects.filter(**filters).order_by('price', 'id'), many=True).data
+
+    def test_stream_renders_the_full_envelope(self):
+        response = self.client.get('/api/product/search/', dict(stream=1, sort_by='price'))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        content = b''.join(response.streaming_content)
+        self.assertEqual(content, JSONRenderer().render(create_json_response(
+            status=True, message="Products Overview", data=self.expected())))
+
+        response = self.client.get('/api/product/search/', dict(stream=1, query='nothing'))
+        self.assertEqual(json.loads(b''.join(response.streaming_content)),
+                         dict(status=True, message="Products Overview", data=[]))
+
+    def test_ndjson_writes_one_product_per_line(self):
+        for params, headers in [(dict(format='ndjson'), {}), ({}, dict(HTTP_ACCEPT='application/x-ndjson'))]:
+            with self.subTest(params=params, headers=headers):
+                response = self.client.get('/api/product/search/', dict(params, sort_by='price', query='item 1'),
+                                           **headers)
+                self.assertTrue(response.streaming)
+                self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+                lines = b''.join(response.streaming_content).decode().splitlines()
+                self.assertEqual([json.loads(line) for line in lines], self.expected(name__contains='item 1'))
+
+
+class SearchCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cached', 'cached@example.com', 'password')
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        cls.product = Product.objects.create(name='cached lamp', description='description', price=Decimal('5'),
+                                             stock=1)
+
+    def setUp(self):
+        cache.clear()
+        search_cache.clear_local()
+        search_cache.reset_stats()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def names(self, **params):
+        data = self.client.get('/api/product/search/', dict(params, query='lamp')).json()['data']
+        return [product['name'] for product in data[0]] if data else []
+
+    def test_repeated_searches_are_served_from_the_cache(self):
+        first = self.client.get('/api/product/search/', dict(query='lamp')).content
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/product/search/', dict(query='lamp')).content, first)
+        search_cache.clear_local()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/product/search/', dict(query='lamp')).content, first)
+        self.names(sort_by='price')
+
+        stats = search_cache.stats()
+        self.assertEqual((stats['misses'], stats['local_hits'], stats['shared_hits']), (2, 1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(self.client.get('/api/product/search/cache-stats/').json()['data'][0]['misses'], 2)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/product/search/cache-stats/').status_code, 403)
+
+    def test_product_writes_invalidate_cached_searches(self):
+        self.assertEqual(self.names(), ['cached lamp'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='new lamp', description='description', price=Decimal('1'), stock=1)
+        self.assertEqual(self.names(sort_by='name'), ['cached lamp', 'new lamp'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'renamed lamp'
+            self.product.save()
+        self.assertEqual(self.names(sort_by='name'), ['new lamp', 'renamed lamp'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertEqual(self.names(sort_by='name'), ['new lamp'])
+
+    def test_disabled_cache_is_bypassed(self):
+        with override_settings(PRODUCT_SEARCH_CACHE={'ENABLED': False}):
+            self.names()
+            with self.assertNumQueries(1):
+                self.names()
+        self.assertEqual(search_cache.stats()['misses'], 0)
+
+
+@override_settings(PRODUCT_SUGGEST_INDEX={'SYNC_INTERVAL': 0})
+class SuggestTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('typist', 'typist@example.com', 'password')
+        for name in ['Desk  Lamp', 'desk chair', 'Deskjet printer', 'Lamp shade', 'DESK organizer']:
+            Product.objects.create(name=name, description='description', price=Decimal('1'), stock=1)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.index = PrefixIndex()
+        self.index.load()
+
+    def names(self, prefix, limit=10):
+        return [name for pk, name in self.index.suggest(prefix, limit)]
+
+    def test_prefix_matches_ignore_case_and_whitespace(self):
+        self.assertEqual(self.names('desk '), ['desk chair', 'Desk  Lamp', 'DESK organizer', 'Deskjet printer'])
+        self.assertEqual(self.names('DESK  L', limit=2), ['Desk  Lamp'])
+        self.assertEqual(self.names('desk', limit=2), ['desk chair', 'Desk  Lamp'])
+        self.assertEqual(self.names('   '), [])
+        suggest_index.load()
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/product/suggest/', dict(query='lamp s', limit=5))
+        self.assertEqual([row['name'] for row in response.json()['data'][0]], ['Lamp shade'])
+
+    def test_local_writes_are_applied_in_step_with_the_catalog_version(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Desk mat', description='d', price=Decimal('1'), stock=1)
+        suggest_index.load()
+        version = suggest_index.version
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = 'Desk pad'
+            product.save()
+        self.assertEqual(suggest_index.version, version + 1)
+        with self.assertNumQueries(0):
+            self.assertIn('Desk pad', [name for pk, name in suggest_index.suggest('desk p', 10)])
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(suggest_index.suggest('desk p', 10), [])
+
+    def test_writes_of_other_processes_are_reloaded(self):
+        Product.objects.filter(name='Lamp shade').update(name='Lampshade')
+        self.assertEqual(self.names('lamp'), ['Lamp shade'])
+        bump_catalog_version()
+        self.assertEqual(self.names('lamp'), ['Lampshade'])
+        with override_settings(PRODUCT_SUGGEST_INDEX={'SYNC_INTERVAL': 60}):
+            Product.objects.filter(name='Lampshade').update(name='Lamp')
+            bump_catalog_version()
+            self.assertEqual(self.names('lamp'), ['Lampshade'])
+
+    def test_changes_made_during_a_load_are_kept(self):
+        names = Product.objects.values_list('id', 'name')
+
+        def load_names(*args, **kwargs):
+            self.index.add(-1, 'Desk drawer')
+            return names
+
+        with mock.patch.object(Product.objects, 'values_list', side_effect=load_names):
+            self.index.load()
+        self.assertIn('Desk drawer', self.names('desk d'))
+
+    def test_add_many_merges_like_a_rebuild(self):
+        names = {pk: f'Bulk {pk % 7} item' for pk in range(1000, 1100)}
+        renamed = Product.objects.get(name='desk chair').pk
+        self.index.add_many({**names, renamed: 'bulk chair'})
+        expected = PrefixIndex()
+        expected.load()
+        expected.add_many({**names, renamed: 'bulk chair'})
+        self.assertEqual(self.index._entries, sorted(self.index._entries))
+        self.assertEqual(self.index._entries, expected._entries)
+        self.assertEqual(self.names('bulk c'), ['bulk chair'])
+        self.assertEqual(self.index.stats()['entries'], 105)
+
+
+class ProductBulkCreateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('importer', 'importer@example.com', 'password')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def row(self, name, price='1.00'):
+        return dict(name=name, description='description', price=price, stock=1)
+
+    def test_invalid_rows_are_reported_and_valid_rows_created(self):
+        rows = [self.row('first'), self.row('bad price', price='cheap'), self.row('second'), dict(name='no fields')]
+        with mock.patch.object(ProductBulkCreateView, 'chunk_size', 2), \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post('/api/product/bulk-create/', rows, format='json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data'][0]
+        self.assertEqual(data['created'], 2)
+        self.assertEqual([error['index'] for error in data['errors']], [1, 3])
+        self.assertEqual(set(data['errors'][1]['errors']), {'description', 'price', 'stock'})
+        self.assertEqual(list(Product.objects.order_by('id').values_list('name', flat=True)), ['first', 'second'])
+        # One on_commit per inserted chunk.
+        self.assertEqual(len(callbacks), 2)
+
+    def test_chunks_committed_before_a_database_error_are_kept(self):
+        bulk_create = QuerySet.bulk_create
+        calls = []
+
+        def failing_bulk_create(queryset, objs, *args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise IntegrityError('boom')
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        rows = [self.row(f'row {index}') for index in range(4)]
+        with mock.patch.object(ProductBulkCreateView, 'chunk_size', 2), \
+                mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=failing_bulk_create):
+            response = self.client.post('/api/product/bulk-create/', rows, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(Product.objects.order_by('id').values_list('name', flat=True)), ['row 0', 'row 1'])
+
+    def test_ndjson_payloads_are_accepted(self):
+        body = '\n'.join(json.dumps(self.row(f'line {index}')) for index in range(3)) + '\n'
+        response = self.client.post('/api/product/bulk-create/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.json()['data'][0], dict(created=3, errors=[]))
+
+    def test_nothing_valid_is_a_bad_request(self):
+        response = self.client.post('/api/product/bulk-create/', [dict(name='')], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], "No Products Created")
+        response = self.client.post('/api/product/bulk-create/', self.row('not a list'), format='json')
+        self.assertEqual((response.status_code, response.json()['message']), (400, "Expected a list of products"))
+        self.assertFalse(Product.objects.exists())
+
+
+class BatchSelectTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('batcher', 'batcher@example.com', 'password')
+        cls.products = [Product.objects.create(name=f'batch {index}', description='d', price=Decimal('1'), stock=1)
+                        for index in range(4)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, product_ids, selected=True):
+        response = self.client.post('/api/product/select/batch/', dict(product_ids=product_ids, selected=selected),
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data'][0]
+
+    def test_batch_upserts_known_ids_and_reports_unknown_ones(self):
+        first, second, third, _ = (product.id for product in self.products)
+        missing = third + 100
+        self.assertEqual(self.batch([second, first, missing, second]),
+                         dict(selected=True, product_ids=[second, first], unknown_ids=[missing]))
+        self.assertEqual(self.batch([second, third], selected=False),
+                         dict(selected=False, product_ids=[second, third], unknown_ids=[]))
+        self.assertEqual(dict(ProductSelection.objects.filter(user=self.user).values_list('product_id', 'selected')),
+                         {first: True, second: False, third: False})
+        self.assertEqual(list(Product.objects.order_by('id').values_list('selection_count', flat=True)),
+                         [1, 0, 0, 0])
+
+    def test_invalid_payloads_are_rejected(self):
+        for payload in [dict(product_ids=[]), dict(product_ids=['x']), dict(product_ids=[0]), {}]:
+            with self.subTest(payload=payload):
+                response = self.client.post('/api/product/select/batch/', payload, format='json')
+                self.assertEqual(response.status_code, 400)
+
+
+class ConcurrentSelectionTests(TransactionTestCase):
+    databases = '__all__'
+    threads = 8
+    calls = 20
+
+    def run_threads(self, target):
+        errors = []
+
+        def run(index):
+            try:
+                target(index)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_concurrent_batches_wait_for_the_write_lock(self):
+        users = [User.objects.create_user(f'concurrent{index}') for index in range(self.threads)]
+        product_ids = [Product.objects.create(name=f'hot {index}', description='d', price=Decimal('1'), stock=1).id
+                       for index in range(10)]
+
+        def toggle(index):
+            for call in range(self.calls):
+                apply_selections(users[index].id, product_ids[call % 6:call % 6 + 5], call % 3 != 2)
+
+        self.assertEqual(self.run_threads(toggle), [])
+        self.assertEqual(ProductSelection.objects.count(), self.threads * len(product_ids))
+        self.assertEqual(reconcile_selection_counts(), 0)
+
+    @override_settings(SELECTION_WRITE_BEHIND={'FLUSH_INTERVAL': None})
+    def test_concurrent_selects_deselects_and_flushes_wait_for_the_write_lock(self):
+        users = [User.objects.create_user(f'clicker{index}') for index in range(self.threads)]
+        product_ids = [Product.objects.create(name=f'warm {index}', description='d', price=Decimal('1'), stock=1).id
+                       for index in range(5)]
+        buffer = SelectionWriteBuffer()
+
+        def click(index):
+            for call in range(self.calls):
+                product_id = product_ids[call % len(product_ids)]
+                if index % 2:
+                    buffer.add(users[index].id, product_id, call % 3 != 0)
+                    buffer.flush()
+                else:
+                    selection, _ = create_selection(users[index].id, product_id)
+                    if call % 3 == 0:
+                        deselect_selection(selection)
+
+        self.assertEqual(self.run_threads(click), [])
+        self.assertEqual(ProductSelection.objects.count(), self.threads * len(product_ids))
+        self.assertEqual(reconcile_selection_counts(), 0)
+
+
+class UserProductQueryCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('collector', 'collector@example.com', 'password')
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        products = [Product.objects.create(name=f'owned {index}', description='d', price=Decimal(index), stock=1)
+                    for index in range(30)]
+        apply_selections(cls.user.id, [product.id for product in products], True)
+        apply_selections(cls.user.id, [product.id for product in products[::3]], False)
+        apply_selections(other.id, [product.id for product in products[:5]], True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_one_query_per_page_regardless_of_page_size(self):
+        for page_size in [1, 10, 30, 100]:
+            with self.subTest(page_size=page_size), self.assertNumQueries(1):
+                response = self.client.get('/api/user/products/', dict(page_size=page_size))
+            rows = response.json()['data'][0]
+            self.assertEqual(len(rows), min(page_size, 30))
+            self.assertEqual({row['user'] for row in rows}, {self.user.id})
+        cursor = self.client.get('/api/user/products/', dict(page_size=10)).json()['next']
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/user/products/', dict(page_size=10, cursor=cursor))
+        self.assertEqual(len(response.json()['data'][0]), 10)
+
+    def test_rows_nest_the_serialized_product(self):
+        rows = self.client.get('/api/user/products/', dict(page_size=3)).json()['data'][0]
+        selections = ProductSelection.objects.filter(user=self.user).select_related('product').order_by('id')[:3]
+        self.assertEqual(rows, [dict(user=self.user.id, product=ProductSerializer(selection.product).data,
+                                     selected=selection.selected) for selection in selections])
+
+
+class ReadRoutingTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('router', 'router@example.com', 'password')
+        for index in range(5):
+            Product.objects.create(name=f'routed {index}', description='d', price=Decimal(index), stock=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def product_queries(self, alias, request):
+        with CaptureQueriesContext(connections[alias]) as captured:
+            request()
+        return [query['sql'] for query in captured.captured_queries if 'products_product' in query['sql']]
+
+    def test_streamed_pages_are_read_from_the_read_alias(self):
+        def stream():
+            response = self.client.get('/api/product/search/', dict(stream=1, format='ndjson'))
+            self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 5)
+
+        with CaptureQueriesContext(connections['default']) as default:
+            self.assertEqual(len(self.product_queries('read', stream)), 1)
+        self.assertFalse([query for query in default.captured_queries if 'products_product' in query['sql']])
+
+    def test_read_only_views_read_from_the_read_alias(self):
+        for url in ['/api/product/search/', '/api/user/products/']:
+            with self.subTest(url=url), CaptureQueriesContext(connections['default']) as default:
+                self.assertTrue(self.product_queries('read', lambda: self.client.get(url)))
+                self.assertFalse(default.captured_queries)
+
+    def test_writes_and_transactions_stay_on_default(self):
+        product = Product.objects.first()
+        select = lambda: self.client.post(f'/api/product/{product.pk}/select/')
+        self.assertFalse(self.product_queries('read', select))
+        with read_database():
+            self.assertEqual(Product.objects.all().db, 'read')
+            with transaction.atomic():
+                self.assertEqual(Product.objects.all().db, 'default')
+                self.assertEqual(ProductSelection.objects.filter(product=product).count(), 1)
+
+    def test_connections_are_tuned(self):
+        pragmas = {}
+        for alias in ['default', 'read']:
+            with connections[alias].cursor() as cursor:
+                pragmas[alias] = {name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                                  for name in ['journal_mode', 'busy_timeout', 'query_only']}
+        self.assertEqual(pragmas['default'], dict(journal_mode='wal', busy_timeout=5000, query_only=0))
+        self.assertEqual(pragmas['read'], dict(journal_mode='wal', busy_timeout=5000, query_only=1))
+        with override_settings(SQLITE_PRAGMAS={'busy_timeout': 100}):
+            self.assertEqual(get_sqlite_pragmas('default')['busy_timeout'], 100)
+        with self.assertRaises(OperationalError), connections['read'].cursor() as cursor:
+            cursor.execute("DELETE FROM products_product")
+
+    def test_benchmark_counts_queries_on_every_alias(self):
+        token = AccessToken.for_user(self.user)
+        with CaptureQueriesContext(connections['read']) as read:
+            _, _, queries, _ = InProcessRunner().request('get', '/api/product/search/', token=token)
+        self.assertTrue(read.captured_queries)
+        self.assertGreaterEqual(queries, len(read.captured_queries))
+
+
+@override_settings(PRODUCT_SEARCH_CACHE={'ENABLED': False})
+class FastPathSerializationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader', 'reader@example.com', 'password')
+        names = ['plain', 'quote " and \\ backslash', 'unicode é ü 漢字', 'separators    ', 'tab\tnew\nline']
+        for index, name in enumerate(names * 3):
+            Product.objects.create(name=f'{name} {index}', description=f'{name} description',
+                                   price=Decimal('0.5') * index, stock=index - 2)
+        apply_selections(cls.user.id, list(Product.objects.values_list('id', flat=True)[:5]), True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_rows_render_like_product_serializer(self):
+        products = list(Product.objects.order_by('id'))
+        rows = list(Product.objects.order_by('id').values_list(*product_row_encoder.columns))
+
+        expected = JSONRenderer().render(create_json_response(
+            status=True, message="Products Overview", data=ProductSerializer(products, many=True).data))
+        actual = EnvelopeJSONRenderer().render(create_json_response(
+            status=True, message="Products Overview", data=product_row_encoder.encode_many(rows)))
+        self.assertEqual(actual, expected)
+
+    def test_search_responses_are_identical(self):
+        queries = [
+            {},
+            {'query': 'zzz'},
+            {'query': 'quote', 'sort_by': 'price', 'sort_order': 'desc'},
+            {'query': 'description', 'sort_by': 'relevance'},
+            {'sort_by': 'stock', 'page_size': 4},
+            {'sort_by': 'name', 'sort_order': 'desc', 'page_size': 4},
+            {'sort_by': 'price', 'include_selected': 1},
+            {'sort_by': 'popularity', 'sort_order': 'desc', 'page_size': 4},
+        ]
+        for params in queries:
+            with self.subTest(params=params):
+                with override_settings(PRODUCT_SEARCH_FAST_PATH=False):
+                    expected = self.client.get('/api/product/search/', params)
+                with override_settings(PRODUCT_SEARCH_FAST_PATH=True):
+                    actual = self.client.get('/api/product/search/', params)
+                self.assertEqual(actual.status_code, 200)
+                self.assertEqual(actual.content, expected.content)
+
+
+@override_settings(PRODUCT_SEARCH_CACHE={'ENABLED': False})
+class CachedAuthenticationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('bearer', 'bearer@example.com', 'password')
+
+    def setUp(self):
+        user_cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def user_queries(self, url='/api/product/search/'):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len([query for query in captured.captured_queries if 'auth_user' in query['sql']])
+
+    def test_cached_users_cost_no_auth_queries(self):
+        self.assertEqual(self.user_queries(), 1)
+        self.assertEqual(self.user_queries(), 0)
+        self.assertEqual(self.user_queries('/api/async/product/search/'), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.user_queries('/api/async/product/search/'), 1)
+        self.assertEqual(self.user_queries(), 0)
+
+    def test_settings_are_read_when_users_are_cached(self):
+        with override_settings(JWT_USER_CACHE={'TTL': -1}):
+            self.assertEqual(self.user_queries(), 1)
+            self.assertEqual(self.user_queries(), 1)
+        with override_settings(JWT_USER_CACHE={'MAX_SIZE': 0}):
+            self.assertEqual(self.user_queries(), 1)
+            self.assertEqual(len(user_cache), 0)
+
+    def test_inactive_users_are_rejected_and_not_cached(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        for url in ['/api/product/search/', '/api/async/product/search/']:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(len(user_cache), 0)
+
+
+class RefreshBlacklistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('refresher', 'refresher@example.com', 'password')
+
+    def setUp(self):
+        blacklist_filter.load()
+        self.client = APIClient()
+        self.refresh = str(FilteredRefreshToken.for_user(self.user))
+
+    def refresh_token(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post('/api/auth/token/refresh/', dict(refresh=self.refresh), format='json')
+        return response.status_code, len([query for query in captured.captured_queries
+                                          if 'token_blacklist' in query['sql']])
+
+    def test_refreshes_skip_the_blacklist_tables_until_logout(self):
+        self.assertEqual(self.refresh_token(), (200, 0))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.assertEqual(self.client.post('/api/auth/logout/', dict(refresh=self.refresh), format='json').status_code,
+                         200)
+        status_code, queries = self.refresh_token()
+        self.assertEqual(status_code, 401)
+        self.assertGreater(queries, 0)
+
+    def test_blacklistings_of_other_processes_are_synced(self):
+        token = OutstandingToken.objects.get(jti=FilteredRefreshToken(self.refresh)['jti'])
+        BlacklistedToken.objects.create(token=token)
+        with override_settings(JWT_BLACKLIST_FILTER={'SYNC_INTERVAL': 60}):
+            self.assertEqual(self.refresh_token(), (200, 0))
+        with override_settings(JWT_BLACKLIST_FILTER={'SYNC_INTERVAL': 0}):
+            self.assertEqual(self.refresh_token()[0], 401)
+
+    def test_blacklistings_committed_below_the_watermark_are_synced(self):
+        token = OutstandingToken.objects.get(jti=FilteredRefreshToken(self.refresh)['jti'])
+        other = OutstandingToken.objects.get(jti=FilteredRefreshToken.for_user(self.user)['jti'])
+        with override_settings(JWT_BLACKLIST_FILTER={'SYNC_INTERVAL': 0}):
+            late = BlacklistedToken.objects.create(token=other).id - 1
+            blacklist_filter.sync()
+            BlacklistedToken.objects.create(id=late, token=token)
+            self.assertEqual(self.refresh_token()[0], 401)
+
+
+class AsyncViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('looper', 'looper@example.com', 'password')
+        cls.products = [Product.objects.create(name=name, description='sample', price=Decimal('5.00'), stock=1)
+                        for name in ['anvil', 'anchor', 'banjo']]
+
+    def setUp(self):
+        search_cache.clear_local()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_search_matches_the_sync_view(self):
+        for params in [dict(query='an', sort_by='name'), dict(sort_by='price', sort_order='desc', facets='true')]:
+            with self.subTest(params=params):
+                response = self.client.get('/api/async/product/search/', params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), self.client.get('/api/product/search/', params).json())
+                revalidated = self.client.get('/api/async/product/search/', params,
+                                              HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(revalidated.status_code, 304)
+
+    def test_requests_need_a_token(self):
+        self.client.credentials()
+        for url in ['/api/async/product/search/', '/api/async/user/products/']:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 401)
+
+    def test_select_deselect_and_list(self):
+        product = self.products[0]
+        url = f'/api/async/product/{product.pk}/select/'
+        self.assertEqual(self.client.post(url).json()['data'], [dict(user=self.user.pk, product=product.pk,
+                                                                     selected=True)])
+        self.assertIn('again', self.client.post(url).json()['message'])
+        listed = self.client.get('/api/async/user/products/').json()['data'][0]
+        self.assertEqual([(row['product']['id'], row['selected']) for row in listed], [(product.pk, True)])
+
+        self.assertFalse(self.client.put(url).json()['data'][0]['selected'])
+        self.assertFalse(ProductSelection.objects.get(user=self.user, product=product).selected)
+        self.assertEqual(self.client.post('/api/async/product/0/select/').status_code, 404)
+        self.assertEqual(self.client.put(f'/api/async/product/{self.products[1].pk}/select/').status_code, 404)
+
+    def test_cache_is_not_used_on_the_event_loop(self):
+        def running_loop():
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return False
+            return True
+
+        calls = []
+        get_version = mock.Mock(side_effect=lambda key: calls.append(running_loop()) or 1)
+        with mock.patch('products.cache._get_version', get_version):
+            for params in [{}, dict(facets='true')]:
+                self.assertEqual(self.client.get('/api/async/product/search/', params).status_code, 200)
+            self.assertEqual(self.client.get('/api/async/user/products/').status_code, 200)
+        self.assertTrue(calls)
+        self.assertNotIn(True, calls)
+
+
+@override_settings(PRODUCT_SEARCH_CACHE={'ENABLED': False})
+class SearchQueryPlanTests(TestCase):
+    """
+    Every supported sort must be served in index order, never through ``USE TEMP B-TREE``.
+
+    Full-text matches (queries of three or more characters) are excluded on
+    purpose: SQLite reads the match set from the FTS index and sorts only
+    those rows, which is the cheaper plan for a selective search.
+    """
+    sort_indexes = {
+        'name': 'product_name_id_idx',
+        'price': 'product_price_id_idx',
+        'stock': 'product_stock_id_idx',
+        'popularity': 'product_selection_count_id_idx',
+        'id': None,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('planner', 'planner@example.com', 'password')
+        for index in range(20):
+            Product.objects.create(name=f'product {index % 7}', description='description',
+                                   price=Decimal(index % 5), stock=index % 3)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def explain(self, params):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/product/search/', params)
+        self.assertEqual(response.status_code, 200)
+        statements = [query['sql'] for query in captured.captured_queries
+                      if query['sql'].startswith('SELECT') and 'products_product' in query['sql']]
+        self.assertEqual(len(statements), 1, statements)
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {statements[0]}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        return response.json(), plan
+
+    def assertIndexOrdered(self, plan, index, seek=False):
+        self.assertFalse([step for step in plan if 'TEMP B-TREE' in step], plan)
+        if index:
+            self.assertTrue([step for step in plan if index in step], plan)
+        if seek:
+            # Cursor pages must search the index from the cursor, not scan every earlier row.
+            using = f'USING INDEX {index} ' if index else 'USING INTEGER PRIMARY KEY '
+            self.assertTrue([step for step in plan if step.startswith('SEARCH products_product ') and using in step],
+                            plan)
+            self.assertFalse([step for step in plan if step.startswith('SCAN products_product')], plan)
+
+    def test_sorted_pages_use_indexes(self):
+        for query in ['', 'pr']:
+            for sort_by, index in self.sort_indexes.items():
+                for sort_order in ['asc', 'desc']:
+                    params = dict(query=query, sort_by=sort_by, sort_order=sort_order, page_size=3)
+                    with self.subTest(**params):
+                        payload, plan = self.explain(params)
+                        self.assertIndexOrdered(plan, index)
+
+                        payload, plan = self.explain(dict(params, cursor=payload['next']))
+                        self.assertIndexOrdered(plan, index, seek=True)
+
+                        payload, plan = self.explain(dict(params, cursor=payload['prev']))
+                        self.assertIndexOrdered(plan, index, seek=True)
+
+
+class BenchmarkSuiteTests(TestCase):
+    databases = '__all__'
+
+    def test_seed_catalog_is_idempotent(self):
+        created = seed_catalog(products=50, users=3, selections=5, batch_size=20)
+        self.assertEqual(created, dict(products=50, users=3, selections=15))
+        self.assertEqual(seed_catalog(products=50, users=3, selections=5), dict(products=0, users=0, selections=0))
+        self.assertEqual(ProductSelection.objects.filter(user__username__startswith=BENCHMARK_USER_PREFIX).count(), 15)
+
+    def test_every_route_reports_latency_and_queries(self):
+        seed_catalog(products=30, users=1, selections=5)
+        results = run_benchmark(InProcessRunner(), f'{BENCHMARK_USER_PREFIX}0', requests=2, warmup=0)
+
+        self.assertEqual(list(results['routes']), [route.name for route in ROUTES])
+        self.assertEqual(results['environment']['mode'], 'inprocess')
+        for name, result in results['routes'].items():
+            with self.subTest(route=name):
+                self.assertEqual(result['requests'], 2)
+                self.assertEqual(result['errors'], 0)
+                self.assertIsNotNone(result['queries_per_request'])
+                self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.50), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([7], 0.95), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+
+@override_settings(PRODUCT_SEARCH_CACHE={'ENABLED': False})
+class RequestMetricsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('metrics', 'metrics@example.com', 'password')
+        Product.objects.create(name='product', description='description', price=Decimal('1.00'), stock=1)
+
+    def test_timings_are_reported_and_aggregated(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        request_metrics.reset()
+
+        response = client.get('/api/product/search/')
+        self.assertRegex(response['Server-Timing'],
+                         r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="1 queries", serialize;dur=[\d.]+, auth;dur=[\d.]+$')
+        client.generic('BREW', '/api/product/search/')
+
+        with override_settings(REQUEST_METRICS={'ALLOWED_IPS': ['127.0.0.1']}):
+            metrics = APIClient().get('/api/metrics').content.decode()
+        self.assertIn('http_requests_total{view="product-search",method="GET",status="200"} 1', metrics)
+        self.assertIn('http_request_db_queries_bucket{view="product-search",method="GET",le="1.0"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_count{view="product-search",method="GET"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_count{view="product-search",method="other"} 1', metrics)
+        self.assertNotIn('BREW', metrics)
+
+    def test_metrics_are_restricted_to_staff_and_allowed_ips(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/metrics').status_code, 401)
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/metrics').status_code, 403)
+        with override_settings(REQUEST_METRICS={'ALLOWED_IPS': ['10.0.0.9']}):
+            self.assertEqual(APIClient().get('/api/metrics', REMOTE_ADDR='10.0.0.9').status_code, 200)
+            self.assertEqual(APIClient().get('/api/metrics').status_code, 401)
+        self.user.is_staff = True
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/metrics').status_code, 200)
+
+
+class CatalogImportExportTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        Product.objects.create(name='first', description='one', price=Decimal('1.50'), stock=1)
+        Product.objects.create(name='second', description='two', price=Decimal('2.00'), stock=2)
+
+    def run_command(self, *args, **kwargs):
+        call_command(*args, stdout=open(os.devnull, 'w'), stderr=open(os.devnull, 'w'), **kwargs)
+
+    def test_export_and_import_round_trip(self):
+        for file_format in ['csv', 'jsonl']:
+            with self.subTest(file_format=file_format):
+                path = os.path.join(self.directory, f'products.{file_format}')
+                self.run_command('export_products', path)
+                Product.objects.filter(name='first').update(name='changed')
+                Product.objects.create(name='third', description='three', price=Decimal('3.00'), stock=3)
+
+                self.run_command('import_products', path, chunk_size=1, drop_indexes=True)
+                self.assertEqual(list(Product.objects.order_by('id').values_list('name', flat=True)),
+                                 ['first', 'second', 'third'])
+                Product.objects.filter(name='third').delete()
+
+    def test_import_resumes_after_last_committed_chunk(self):
+        path = os.path.join(self.directory, 'products.jsonl')
+        with open(path, 'w') as f:
+            f.write('{"name": "skipped", "description": "d", "price": "1.00", "stock": 1}\n')
+            f.write('{"name": "loaded", "description": "d", "price": "1.00", "stock": 1}\n')
+        stat = os.stat(path)
+        ImportCheckpoint.objects.create(name=os.path.abspath(path), state=dict(
+            path=os.path.abspath(path), size=stat.st_size, mtime=stat.st_mtime, rows=1, imported=1, invalid=0))
+
+        self.run_command('import_products', path, resume=True)
+        self.assertFalse(Product.objects.filter(name='skipped').exists())
+        self.assertTrue(Product.objects.filter(name='loaded').exists())
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_a_crash_after_saving_a_chunk_does_not_duplicate_it_on_resume(self):
+        path = os.path.join(self.directory, 'products.jsonl')
+        with open(path, 'w') as f:
+            for name in ['third', 'fourth']:
+                f.write(json.dumps(dict(name=name, description='d', price='1.00', stock=1)) + '\n')
+
+        def crash_after_the_second_chunk(validated):
+            products = upsert_products(validated)
+            if validated[0]['name'] == 'fourth':
+                raise KeyboardInterrupt
+            return products
+
+        with mock.patch('products.management.commands.import_products.upsert_products',
+                        side_effect=crash_after_the_second_chunk), self.assertRaises(KeyboardInterrupt):
+            self.run_command('import_products', path, chunk_size=1)
+        self.run_command('import_products', path, chunk_size=1, resume=True)
+        self.assertEqual(list(Product.objects.order_by('id').values_list('name', flat=True)),
+                         ['first', 'second', 'third', 'fourth'])
+
+
+@override_settings(PRODUCT_SEARCH_CACHE={'ENABLED': False})
+class SearchFacetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('facets', 'facets@example.com', 'password')
+        for index in range(30):
+            Product.objects.create(name=f'product {index}', description='description',
+                                   price=Decimal(index * 37 % 1200), stock=index % 4 - 1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_filters_and_facets_share_one_aggregate(self):
+        params = dict(price_min='10', price_max='500', in_stock='true', facets='1', sort_by='price')
+        with CaptureQueriesContext(connection) as captured:
+            payload = self.client.get('/api/product/search/', params).json()
+
+        expected = Product.objects.filter(price__gte=10, price__lte=500, stock__gt=0)
+        self.assertEqual([product['id'] for product in payload['data'][0]],
+                         list(expected.order_by('price', 'id').values_list('id', flat=True)))
+        self.assertEqual(len([query for query in captured.captured_queries
+                              if '"products_product"' in query['sql']]), 2)
+        self.assertEqual(payload['facets']['total'], expected.count())
+        self.assertEqual(sum(bucket['count'] for bucket in payload['facets']['price']), expected.count())
+        self.assertEqual(payload['facets']['stock'], dict(in_stock=expected.count(), out_of_stock=0))
+
+    def test_invalid_filters_are_rejected(self):
+        response = self.client.get('/api/product/search/', dict(price_min='5', price_max='1'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), dict(error=dict(price_max=['Must not be lower than price_min.'])))
+
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('etag', 'etag@example.com', 'password')
+        cls.product = Product.objects.create(name='product', description='description', price=Decimal('1.00'),
+                                             stock=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertNotModified(self, url):
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(captured), 0)
+        return etag
+
+    def test_search_is_not_modified_until_the_catalog_changes(self):
+        etag = self.assertNotModified('/api/product/search/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='new', description='description', price=Decimal('2.00'), stock=2)
+        self.assertEqual(self.client.get('/api/product/search/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_user_products_are_not_modified_until_a_selection_changes(self):
+        etag = self.assertNotModified('/api/user/products/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/product/{self.product.id}/select/')
+        self.assertEqual(self.client.get('/api/user/products/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class SessionRestoreTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('restore', 'restore@example.com', 'password')
+        cls.products = [Product.objects.create(name=f'lamp {i}', description='description', price=Decimal(i), stock=i)
+                        for i in range(1, 5)]
+
+    def setUp(self):
+        cache.clear()
+        clear_snapshot(self.user.id)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def restore(self):
+        response = self.client.get('/api/session/restore/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data'][0]
+
+    def test_restore_returns_last_search_and_selections(self):
+        first, second, third = (product.id for product in self.products[:3])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/product/{first}/select/')
+        self.assertEqual(self.restore()['selected_product_ids'], [first])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/product/select/batch/', dict(product_ids=[second, third], selected=True),
+                             format='json')
+            self.client.put(f'/api/product/{first}/select/')
+        search = self.client.get('/api/product/search/', dict(query='lamp', sort_by='price', sort_order='desc',
+                                                              page_size=2))
+
+        with CaptureQueriesContext(connection) as captured:
+            session = self.restore()
+        self.assertEqual(len(captured), 0)
+        self.assertEqual(session['search'], dict(query='lamp', sort_by='price', sort_order='desc', page_size='2'))
+        self.assertEqual(session['selected_product_ids'], [second, third])
+        self.assertEqual(session['results']['data'], search.json()['data'][0])
+        self.assertEqual(session['results']['next'], search.json()['next'])
+
+    def test_cold_restore_costs_a_fixed_number_of_queries(self):
+        apply_selections(self.user.id, [product.id for product in self.products], True)
+        with CaptureQueriesContext(connection) as captured:
+            session = self.restore()
+        # The saved search, the selected ids and the search page.
+        self.assertLessEqual(len(captured), 3)
+        self.assertEqual(session['search'], {})
+        self.assertEqual(session['selected_product_ids'], [product.id for product in self.products])
+        self.assertEqual(len(session['results']['data']), len(self.products))
+
+    def test_searches_survive_a_cache_flush(self):
+        self.client.get('/api/product/search/', dict(query='lamp', sort_by='price'))
+        self.assertEqual(persist_searches(force=True), 1)
+        cache.clear()
+        self.assertEqual(self.restore()['search'], dict(query='lamp', sort_by='price'))
+        self.assertEqual(SearchSnapshot.objects.get(user=self.user).params, dict(query='lamp', sort_by='price'))
+
+    def test_revalidated_pages_are_recorded(self):
+        for url in ['/api/product/search/', '/api/async/product/search/']:
+            with self.subTest(url=url):
+                if url.startswith('/api/async/'):
+                    self.client.force_authenticate()
+                    self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+                etag = self.client.get(url, dict(query='lamp'))['ETag']
+                self.client.get(url, dict(sort_by='stock'))
+                response = self.client.get(url, dict(query='lamp'), HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(self.restore()['search'], dict(query='lamp'))
+
+    def test_failed_snapshot_writes_stay_queued(self):
+        self.client.get('/api/product/search/', dict(query='lamp'))
+        with mock.patch.object(SearchSnapshot.objects, 'bulk_create', side_effect=OperationalError('locked')), \
+                self.assertLogs('products.snapshots', 'WARNING'):
+            self.assertEqual(persist_searches(force=True), 0)
+        self.assertEqual(persist_searches(force=True), 1)
+        self.assertEqual(SearchSnapshot.objects.get(user=self.user).params, dict(query='lamp'))
+
+
+@override_settings(SESSION_SNAPSHOT={'PERSIST_INTERVAL': 0})
+class SearchSnapshotPersistTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('persist', 'persist@example.com', 'password')
+        Product.objects.create(name='lamp', description='description', price=Decimal('1.00'), stock=1)
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_searches_are_saved_after_the_response(self):
+        with mock.patch('products.snapshots.SearchSnapshot.objects.bulk_create',
+                        side_effect=OperationalError('database is locked')), self.assertLogs('products.snapshots'):
+            response = self.client.get('/api/product/search/', dict(query='lamp'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SearchSnapshot.objects.exists())
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.assertEqual(self.client.get('/api/async/product/search/', dict(query='lam')).status_code, 200)
+        self.assertEqual(SearchSnapshot.objects.get(user=self.user).params, dict(query='lam'))
+
+
+class SearchSelectionFlagTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('flags', 'flags@example.com', 'password')
+        cls.products = [Product.objects.create(name=f'chair {i}', description='description', price=Decimal(i),
+                                               stock=i) for i in range(1, 4)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def flags(self, url='/api/product/search/'):
+        response = self.client.get(url, dict(include_selected=1))
+        self.assertEqual(response.status_code, 200)
+        return {product['id']: product['selected'] for product in response.json()['data'][0]}
+
+    def test_flags_follow_select_and_deselect(self):
+        first, second, third = (product.id for product in self.products)
+        self.assertEqual(self.flags(), {first: False, second: False, third: False})
+        self.assertNotIn('selected', self.client.get('/api/product/search/').json()['data'][0][0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/product/{first}/select/')
+            self.client.post(f'/api/product/{second}/select/')
+            self.client.put(f'/api/product/{first}/select/')
+        with CaptureQueriesContext(connection) as captured:
+            flags = self.flags()
+        # The page comes from the search cache and the ids from the patched snapshot.
+        self.assertEqual(len(captured), 0)
+        self.assertEqual(flags, {first: False, second: True, third: False})
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.assertEqual(self.flags('/api/async/product/search/'), flags)
+
+    def test_etag_changes_with_selections(self):
+        etag = self.client.get('/api/product/search/', dict(include_selected=1))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/product/{self.products[0].id}/select/')
+        response = self.client.get('/api/product/search/', dict(include_selected=1), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class SelectionCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'fan{i}', f'fan{i}@example.com', 'password') for i in range(2)]
+        cls.products = [Product.objects.create(name=f'desk {i}', description='description', price=Decimal(i),
+                                               stock=i) for i in range(1, 4)]
+
+    def setUp(self):
+        cache.clear()
+        self.clients = []
+        for user in self.users:
+            client = APIClient()
+            client.force_authenticate(user)
+            self.clients.append(client)
+
+    def counts(self):
+        return list(Product.objects.order_by('id').values_list('selection_count', flat=True))
+
+    def popular(self):
+        response = self.clients[0].get('/api/product/search/', dict(sort_by='popularity', sort_order='desc'))
+        return [product['id'] for product in response.json()['data'][0]]
+
+    def test_counts_follow_selection_transitions(self):
+        first, second, third = (product.id for product in self.products)
+        self.assertEqual(self.popular(), [third, second, first])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.clients[0].post(f'/api/product/{first}/select/')
+            self.clients[0].post(f'/api/product/{first}/select/')
+            self.clients[1].post(f'/api/product/{first}/select/')
+            self.clients[1].post('/api/product/select/batch/', dict(product_ids=[first, second], selected=True),
+                                 format='json')
+        self.assertEqual(self.counts(), [2, 1, 0])
+        self.assertEqual(self.popular(), [first, second, third])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.clients[0].put(f'/api/product/{first}/select/')
+            self.clients[0].put(f'/api/product/{first}/select/')
+            self.clients[1].post('/api/product/select/batch/', dict(product_ids=[second, third], selected=False),
+                                 format='json')
+        self.assertEqual(self.counts(), [1, 0, 0])
+
+    @override_settings(SELECTION_WRITE_BEHIND={'FLUSH_INTERVAL': None})
+    def test_selection_transactions_start_with_a_write(self):
+        user, product = self.users[0], self.products[0]
+        buffer = SelectionWriteBuffer()
+        buffer.add(user.id, self.products[1].id, True)
+        writes = [
+            lambda: create_selection(user.id, product.id),
+            lambda: create_selection(user.id, product.id),
+            lambda: deselect_selection(ProductSelection.objects.get(user=user, product=product)),
+            lambda: apply_selections(user.id, [product.id], True),
+            buffer.flush,
+        ]
+        for write in writes:
+            with CaptureQueriesContext(connection) as captured:
+                write()
+            statements = [query['sql'] for query in captured.captured_queries]
+            begin = next(index for index, sql in enumerate(statements) if sql.startswith('SAVEPOINT'))
+            self.assertRegex(statements[begin + 1], r'^(UPDATE|INSERT)')
+        self.assertEqual(self.counts(), [1, 1, 0])
+        self.assertTrue(ProductSelection.objects.get(user=user, product=product).selected)
+
+    def test_reconcile_fixes_drifted_counts(self):
+        apply_selections(self.users[0].id, [self.products[0].id, self.products[1].id], True)
+        apply_selections(self.users[1].id, [self.products[0].id], True)
+        Product.objects.update(selection_count=7)
+        call_command('reconcile_selection_counts', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.counts(), [2, 1, 0])
+
+
+class StockReservationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        cls.product = Product.objects.create(name='lamp', description='description', price=Decimal('5.00'), stock=5)
+        cls.other = Product.objects.create(name='bulb', description='description', price=Decimal('1.00'), stock=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def reserve(self, product_id, quantity):
+        return self.client.post(f'/api/product/{product_id}/reserve/', dict(quantity=quantity), format='json')
+
+    def test_reserve_takes_stock_with_one_conditional_update(self):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.reserve(self.product.id, 3).status_code, 200)
+        self.assertEqual([query['sql'].split()[0] for query in captured.captured_queries
+                          if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))], ['UPDATE'])
+        self.assertEqual(self.reserve(self.product.id, 3).status_code, 409)
+        self.assertEqual(self.reserve(0, 1).status_code, 404)
+        self.assertEqual(self.reserve(self.product.id, 0).status_code, 400)
+        self.assertEqual(available_stock(self.product.id), 2)
+
+    def test_batch_reserves_all_or_nothing(self):
+        items = [dict(product=self.product.id, quantity=2), dict(product=self.other.id, quantity=2)]
+        response = self.client.post('/api/product/reserve/batch/', dict(items=items), format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['data'][0], dict(insufficient=[self.other.id], unknown=[]))
+        self.assertEqual(available_stock(self.product.id), 5)
+
+        items[1]['quantity'] = 1
+        response = self.client.post('/api/product/reserve/batch/', dict(items=items), format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([available_stock(self.product.id), available_stock(self.other.id)], [3, 0])
+
+    def test_reservations_invalidate_pages_and_etags_showing_stock(self):
+        etag = self.client.get('/api/product/search/')['ETag']
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.reserve(self.product.id, 3).status_code, 200)
+        self.assertEqual(get_catalog_version(), version)
+        response = self.client.get('/api/product/search/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({product['id']: product['stock'] for product in response.json()['data'][0]},
+                         {self.product.id: 2, self.other.id: 1})
+
+    def test_catalog_version_moves_only_when_stock_runs_out_or_returns(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.reserve(self.product.id, 4).status_code, 200)
+        self.assertEqual(get_catalog_version(), version)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.reserve(self.product.id, 1).status_code, 200)
+        self.assertEqual(Product.objects.get(pk=self.product.id).stock, 0)
+        self.assertGreater(get_catalog_version(), version)
+
+        shard_stock(self.other.id, 2)
+        version = get_catalog_version()
+        with override_settings(STOCK_RESERVATION={'SHARD_REFRESH_INTERVAL': 0}):
+            StockShard.objects.filter(product=self.other, stock=0).update(stock=3)
+            self.assertTrue(refresh_sharded_stock(self.other.id))
+            self.assertEqual(get_catalog_version(), version)
+            StockShard.objects.filter(product=self.other).update(stock=0)
+            self.assertTrue(refresh_sharded_stock(self.other.id))
+            self.assertGreater(get_catalog_version(), version)
+        self.assertEqual(available_stock(self.other.id), 0)
+
+    def test_refresh_times_are_bounded(self):
+        for product_id in range(2000):
+            stock._refreshed.set(product_id, 0.0)
+        self.assertEqual(len(stock._refreshed), stock._refreshed.maxsize)
+
+    def test_sharded_stock(self):
+        shard_stock(self.product.id, 2)
+        self.assertEqual(sorted(StockShard.objects.values_list('stock', flat=True)), [2, 3])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.reserve(self.product.id, 2).status_code, 200)
+            self.assertEqual(self.reserve(self.product.id, 2).status_code, 200)
+        # 1 unit is left, in one shard.
+        self.assertEqual(self.reserve(self.product.id, 2).status_code, 409)
+        self.assertEqual(available_stock(self.product.id), 1)
+        self.assertEqual(shard_stock(self.product.id, 0), 1)
+        self.assertEqual(Product.objects.get(pk=self.product.id).stock, 1)
+        self.assertFalse(StockShard.objects.exists())
+
+
+@override_settings(SELECTION_WRITE_BEHIND={'ENABLED': True, 'FLUSH_INTERVAL': None})
+class SelectionWriteBehindTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('clicker', 'clicker@example.com', 'password')
+        cls.products = [Product.objects.create(name=f'mug {i}', description='description', price=Decimal(i),
+                                               stock=i) for i in range(1, 4)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.addCleanup(selection_buffer.flush)
+
+    def listed(self):
+        response = self.client.get('/api/user/products/')
+        return {row['product']['id']: row['selected'] for row in response.json()['data'][0]}, response['ETag']
+
+    def test_toggles_are_queued_overlaid_and_flushed_in_one_batch(self):
+        first, second, third = (product.id for product in self.products)
+        apply_selections(self.user.id, [third], True)
+        _, etag = self.listed()
+
+        for method, pk in [('post', first), ('post', second), ('put', first), ('put', third)]:
+            self.assertEqual(getattr(self.client, method)(f'/api/product/{pk}/select/').status_code, 202)
+        self.assertEqual(self.client.put(f'/api/product/{self.products[0].id + 100}/select/').status_code, 404)
+        self.assertEqual(ProductSelection.objects.filter(user=self.user).count(), 1)
+
+        listed, new_etag = self.listed()
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(listed, {first: False, second: True, third: False})
+        flags = self.client.get('/api/product/search/', dict(include_selected=1)).json()['data'][0]
+        self.assertEqual([product['id'] for product in flags if product['selected']], [second])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(selection_buffer.flush(), 3)
+        self.assertEqual(len(selection_buffer), 0)
+        self.assertEqual(dict(ProductSelection.objects.filter(user=self.user).values_list('product_id', 'selected')),
+                         {first: False, second: True, third: False})
+        self.assertEqual(self.listed()[0], listed)
+        self.assertEqual(list(Product.objects.order_by('id').values_list('selection_count', flat=True)), [0, 1, 0])
+
+    def test_async_toggles_go_through_the_queue(self):
+        product_id = self.products[0].id
+        self.assertEqual(self.client.post(f'/api/product/{product_id}/select/').status_code, 202)
+        self.assertEqual(self.client.put(f'/api/product/{product_id}/select/').status_code, 202)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        response = self.client.post(f'/api/async/product/{product_id}/select/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['data'][0], dict(user=self.user.id, product=product_id, selected=True))
+        self.assertEqual(self.client.put(f'/api/async/product/{product_id + 100}/select/').status_code, 404)
+
+        selection_buffer.flush()
+        self.assertTrue(ProductSelection.objects.get(user=self.user, product_id=product_id).selected)
+
+    def test_full_queue_writes_synchronously(self):
+        with override_settings(SELECTION_WRITE_BEHIND={'ENABLED': True, 'FLUSH_INTERVAL': None, 'MAX_PENDING': 0}):
+            response = self.client.post(f'/api/product/{self.products[0].id}/select/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(ProductSelection.objects.filter(user=self.user, selected=True).exists())
+
+    def test_reselecting_selects_in_both_modes(self):
+        for enabled in (True, False):
+            with self.subTest(write_behind=enabled), override_settings(
+                    SELECTION_WRITE_BEHIND={'ENABLED': enabled, 'FLUSH_INTERVAL': None}):
+                product_id = self.products[int(enabled)].id
+                apply_selections(self.user.id, [product_id], False)
+                response = self.client.post(f'/api/product/{product_id}/select/')
+                self.assertEqual(response.status_code, 202 if enabled else 200)
+                self.assertTrue(response.json()['data'][0]['selected'])
+                selection_buffer.flush()
+                self.assertTrue(ProductSelection.objects.get(user=self.user, product_id=product_id).selected)
+                self.assertEqual(Product.objects.get(pk=product_id).selection_count, 1)
+
+    def test_busy_database_requeues_the_batch(self):
+        first, second = self.products[0].id, self.products[1].id
+        selection_buffer.add(self.user.id, first, True)
+        selection_buffer.add(self.user.id, second, True)
+
+        def busy(user_id, product_ids, selected):
+            # A toggle queued while the batch is written is newer and must survive the retry.
+            selection_buffer.add(self.user.id, first, False)
+            raise OperationalError('database is locked')
+
+        with mock.patch('products.writebehind.write_selections', side_effect=busy), \
+                self.assertLogs('products.writebehind', 'ERROR'):
+            self.assertEqual(selection_buffer.flush(), 0)
+        self.assertEqual(len(selection_buffer), 2)
+        self.assertEqual(selection_buffer.pending_for(self.user.id), {first: False, second: True})
+        self.assertEqual(selection_buffer.flush(), 2)
+        self.assertEqual(dict(ProductSelection.objects.filter(user=self.user).values_list('product_id', 'selected')),
+                         {first: False, second: True})
+
+
+class SelectionWriteBehindThreadTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('flusher')
+        self.product_ids = [Product.objects.create(name=f'cup {index}', description='d', price=Decimal('1'),
+                                                   stock=1).id for index in range(3)]
+        self.buffer = SelectionWriteBuffer()
+        self.addCleanup(self.buffer.stop)
+
+    def selected(self):
+        return set(ProductSelection.objects.filter(user=self.user, selected=True).values_list('product_id', flat=True))
+
+    def wait_for(self, expected, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.selected() != expected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.selected()
+
+    @override_settings(SELECTION_WRITE_BEHIND={'FLUSH_INTERVAL': 0.05})
+    def test_background_thread_flushes_every_interval(self):
+        self.buffer.add(self.user.id, self.product_ids[0], True)
+        self.assertEqual(self.wait_for({self.product_ids[0]}), {self.product_ids[0]})
+        self.buffer.add(self.user.id, self.product_ids[1], True)
+        self.assertEqual(self.wait_for(set(self.product_ids[:2])), set(self.product_ids[:2]))
+
+    @override_settings(SELECTION_WRITE_BEHIND={'FLUSH_INTERVAL': 60, 'BATCH_SIZE': 2})
+    def test_full_batch_wakes_the_thread(self):
+        self.buffer.add(self.user.id, self.product_ids[0], True)
+        self.assertEqual(self.wait_for({self.product_ids[0]}, timeout=0.2), set())
+        self.buffer.add(self.user.id, self.product_ids[1], True)
+        self.assertEqual(self.wait_for(set(self.product_ids[:2])), set(self.product_ids[:2]))
+
+    @override_settings(SELECTION_WRITE_BEHIND={'FLUSH_INTERVAL': 60})
+    def test_stop_drains_the_queue(self):
+        for product_id in self.product_ids:
+            self.buffer.add(self.user.id, product_id, True)
+        self.buffer.stop()
+        self.assertEqual(self.selected(), set(self.product_ids))
+        self.assertEqual(len(self.buffer), 0)
+        self.assertFalse(self.buffer.add(self.user.id, self.product_ids[0], False))
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        request_metrics.reset()
+
+    def test_concurrent_threads_share_one_call(self):
+        flight = SingleFlight('search')
+        started, release, calls = threading.Event(), threading.Event(), []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'data': 'page'}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', compute)))
+        leader.start()
+        self.assertTrue(started.wait(5))
+
+        # Followers signal once they have joined the leader's call, right before waiting for it.
+        done, joined = flight._calls['key'].done, threading.Semaphore(0)
+        wait = done.wait
+
+        def joined_wait(timeout=None):
+            joined.release()
+            return wait(timeout)
+
+        done.wait = joined_wait
+        followers = [threading.Thread(target=lambda: results.append(flight.do('key', compute))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        for _ in followers:
+            self.assertTrue(joined.acquire(timeout=5))
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'data': 'page'}] * 4)
+        self.assertIs(results[0], results[-1])
+        self.assertIn('search_requests_coalesced_total{kind="search"} 3', request_metrics.render())
+        self.assertEqual(flight.do('key', lambda: 'fresh'), 'fresh')
+
+    def test_concurrent_coroutines_share_one_call_and_its_error(self):
+        flight = AsyncSingleFlight('facets')
+        calls = []
+
+        async def compute(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            if isinstance(value, Exception):
+                raise value
+            return value
+
+        async def main():
+            shared = await asyncio.gather(*(flight.do('a', lambda: compute('a')) for _ in range(3)),
+                                          flight.do('b', lambda: compute('b')))
+            errors = await asyncio.gather(*(flight.do('c', lambda: compute(ValueError('boom'))) for _ in range(2)),
+                                          return_exceptions=True)
+            return shared, errors
+
+        shared, errors = asyncio.run(main())
+        self.assertEqual(shared, ['a', 'a', 'a', 'b'])
+        self.assertEqual(len(calls), 3)
+        self.assertEqual([str(error) for error in errors], ['boom', 'boom'])
+        self.assertIn('search_requests_coalesced_total{kind="facets"} 3', request_metrics.render())
+
+    def test_a_cancelled_leader_does_not_cancel_its_followers(self):
+        flight = AsyncSingleFlight('search')
+        calls = []
+
+        async def compute():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        async def main():
+            leader = asyncio.create_task(flight.do('a', compute))
+            await asyncio.sleep(0)
+            followers = [asyncio.create_task(flight.do('a', compute)) for _ in range(2)]
+            await asyncio.sleep(0)
+            leader.cancel()
+            return leader, await asyncio.gather(*followers)
+
+        leader, results = asyncio.run(main())
+        self.assertTrue(leader.cancelled())
+        # One follower takes over and the other shares its result.
+        self.assertEqual(results, [2, 2])
+        self.assertIn('search_requests_coalesced_total{kind="search"} 1', request_metrics.render())
 
-# Create your tests here.
+    def test_disabled_runs_every_call(self):
+        with override_settings(SEARCH_SINGLE_FLIGHT={'ENABLED': False}):
+            self.assertEqual(SingleFlight('search').do('key', lambda: 1), 1)
+        self.assertNotIn('search_requests_coalesced_total{', request_metrics.render())
@@ -0,0 +1,17 @@
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from products.blacklist import blacklist_filter
+
+
+class FilteredRefreshToken(RefreshToken):
+    """RefreshToken that only queries the blacklist when the in-memory filter reports a possible hit."""
+
+    def check_blacklist(self):
+        if blacklist_filter.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
+
+    def blacklist(self):
+        result = super().blacklist()
+        blacklist_filter.add(self.payload[api_settings.JTI_CLAIM])
+        return result
@@ -1,13 +1,24 @@
 from django.urls import path
-from rest_framework_simplejwt.views import TokenBlacklistView
 
+from products.async_views import AsyncProductSearchView
+from products.async_views import AsyncProductSelectView
+from products.async_views import AsyncUserProductListView
 from products.views import SignupView
 from products.views import TokenObtainPairView
 from products.views import TokenRefreshView
+from products.views import TokenBlacklistView
 from products.views import ProductViewSet
+from products.views import ProductBulkCreateView
+from products.views import ProductReserveView
+from products.views import ProductReserveBatchView
 from products.views import ProductSearchView
+from products.views import SearchCacheStatsView
+from products.views import ProductSuggestView
+from products.views import SuggestIndexStatsView
 from products.views import ProductSelectViewSet
 from products.views import UserProductListView
+from products.views import SessionRestoreView
+from products.views import MetricsView
 
 urlpatterns = [
     path('auth/signup/', SignupView.as_view(), name='auth-signup'),
@@ -15,8 +26,20 @@ urlpatterns = [
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/logout/', TokenBlacklistView.as_view(), name='token_blacklist'),
     path('product/create/', ProductViewSet.as_view({'post': 'create'}), name='product-create'),
+    path('product/bulk-create/', ProductBulkCreateView.as_view(), name='product-bulk-create'),
     path('product/search/', ProductSearchView.as_view(), name='product-search'),
+    path('product/search/cache-stats/', SearchCacheStatsView.as_view(), name='product-search-cache-stats'),
+    path('product/suggest/', ProductSuggestView.as_view(), name='product-suggest'),
+    path('product/suggest/stats/', SuggestIndexStatsView.as_view(), name='product-suggest-stats'),
+    path('product/select/batch/', ProductSelectViewSet.as_view({'post': 'batch'}), name='product-select-batch'),
     path('product/<int:pk>/select/', ProductSelectViewSet.as_view({'post': 'select', "put": "deselect"}),
          name='product-select'),
+    path('product/reserve/batch/', ProductReserveBatchView.as_view(), name='product-reserve-batch'),
+    path('product/<int:pk>/reserve/', ProductReserveView.as_view(), name='product-reserve'),
     path('user/products/', UserProductListView.as_view(), name='user-products'),
+    path('session/restore/', SessionRestoreView.as_view(), name='session-restore'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('async/product/search/', AsyncProductSearchView.as_view(), name='async-product-search'),
+    path('async/product/<int:pk>/select/', AsyncProductSelectView.as_view(), name='async-product-select'),
+    path('async/user/products/', AsyncUserProductListView.as_view(), name='async-user-products'),
 ]
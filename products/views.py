@@ -1,24 +1,110 @@
-import django
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.http import HttpRequest
+from django.http import HttpResponse
+from django.http import QueryDict
+from django.http import StreamingHttpResponse
 from rest_framework import generics
 from rest_framework import viewsets
 from rest_framework import permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.views import APIView
 from rest_framework_simplejwt.exceptions import InvalidToken
 from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.views import TokenViewBase
 
 from product_manager.utils import create_json_response
+from products.authentication import invalidate_user
+from products.bulk import bulk_create_products
+from products.cache import search_cache
+from products.db import ReadOnlyViewMixin
+from products.encoders import EncodedRows
+from products.encoders import RowEncoder
+from products.etags import ConditionalListMixin
+from products.etags import search_etag
+from products.etags import user_products_etag
+from products.metrics import PROMETHEUS_CONTENT_TYPE
+from products.metrics import get_metrics_settings
+from products.metrics import request_metrics
+from products.metrics import timed
 from products.models import Product
 from products.models import ProductSelection
+from products.pagination import KeysetPagination
+from products.parsers import NDJSONParser
+from products.renderers import EnvelopeJSONRenderer
+from products.renderers import NDJSONRenderer
+from products.renderers import stream_json_envelope
+from products.renderers import stream_ndjson
+from products.search import build_search_queryset
+from products.search import filter_products
+from products.search import product_facets
+from products.selections import apply_selections
+from products.selections import create_selection
+from products.selections import deselect_selection
+from products.selections import user_selections
 from products.serializers import UserSerializer
 from products.serializers import ProductSerializer
 from products.serializers import ProductSelectionSerializer
+from products.serializers import ProductSelectionBatchSerializer
+from products.serializers import ProductSearchFilterSerializer
+from products.serializers import StockReservationBatchSerializer
+from products.serializers import StockReservationSerializer
+from products.serializers import UserProductSelectionSerializer
+from products.singleflight import facets_flight
+from products.singleflight import search_flight
+from products.snapshots import clear_snapshot
+from products.snapshots import get_snapshot
+from products.snapshots import record_search
+from products.snapshots import selected_product_ids
+from products.stock import reserve_stock
+from products.stock import reserve_stock_batch
+from products.suggest import suggest_index
+from products.writebehind import overlay_selected_ids
+from products.writebehind import overlay_user_products
+from products.writebehind import queue_selection_toggle
+from products.writebehind import selection_buffer
+
+product_row_encoder = RowEncoder(ProductSerializer)
+
+
+def row_columns(queryset):
+    """
+    The ``values_list()`` columns for encoding ``queryset`` with ``product_row_encoder``.
+
+    Annotations such as ``search_rank`` and the sort column are selected too,
+    so the paginator can read the sort key of each row; the encoder ignores
+    the extra columns.
+    """
+    sort_columns = [field.lstrip('-') for field in queryset.query.order_by if isinstance(field, str)]
+    extra = [column for column in (*queryset.query.annotations, *sort_columns)
+             if column not in product_row_encoder.columns]
+    return [*product_row_encoder.columns, *dict.fromkeys(extra)]
+
+
+def mark_selected(payload, selected_ids):
+    """
+    Return a search page ``payload`` with a ``selected`` flag on each product.
+
+    The payload may come from the search cache and is shared between users,
+    so a new one is built instead of updating it in place.
+    """
+    if not payload['data']:
+        return payload
+    rows = payload['data'][0]
+    if isinstance(rows, EncodedRows):
+        rows = product_row_encoder.add_field(rows, 'selected', [pk in selected_ids for pk in rows.ids])
+    else:
+        rows = [dict(row, selected=row['id'] in selected_ids) for row in rows]
+    return dict(payload, data=[rows])
 
 
 class SignupView(generics.CreateAPIView):
@@ -110,6 +196,31 @@ class TokenRefreshView(TokenViewBase):
                         status=status.HTTP_200_OK)
 
 
+class TokenBlacklistView(TokenViewBase):
+    """
+    Takes a refresh type JSON web token and adds it to the blacklist.
+
+    The token owner is also dropped from the authentication user cache, so
+    the next request re-reads the user from the database, and their session
+    snapshot is cleared.
+    """
+
+    _serializer_class = api_settings.TOKEN_BLACKLIST_SERIALIZER
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        user_id = serializer.token.payload.get(api_settings.USER_ID_CLAIM)
+        invalidate_user(user_id)
+        clear_snapshot(user_id)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
+
+
 class ProductViewSet(viewsets.ModelViewSet):
     """
     API endpoint for Creating products.
@@ -141,7 +252,201 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response(create_json_response(status=False, message=e), status=status.HTTP_400_BAD_REQUEST)
 
 
-class ProductSearchView(generics.ListAPIView):
+class ProductBulkCreateView(APIView):
+    """
+    API endpoint for creating many products in one request.
+
+    Rows are validated with ProductSerializer(many=True) and inserted with bulk_create, `chunk_size` rows
+    per transaction. Invalid rows are reported by index and don't prevent valid rows from being created.
+
+    Request method: POST
+    Endpoint: /api/product/bulk-create/
+
+    Request Payload (application/json), or one product per line (application/x-ndjson):
+    [
+        {
+            "name": "string",
+            "description": "string",
+            "price": "decimal",
+            "stock": "integer"
+        },
+        ...
+    ]
+
+    Returns:
+        200 OK: At least one product was created, or the payload was empty.
+            Response Payload:
+            {
+                "status": true,
+                "message": "2 Products Created",
+                "data": [
+                    {
+                        "created": 2,
+                        "errors": [
+                            {
+                                "index": 1,
+                                "errors": {"price": ["A valid number is required."]}
+                            }
+                        ]
+                    }
+                ]
+            }
+
+        400 BAD REQUEST: The payload is not a list, or no row is valid.
+
+    Permissions:
+        - Only authenticated users can access this endpoint.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [JSONParser, NDJSONParser]
+    chunk_size = 1000
+
+    def post(self, request, *args, **kwargs):
+        try:
+            rows = request.data
+            if not isinstance(rows, list):
+                return Response(create_json_response(status=False, message="Expected a list of products"),
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            created, errors = bulk_create_products(rows, self.chunk_size)
+            data = dict(created=len(created), errors=errors)
+            if errors and not created:
+                return Response(create_json_response(status=False, message="No Products Created", data=data),
+                                status=status.HTTP_400_BAD_REQUEST)
+            return Response(create_json_response(status=True, message=f"{len(created)} Products Created", data=data))
+        except Exception as e:
+            return Response(create_json_response(status=False, message=e), status=status.HTTP_400_BAD_REQUEST)
+
+
+class ProductReserveView(APIView):
+    """
+    API endpoint for reserving stock of a product, e.g. at checkout.
+
+    The stock is taken with a single conditional UPDATE (see products/stock.py), so concurrent reservations
+    never oversell and never lose each other's updates.
+
+    Request method: POST
+    Endpoint: /api/product/{id}/reserve/
+
+    Request Payload:
+    {
+        "quantity": "integer (optional, defaults to 1)"
+    }
+
+    Returns:
+        200 OK: Stock reserved.
+            Response Payload:
+            {
+                "status": true,
+                "message": "Product Reserved",
+                "data": [
+                    {
+                        "product": 1,
+                        "quantity": 2
+                    }
+                ]
+            }
+
+        400 BAD REQUEST: Invalid quantity.
+        404 NOT FOUND: Product with the specified ID not found.
+        409 CONFLICT: Not enough stock; nothing was reserved.
+
+    Permissions:
+        - Only authenticated users can access this endpoint.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, pk=None):
+        try:
+            serializer = StockReservationSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            quantity = serializer.validated_data['quantity']
+            if not reserve_stock(pk, quantity):
+                return Response(create_json_response(status=False, message="Insufficient stock"),
+                                status=status.HTTP_409_CONFLICT)
+            return Response(create_json_response(status=True, message="Product Reserved",
+                                                 data=dict(product=pk, quantity=quantity)))
+        except ValidationError as e:
+            return Response(create_json_response(status=False, message=e), status=status.HTTP_400_BAD_REQUEST)
+        except Product.DoesNotExist:
+            return Response(create_json_response(status=False, message="Product doesnt exist"),
+                            status=status.HTTP_404_NOT_FOUND)
+        except Exception:
+            return Response(create_json_response(status=False, message="General Error on Reserve API"),
+                            status=status.HTTP_400_BAD_REQUEST)
+
+
+class ProductReserveBatchView(APIView):
+    """
+    API endpoint for reserving stock of several products at once, all or nothing.
+
+    Request method: POST
+    Endpoint: /api/product/reserve/batch/
+
+    Request Payload:
+    {
+        "items": [
+            {"product": 1, "quantity": 2},
+            {"product": 3}
+        ]
+    }
+
+    Quantities of repeated products are added up.
+
+    Returns:
+        200 OK: Every item was reserved.
+            Response Payload:
+            {
+                "status": true,
+                "message": "Products Reserved",
+                "data": [
+                    {
+                        "items": [{"product": 1, "quantity": 2}, {"product": 3, "quantity": 1}]
+                    }
+                ]
+            }
+
+        400 BAD REQUEST: Invalid payload.
+        409 CONFLICT: Some products don't exist or lack stock; nothing was reserved.
+            Response Payload:
+            {
+                "status": false,
+                "message": "Products Not Reserved",
+                "data": [
+                    {
+                        "insufficient": [3],
+                        "unknown": []
+                    }
+                ]
+            }
+
+    Permissions:
+        - Only authenticated users can access this endpoint.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        try:
+            serializer = StockReservationBatchSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            quantities = {}
+            for item in serializer.validated_data['items']:
+                quantities[item['product']] = quantities.get(item['product'], 0) + item['quantity']
+            insufficient, unknown = reserve_stock_batch(quantities)
+            if insufficient or unknown:
+                return Response(create_json_response(status=False, message="Products Not Reserved",
+                                                     data=dict(insufficient=insufficient, unknown=unknown)),
+                                status=status.HTTP_409_CONFLICT)
+            items = [dict(product=pk, quantity=quantity) for pk, quantity in quantities.items()]
+            return Response(create_json_response(status=True, message="Products Reserved", data=dict(items=items)))
+        except ValidationError as e:
+            return Response(create_json_response(status=False, message=e), status=status.HTTP_400_BAD_REQUEST)
+        except Exception:
+            return Response(create_json_response(status=False, message="General Error on Batch Reserve API"),
+                            status=status.HTTP_400_BAD_REQUEST)
+
+
+class ProductSearchView(ReadOnlyViewMixin, ConditionalListMixin, generics.ListAPIView):
     """
     API endpoint for searching and sorting products.
 
@@ -151,46 +456,92 @@ class ProductSearchView(generics.ListAPIView):
     Endpoint: /api/product/search/
 
     Query Parameters:
-    - query (optional): The search query string.
+    - query (optional): The search query string. Matched against name and description through the
+      full-text index when it is available, otherwise by a case-insensitive substring match on both.
     - sort_by (optional): The field to sort the search results by. Defaults to 'name'.
+      'relevance' orders full-text matches by BM25 rank. 'popularity' orders by how many users have
+      selected each product, read from the indexed Product.selection_count.
     - sort_order (optional): The sort order for the search results. 'asc' for ascending (default), 'desc' for descending.
-
-    Returns a list of serialized products based on the search query and sorting parameters.
+    - page_size (optional): Number of products per page. Defaults to 50, capped at 500.
+    - cursor (optional): The `next` or `prev` cursor of a previous response.
+    - price_min, price_max (optional): Inclusive price range.
+    - in_stock (optional): 'true' for products in stock, 'false' for products out of stock.
+    - stock_min (optional): Minimum stock.
+    - facets (optional): '1' adds counts per price bucket and in/out of stock for all matching products,
+      computed in a single aggregate query and cached per catalog version.
+    - include_selected (optional): '1' adds `selected: true/false` to each product for the current user.
+      The flags come from the user's cached set of selected product ids, so cached pages stay shared between
+      users and no per-row lookup is made.
+    - stream (optional): '1' streams every matching product in a single response instead of one page.
+      Send `Accept: application/x-ndjson` (or `format=ndjson`) to stream one product per line instead.
+
+    Returns a page of serialized products based on the search query and sorting parameters.
+    Pages are cached per catalog version, so any product write invalidates every cached search.
+    Responses carry a strong ETag built from the catalog version and the query parameters; a request whose
+    If-None-Match matches it gets 304 Not Modified without running the search.
 
     Returns:
         200 OK: Successful search operation.
             Response Payload:
-            [
-                {
-                    "id": "integer",
-                    "name": "string",
-                    "description": "string",
-                    "price": "decimal",
-                    "stock": "integer",
-                },
-                ...
-            ]
+            {
+                "status": true,
+                "message": "Products Overview",
+                "data": [
+                    [
+                        {
+                            "id": "integer",
+                            "name": "string",
+                            "description": "string",
+                            "price": "decimal",
+                            "stock": "integer",
+                            "selected": "boolean (with include_selected)"
+                        },
+                        ...
+                    ]
+                ],
+                "next": "string or null",
+                "prev": "string or null",
+                "facets": {
+                    "total": "integer",
+                    "price": [{"min": 0, "max": 10, "count": "integer"}, ..., {"min": 1000, "max": null, ...}],
+                    "stock": {"in_stock": "integer", "out_of_stock": "integer"}
+                }
+            }
 
-        400 BAD REQUEST: Invalid query or sorting parameters.
+        400 BAD REQUEST: Invalid query, filter or sorting parameters.
     """
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    renderer_classes = [EnvelopeJSONRenderer, BrowsableAPIRenderer, NDJSONRenderer]
+    stream_chunk_size = 1000
+
+    def get_etag(self, request):
+        return search_etag(request.query_params, request.accepted_media_type, request.user.id)
+
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == status.HTTP_304_NOT_MODIFIED and not self.is_streaming():
+            # A revalidated page is still the page the user is on.
+            record_search(request.user.id, request.query_params)
+        return response
+
+    def get_filters(self):
+        if not hasattr(self, '_filters'):
+            serializer = ProductSearchFilterSerializer(data=self.request.query_params)
+            serializer.is_valid(raise_exception=True)
+            self._filters = serializer.validated_data
+        return self._filters
 
     def get_queryset(self):
+        filters = self.get_filters()
         try:
             query = self.request.query_params.get('query', '')
             sort_by = self.request.query_params.get('sort_by', 'name')
             sort_order = self.request.query_params.get('sort_order', 'asc')
 
-            products = Product.objects.filter(name__icontains=query)
-            fields = ProductSerializer.Meta.fields
-
-            # Apply sorting based on the sort_by and sort_order parameters
-            if sort_by in fields:
-                # Construct the sort field based on sort_by and sort_order
-                sort_field = sort_by if sort_order == 'asc' else f"-{sort_by}"
-                products = products.order_by(sort_field)
-
+            products = build_search_queryset(filter_products(Product.objects.all(), filters), query, sort_by,
+                                             sort_order, ProductSerializer.Meta.fields)
             return products
         except Exception as e:
             return Product.objects.none()
@@ -198,11 +549,209 @@ class ProductSearchView(generics.ListAPIView):
     def list(self, request, *args, **kwargs):
         try:
             queryset = self.get_queryset()
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(create_json_response(status=True, message=f"Products Overview", data=serializer.data))
+            if self.is_streaming():
+                return self.stream_response(queryset)
+
+            fast_path = self.use_fast_path()
+            cache_key = self.get_cache_key(fast_path)
+            payload = search_cache.get(cache_key) if search_cache.enabled else None
+            if payload is None:
+                payload = search_flight.do(cache_key, lambda: self.get_payload(queryset, fast_path, cache_key))
+            record_search(request.user.id, request.query_params)
+            if self.get_filters()['include_selected']:
+                selected_ids = overlay_selected_ids(request.user.id, selected_product_ids(request.user.id))
+                payload = mark_selected(payload, frozenset(selected_ids))
+            if self.get_filters()['facets']:
+                payload = dict(payload, facets=self.get_facets(queryset))
+            return Response(payload)
+        except ValidationError as e:
+            return Response(dict(error=e.detail), status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response(dict(error=str(e)), status=status.HTTP_400_BAD_REQUEST)
 
+    def get_facets(self, queryset):
+        """Facet counts for every product matching the query and filters, cached per catalog version."""
+        cache_key = search_cache.make_facets_key(self.request.query_params)
+        facets = search_cache.get(cache_key) if search_cache.enabled else None
+        if facets is None:
+            facets = facets_flight.do(cache_key, lambda: self.compute_facets(queryset, cache_key))
+        return facets
+
+    def compute_facets(self, queryset, cache_key):
+        facets = product_facets(queryset)
+        if search_cache.enabled:
+            search_cache.set(cache_key, facets)
+        return facets
+
+    def use_fast_path(self):
+        """
+        Whether to serialize through ``product_row_encoder`` (``PRODUCT_SEARCH_FAST_PATH``).
+
+        Only plain JSON responses qualify; the encoded rows are spliced in by EnvelopeJSONRenderer.
+        """
+        return getattr(settings, 'PRODUCT_SEARCH_FAST_PATH', False) and isinstance(
+            self.request.accepted_renderer, EnvelopeJSONRenderer)
+
+    def get_payload(self, queryset, fast_path, cache_key):
+        """
+        Query and serialize the page, caching it under ``cache_key``.
+
+        Runs once for identical concurrent searches (see ``products.singleflight``).
+        """
+        if fast_path:
+            payload = self.get_fast_payload(queryset)
+        else:
+            page = self.paginate_queryset(queryset)
+            with timed('serialize'):
+                data = self.get_serializer(page, many=True).data
+            payload = self.paginator.get_paginated_payload(data, message="Products Overview")
+        if search_cache.enabled:
+            search_cache.set(cache_key, payload)
+        return payload
+
+    def get_fast_payload(self, queryset):
+        """Build the page payload from ``values_list()`` rows instead of model instances."""
+        rows = self.paginate_queryset(queryset.values_list(*row_columns(queryset), named=True))
+        with timed('serialize'):
+            data = product_row_encoder.encode_many(rows)
+        return self.paginator.get_paginated_payload(data, message="Products Overview")
+
+    def get_cache_key(self, fast_path=False):
+        return search_cache.make_search_key(self.request.query_params, self.paginator.get_page_size(self.request),
+                                            fast_path)
+
+    def is_streaming(self):
+        ndjson = isinstance(self.request.accepted_renderer, NDJSONRenderer)
+        return ndjson or self.request.query_params.get('stream') in ('1', 'true')
+
+    def stream_response(self, queryset):
+        """
+        Stream every product of ``queryset`` without materializing the result set.
+
+        Rows are fetched with ``.iterator()`` and serialized
+        ``stream_chunk_size`` at a time, so memory stays flat regardless of
+        how many products match.
+        """
+        # The body is produced after dispatch has left read_database(), so pin the alias the view was routed to.
+        rows = queryset.using(queryset.db).iterator(chunk_size=self.stream_chunk_size)
+        serializer = self.get_serializer()
+        if isinstance(self.request.accepted_renderer, NDJSONRenderer):
+            content = stream_ndjson(rows, serializer, self.stream_chunk_size)
+            return StreamingHttpResponse(content, content_type=NDJSONRenderer.media_type)
+        content = stream_json_envelope(rows, serializer, self.stream_chunk_size, message="Products Overview")
+        return StreamingHttpResponse(content, content_type='application/json')
+
+
+class SearchCacheStatsView(APIView):
+    """
+    API endpoint exposing the search result cache counters of this process.
+
+    Request method: GET
+    Endpoint: /api/product/search/cache-stats/
+
+    Returns:
+        200 OK:
+            Response Payload:
+            {
+                "status": true,
+                "message": "Search cache stats",
+                "data": [
+                    {
+                        "local_hits": "integer",
+                        "shared_hits": "integer",
+                        "misses": "integer",
+                        "hit_ratio": "float",
+                        "local_entries": "integer",
+                        "catalog_version": "integer"
+                    }
+                ]
+            }
+
+    Permissions:
+        - Only staff users can access this endpoint.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(create_json_response(status=True, message="Search cache stats", data=search_cache.stats()))
+
+
+class ProductSuggestView(APIView):
+    """
+    API endpoint for name suggestions while the user types.
+
+    Served from the in-memory prefix index in products/suggest.py, so it does not query the database.
+
+    Request method: GET
+    Endpoint: /api/product/suggest/
+
+    Query Parameters:
+    - query: The prefix typed so far. Matching ignores case and repeated whitespace.
+    - limit (optional): Maximum number of suggestions. Defaults to 10, capped at 50.
+
+    Returns:
+        200 OK:
+            Response Payload:
+            {
+                "status": true,
+                "message": "Product Suggestions",
+                "data": [
+                    [
+                        {
+                            "id": "integer",
+                            "name": "string"
+                        },
+                        ...
+                    ]
+                ]
+            }
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    default_limit = 10
+    max_limit = 50
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+        suggestions = suggest_index.suggest(request.query_params.get('query', ''), max(limit, 0))
+        data = [dict(id=pk, name=name) for pk, name in suggestions]
+        return Response(create_json_response(status=True, message="Product Suggestions", data=data))
+
+
+class SuggestIndexStatsView(APIView):
+    """
+    API endpoint reporting the size and build time of this process's suggestion index.
+
+    Request method: GET
+    Endpoint: /api/product/suggest/stats/
+
+    Returns:
+        200 OK:
+            Response Payload:
+            {
+                "status": true,
+                "message": "Suggestion index stats",
+                "data": [
+                    {
+                        "entries": "integer",
+                        "memory_bytes": "integer",
+                        "build_seconds": "float"
+                    }
+                ]
+            }
+
+    Permissions:
+        - Only staff users can access this endpoint.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        suggest_index.ensure_loaded()
+        return Response(create_json_response(status=True, message="Suggestion index stats",
+                                             data=suggest_index.stats()))
+
 
 class ProductSelectViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
@@ -235,6 +784,9 @@ class ProductSelectViewSet(viewsets.ModelViewSet):
                 ]
             }
 
+            - 202 ACCEPTED: Same payload, when write-behind (SELECTION_WRITE_BEHIND) is enabled. The selection
+              is queued and written within FLUSH_INTERVAL seconds.
+
             - 404 NOT FOUND: Product with the specified ID not found.
 
         Raises:
@@ -242,28 +794,23 @@ class ProductSelectViewSet(viewsets.ModelViewSet):
 
         """
         try:
-
-            serializer = ProductSelectionSerializer(
-                data=dict(user=request.user.id, product=pk, selected=True))
-            if serializer.is_valid(raise_exception=True):
-                serializer.save()
-                return Response(
-                    create_json_response(status=True, message=f"Product Selected by user {request.user.username}",
-                                         data=serializer.data))
-        except django.db.utils.IntegrityError as e:
-            return Response(
-                create_json_response(status=True, message=f"Product Selected by user {request.user.username} again"),
-                status=status.HTTP_200_OK)
-        except ValidationError as e:
-            error_detail = e.detail
-            error_message = error_detail.get('non_field_errors', None)
-            if str(error_message[0]).__contains__('unique'):
+            if selection_buffer.enabled:
+                response = self.queue_toggle(request, pk, selected=True)
+                if response is not None:
+                    return response
+
+            if not Product.objects.filter(pk=pk).exists():
+                raise Product.DoesNotExist
+            # Selects a deselected product again, like a queued select does.
+            selection, changed = create_selection(request.user.id, pk)
+            if not changed:
                 return Response(
                     create_json_response(status=True,
                                          message=f"Product Selected by user {request.user.username} again"),
                     status=status.HTTP_200_OK)
-            return Response(create_json_response(status=False, message=e),
-                            status=status.HTTP_400_BAD_REQUEST)
+            return Response(
+                create_json_response(status=True, message=f"Product Selected by user {request.user.username}",
+                                     data=ProductSelectionSerializer(selection).data))
         except Product.DoesNotExist:
             return Response(create_json_response(status=False, message="Product doesnt exist"),
                             status=status.HTTP_404_NOT_FOUND)
@@ -299,6 +846,8 @@ class ProductSelectViewSet(viewsets.ModelViewSet):
                     ]
                 }
 
+            - 202 ACCEPTED: Same payload, when write-behind (SELECTION_WRITE_BEHIND) is enabled.
+
             - 404 NOT FOUND: Product with the specified ID not found.
 
         Raises:
@@ -306,10 +855,15 @@ class ProductSelectViewSet(viewsets.ModelViewSet):
 
         """
         try:
+            if selection_buffer.enabled:
+                response = self.queue_toggle(request, pk, selected=False)
+                if response is not None:
+                    return response
+
             product_selection = ProductSelection.objects.get(user_id=request.user.id, product_id=pk)
             serializer = ProductSelectionSerializer(product_selection, data={'selected': False}, partial=True)
             if serializer.is_valid():
-                serializer.save()
+                deselect_selection(product_selection)
                 return Response(
                     create_json_response(status=True, message=f"Product Deselected by user {request.user.username}",
                                          data=serializer.data))
@@ -320,76 +874,264 @@ class ProductSelectViewSet(viewsets.ModelViewSet):
             return Response(create_json_response(status=False, message="General Error on Deselect API"),
                             status=status.HTTP_400_BAD_REQUEST)
 
+    def queue_toggle(self, request, pk, selected):
+        """
+        Queue a select or deselect in the write-behind buffer and answer 202 Accepted.
+
+        Only reads are made here. Returns None when the buffer is full, and
+        the caller then writes synchronously.
+        """
+        user_id = request.user.id
+        if not queue_selection_toggle(user_id, pk, selected):
+            return None
+        verb = "Selected" if selected else "Deselected"
+        return Response(create_json_response(status=True, message=f"Product {verb} by user {request.user.username}",
+                                             data=dict(user=user_id, product=pk, selected=selected)),
+                        status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        API endpoint to select or deselect many products at once.
+
+        Applies the requested state to every listed product with a single upsert, creating
+        selections that don't exist yet.
+
+        Request method: POST
+        Endpoint: /api/product/select/batch/
+
+        Request Payload:
+            {
+                "product_ids": [1, 2, 3],
+                "selected": true
+            }
+
+        Returns:
+            - 200 OK: Selections updated.
+                Response Payload:
+                {
+                    "status": true,
+                    "message": "Products Selected by user aastasaayyassb",
+                    "data": [
+                        {
+                            "selected": true,
+                            "product_ids": [1, 2],
+                            "unknown_ids": [3]
+                        }
+                    ]
+                }
+
+            - 400 BAD REQUEST: Invalid payload.
+
+        """
+        try:
+            serializer = ProductSelectionBatchSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            selected = serializer.validated_data['selected']
+            applied, unknown = apply_selections(request.user.id, serializer.validated_data['product_ids'], selected)
+            verb = "Selected" if selected else "Deselected"
+            return Response(
+                create_json_response(status=True, message=f"Products {verb} by user {request.user.username}",
+                                     data=dict(selected=selected, product_ids=applied, unknown_ids=unknown)))
+        except ValidationError as e:
+            return Response(create_json_response(status=False, message=e),
+                            status=status.HTTP_400_BAD_REQUEST)
+        except Exception:
+            return Response(create_json_response(status=False, message="General Error on Batch Select API"),
+                            status=status.HTTP_400_BAD_REQUEST)
+
 
-class UserProductListView(ListAPIView):
-    serializer_class = ProductSelectionSerializer
+class UserProductListView(ReadOnlyViewMixin, ConditionalListMixin, ListAPIView):
+    serializer_class = UserProductSelectionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        user = self.request.user
-        return ProductSelection.objects.filter(user=user)
+        # One query per page, see user_selections().
+        return user_selections(self.request.user.id)
+
+    def get_etag(self, request):
+        return user_products_etag(request.user.id, request.query_params, request.accepted_media_type)
 
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        context.update({"depth": 1})
-        return context
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data, message=f"Products of user {self.request.user.username}")
 
     def list(self, request, *args, **kwargs):
         """
                 API endpoint to retrieve products of a user.
 
-                Returns the list of products selected by the user.
+                Returns the list of products selected by the user, one page at a time.
 
                 Request method: GET
                 Endpoint: /api/user/products/
 
+                Query Parameters:
+                - page_size (optional): Number of selections per page. Defaults to 50, capped at 500.
+                - cursor (optional): The `next` or `prev` cursor of a previous response.
+
+                Responses carry a strong ETag built from the catalog version and the user's selection
+                version; send it back in If-None-Match to get 304 Not Modified when nothing changed.
+
                 Returns:
                     - 200 OK: Products retrieved successfully.
                         Response Payload:
                                         {
                     "status": true,
-                    "message": "Products Overview",
+                    "message": "Products of user aastasaayyassb",
                     "data": [
                         [
                             {
-                                "id": 4,
-                                "name": "adada",
-                                "description": "This is a sample product description.",
-                                "price": "121.00",
-                                "stock": 2
-                            },
-                            {
-                                "id": 1,
-                                "name": "amazon",
-                                "description": "This is a sample product description.",
-                                "price": "121.00",
-                                "stock": 2
+                                "user": 1,
+                                "product": {
+                                    "id": 4,
+                                    "name": "adada",
+                                    "description": "This is a sample product description.",
+                                    "price": "121.00",
+                                    "stock": 2
+                                },
+                                "selected": true
                             },
                             {
-                                "id": 3,
-                                "name": "some",
-                                "description": "This is a sample product description.",
-                                "price": "121.00",
-                                "stock": 2
-                            },
-                            {
-                                "id": 2,
-                                "name": "wwd",
-                                "description": "This is a sample product description.",
-                                "price": "121.00",
-                                "stock": 2
+                                "user": 1,
+                                "product": {
+                                    "id": 1,
+                                    "name": "amazon",
+                                    "description": "This is a sample product description.",
+                                    "price": "121.00",
+                                    "stock": 2
+                                },
+                                "selected": false
                             }
                         ]
-                    ]
+                    ],
+                    "next": null,
+                    "prev": null
                     }
                 """
         queryset = self.filter_queryset(self.get_queryset())
 
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            with timed('serialize'):
+                data = self.get_serializer(page, many=True).data
+            data = overlay_user_products(request.user.id, data, last_page=self.paginator.next_cursor is None)
+            return self.get_paginated_response(data)
 
         serializer = self.get_serializer(queryset, many=True)
         return Response(create_json_response(status=True, message=f"Products of user {request.user.username}",
                                              data=serializer.data))
+
+
+class SessionRestoreView(ReadOnlyViewMixin, APIView):
+    """
+    API endpoint restoring a user's session in one round trip.
+
+    Returns the user's last search, the page of results it was on and the ids of their selected products,
+    so a reopened tab doesn't need a search and a /api/user/products/ request after refreshing its token.
+    Served from a per-user snapshot (products/snapshots.py) that searches and selection writes keep up to
+    date, so a restore costs one query for the saved search, at most one for the selected ids, plus the search
+    page, which usually comes from the search cache, however many selections the account has.
+
+    Request method: GET
+    Endpoint: /api/session/restore/
+
+    Returns:
+        200 OK:
+            Response Payload:
+            {
+                "status": true,
+                "message": "Session of user aastasaayyassb",
+                "data": [
+                    {
+                        "search": {"query": "string", "sort_by": "string", "sort_order": "string", "cursor": "..."},
+                        "results": {
+                            "data": [{"id": "integer", "name": "string", ...}, ...],
+                            "next": "string or null",
+                            "prev": "string or null"
+                        },
+                        "selected_product_ids": [1, 4]
+                    }
+                ]
+            }
+
+            `search` is empty when the user hasn't searched yet; `results` is then the first page of the
+            default search.
+
+        400 BAD REQUEST: The session could not be restored.
+
+    Permissions:
+        - Only authenticated users can access this endpoint.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            search, selected = get_snapshot(request.user.id)
+            search = search or {}
+            selected_ids = overlay_selected_ids(request.user.id, selected_product_ids(request.user.id, selected))
+            try:
+                results = self.get_results(search)
+            except NotFound:
+                # The saved cursor no longer decodes; start the search over.
+                search = {name: value for name, value in search.items() if name != 'cursor'}
+                results = self.get_results(search)
+            data = dict(search=search, results=results, selected_product_ids=selected_ids)
+            return Response(create_json_response(status=True, message=f"Session of user {request.user.username}",
+                                                 data=data))
+        except Exception as e:
+            return Response(create_json_response(status=False, message=e), status=status.HTTP_400_BAD_REQUEST)
+
+    def get_results(self, search):
+        """The search page for the saved parameters, shared with ProductSearchView's cache entries."""
+        params = QueryDict(mutable=True)
+        params.update(search)
+        search_request = HttpRequest()
+        search_request.GET = params
+        search_request = Request(search_request)
+
+        serializer = ProductSearchFilterSerializer(data=params)
+        serializer.is_valid(raise_exception=True)
+        queryset = build_search_queryset(filter_products(Product.objects.all(), serializer.validated_data),
+                                         params.get('query', ''), params.get('sort_by', 'name'),
+                                         params.get('sort_order', 'asc'), ProductSerializer.Meta.fields)
+
+        paginator = KeysetPagination()
+        cache_key = None
+        if search_cache.enabled:
+            cache_key = search_cache.make_search_key(params, paginator.get_page_size(search_request))
+        payload = search_cache.get(cache_key) if cache_key else None
+        if payload is None:
+            page = paginator.paginate_queryset(queryset, search_request)
+            with timed('serialize'):
+                data = ProductSerializer(page, many=True).data
+            payload = paginator.get_paginated_payload(data, message="Products Overview")
+            if cache_key:
+                search_cache.set(cache_key, payload)
+        return dict(data=payload['data'][0] if payload['data'] else [], next=payload['next'], prev=payload['prev'])
+
+
+class CanReadMetrics(permissions.BasePermission):
+    """Allows staff users, and requests from ``REQUEST_METRICS['ALLOWED_IPS']`` without a token."""
+
+    def has_permission(self, request, view):
+        if request.META.get('REMOTE_ADDR') in get_metrics_settings()['ALLOWED_IPS']:
+            return True
+        return bool(request.user and request.user.is_staff)
+
+
+class MetricsView(APIView):
+    """
+    Request metrics of this process in Prometheus text format.
+
+    Request method: GET
+    Endpoint: /api/metrics
+
+    Histograms of wall time, database queries, database time, serialization time and authentication time,
+    labelled by URL name and method, plus request counts by status. Recorded by RequestMetricsMiddleware.
+    Readable by staff users; list the scraper's address in REQUEST_METRICS['ALLOWED_IPS'] to let Prometheus
+    scrape it without a token.
+    """
+    permission_classes = [CanReadMetrics]
+
+    def get(self, request):
+        return HttpResponse(request_metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
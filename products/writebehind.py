@@ -0,0 +1,250 @@
+"""
+Write-behind buffering of select/deselect toggles (``SELECTION_WRITE_BEHIND``).
+
+When enabled, ``ProductSelectViewSet`` and ``AsyncProductSelectView`` answer
+select and deselect with 202 Accepted and queue the toggle here (through
+``queue_selection_toggle()``) instead of writing it. Toggles are
+coalesced per ``(user, product)``: the latest one wins. A background thread
+writes everything queued every ``FLUSH_INTERVAL`` seconds, or sooner once
+``BATCH_SIZE`` toggles are waiting. Each flush is one transaction of
+``write_selections`` upserts, so a burst of clicks costs one write lock
+instead of one per click. The ids are checked against the products before
+that transaction, so it starts with a write (see
+``products.selections.count_selection_changes``).
+
+The queue holds at most ``MAX_PENDING`` toggles; when it is full the view
+writes synchronously, as it does with write-behind disabled. Reads that
+list or flag a user's selections overlay that user's queued toggles, so
+users always see their own writes. Queued toggles only live in this process:
+``stop()`` drains them and runs at interpreter exit, but a killed process
+loses what was queued.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import OperationalError
+from django.db import close_old_connections
+from django.db import connections
+from django.db import transaction
+
+from products.models import Product
+from products.models import ProductSelection
+from products.selections import split_known_products
+from products.selections import write_selections
+from products.serializers import ProductSerializer
+
+logger = logging.getLogger(__name__)
+
+SELECTION_WRITE_BEHIND_DEFAULTS = {
+    'ENABLED': False,
+    'MAX_PENDING': 10000,
+    'BATCH_SIZE': 1000,
+    # None disables the background thread; toggles are then only written by flush() and stop().
+    'FLUSH_INTERVAL': 0.5,
+}
+
+
+def get_write_behind_settings():
+    return {**SELECTION_WRITE_BEHIND_DEFAULTS, **getattr(settings, 'SELECTION_WRITE_BEHIND', {})}
+
+
+class SelectionWriteBuffer:
+    """A bounded, per-process queue of selection toggles with a background flusher."""
+
+    def __init__(self):
+        self._pending = {}  # user id -> {product id: selected}
+        self._flushing = {}  # the same, for the batch being written
+        self._size = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def config(self):
+        return get_write_behind_settings()
+
+    @property
+    def enabled(self):
+        return self.config['ENABLED']
+
+    def add(self, user_id, product_id, selected):
+        """Queue a toggle. Returns False, queueing nothing, when the queue is full or shutting down."""
+        config = self.config
+        with self._lock:
+            if self._stopping:
+                return False
+            toggles = self._pending.setdefault(user_id, {})
+            if product_id not in toggles:
+                if self._size >= config['MAX_PENDING']:
+                    return False
+                self._size += 1
+            toggles[product_id] = selected
+            if self._size >= config['BATCH_SIZE']:
+                self._wakeup.notify()
+        if config['FLUSH_INTERVAL'] is not None:
+            self._ensure_started()
+        return True
+
+    def pending_for(self, user_id):
+        """The queued toggles of ``user_id`` as ``{product id: selected}``, including a batch being written."""
+        with self._lock:
+            return {**self._flushing.get(user_id, {}), **self._pending.get(user_id, {})}
+
+    def __len__(self):
+        return self._size
+
+    def flush(self):
+        """Write every queued toggle in one transaction. Returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending, self._size = self._pending, {}, 0
+                self._flushing = batch
+            try:
+                return self._write(batch)
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def _write(self, batch):
+        if not batch:
+            return 0
+        try:
+            writes = {user_id: self._prepare(toggles) for user_id, toggles in batch.items()}
+            with transaction.atomic():
+                for user_id, groups in writes.items():
+                    self._apply(user_id, groups)
+            return sum(len(toggles) for toggles in batch.values())
+        except OperationalError:
+            # Most likely the database is busy; try again with the next flush.
+            logger.exception("Flushing %d selection toggles failed; they stay queued.", len(batch))
+            self._requeue(batch)
+            return 0
+        except Exception:
+            logger.exception("Flushing selection toggles failed; retrying user by user.")
+
+        written = 0
+        for user_id, toggles in batch.items():
+            try:
+                groups = self._prepare(toggles)
+                with transaction.atomic():
+                    self._apply(user_id, groups)
+                written += len(toggles)
+            except Exception:
+                logger.exception("Dropping %d selection toggles of user %s.", len(toggles), user_id)
+        return written
+
+    def _prepare(self, toggles):
+        """``toggles`` as ``[(selected, product ids)]``, leaving out ids that match no product."""
+        known, _ = split_known_products(list(toggles))
+        groups = []
+        for selected in (True, False):
+            product_ids = [product_id for product_id in known if toggles[product_id] is selected]
+            if product_ids:
+                groups.append((selected, product_ids))
+        return groups
+
+    def _apply(self, user_id, groups):
+        for selected, product_ids in groups:
+            write_selections(user_id, product_ids, selected)
+
+    def _requeue(self, batch):
+        with self._lock:
+            for user_id, toggles in batch.items():
+                # Toggles queued since the batch was taken are newer and win.
+                queued = self._pending.get(user_id, {})
+                merged = {**toggles, **queued}
+                self._size += len(merged) - len(queued)
+                self._pending[user_id] = merged
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None and not self._stopping:
+                self._thread = threading.Thread(target=self._run, name='selection-write-behind', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._stopping and self._size < self.config['BATCH_SIZE']:
+                    self._wakeup.wait(self.config['FLUSH_INTERVAL'])
+                stopping = self._stopping
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Selection write-behind flush failed.")
+            close_old_connections()
+            if stopping:
+                break
+        connections.close_all()
+
+    def stop(self, timeout=10):
+        """Stop accepting toggles and write the queued ones, waiting up to ``timeout`` seconds for the thread."""
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        else:
+            self.flush()
+
+
+selection_buffer = SelectionWriteBuffer()
+atexit.register(selection_buffer.stop)
+
+
+def queue_selection_toggle(user_id, product_id, selected):
+    """
+    Queue a select or deselect of ``product_id`` by ``user_id``.
+
+    Returns False, queueing nothing, when the queue is full. Only reads are
+    made. Raises Product.DoesNotExist or ProductSelection.DoesNotExist, like
+    the synchronous write would.
+    """
+    if selected and not Product.objects.filter(pk=product_id).exists():
+        raise Product.DoesNotExist
+    if not selected and product_id not in selection_buffer.pending_for(user_id) and not (
+            ProductSelection.objects.filter(user_id=user_id, product_id=product_id).exists()):
+        raise ProductSelection.DoesNotExist
+    return selection_buffer.add(user_id, product_id, selected)
+
+
+def overlay_selected_ids(user_id, selected_ids):
+    """``selected_ids`` of ``user_id`` with their queued toggles applied."""
+    pending = selection_buffer.pending_for(user_id)
+    if not pending:
+        return selected_ids
+    selected = set(selected_ids)
+    for product_id, value in pending.items():
+        if value:
+            selected.add(product_id)
+        else:
+            selected.discard(product_id)
+    return sorted(selected)
+
+
+def overlay_user_products(user_id, rows, last_page):
+    """
+    Apply the queued toggles of ``user_id`` to a page of UserProductSelectionSerializer ``rows``.
+
+    Toggles of products that have no selection row yet are appended to the
+    last page, where the rows will land once they are written. Costs two
+    queries, and only while the user has toggles queued.
+    """
+    pending = selection_buffer.pending_for(user_id)
+    if not pending:
+        return rows
+    rows = [dict(row, selected=pending[row['product']['id']]) if row['product']['id'] in pending else row
+            for row in rows]
+    if last_page:
+        stored = set(ProductSelection.objects.filter(user_id=user_id, product_id__in=pending)
+                     .values_list('product_id', flat=True))
+        new = [product_id for product_id in pending if product_id not in stored]
+        products = Product.objects.only(*ProductSerializer.Meta.fields).in_bulk(new) if new else {}
+        rows += [dict(user=user_id, product=ProductSerializer(products[product_id]).data, selected=pending[product_id])
+                 for product_id in new if product_id in products]
+    return rows